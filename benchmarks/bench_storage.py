@@ -0,0 +1,370 @@
+"""
+Benchmark riproducibile di storage, indice e costruzione delle statistiche.
+
+Genera storici sintetici (1, 10 e 30 anni di letture giornaliere, più una variante semioraria)
+e misura per ciascuno: salvataggio completo, caricamento (completo e dal solo riepilogo),
+configurazione della entry (async_load del coordinatore, con riepilogo aggiornato e non aggiornato),
+aggiunta di una lettura, interrogazione del mese corrente, ricalcolo dei valori dei sensori,
+aggiornamento incrementale e ricostruzione degli accumulatori di medie e previsione, costruzione delle righe statistiche e invio completo a blocchi mensili.
+Il Recorder è sostituito da fakes.py e la configurazione usa un core di HA in memoria: il benchmark gira offline.
+
+Il risultato è un JSON (stdout o --output) confrontabile tra esecuzioni diverse:
+per ogni misura vengono riportati minimo, mediana e massimo in millisecondi.
+
+Esempi:
+    python benchmarks/bench_storage.py
+    python benchmarks/bench_storage.py --years 1 10 --repeat 5 --output risultati.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics as stats_mod
+import subprocess
+import sys
+import time
+from array import array
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+from fakes import REPO_ROOT, FakeHass, StatisticsCollector
+
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+
+from custom_components.octopus_energy_adapter import statistics
+from custom_components.octopus_energy_adapter.aggregates import RollingAggregates
+from custom_components.octopus_energy_adapter.const import (
+    STORAGE_FORMAT_BINARY,
+    STORAGE_FORMAT_JOURNAL,
+    STORAGE_FORMAT_JSON,
+)
+from custom_components.octopus_energy_adapter.coordinator import OctopusCoordinator
+from custom_components.octopus_energy_adapter.index import HistoryIndex
+from custom_components.octopus_energy_adapter.metrics import NULL_METRICS
+from custom_components.octopus_energy_adapter.prices import PriceHistory
+from custom_components.octopus_energy_adapter.storage import (
+    IntervalHistory,
+    append_binary_sync,
+    append_intervals_sync,
+    append_journal_sync,
+    build_summary,
+    compact_journal_sync,
+    history_checksum,
+    load_history_sync,
+    load_intervals_sync,
+    load_summary_sync,
+    save_binary_sync,
+    save_data_sync,
+    save_intervals_sync,
+    save_summary_sync,
+    summary_index,
+)
+
+# Ultimo giorno degli storici sintetici: ieri, come per un contatore reale (i sensori calcolano i periodi
+# rispetto a oggi). I valori sono generati con un seme fisso, quindi le esecuzioni restano confrontabili.
+END_DATE = date.today() - timedelta(days=1)
+SEED = 42
+TIME_ZONE = "Europe/Rome"
+ENTRY_ID = "benchmark"
+FORMATS = (STORAGE_FORMAT_JSON, STORAGE_FORMAT_JOURNAL, STORAGE_FORMAT_BINARY)
+
+def daily_kwh(rng, day):
+    """Consumo sintetico del giorno: stagionalità annuale (più alto d'inverno) più rumore."""
+    season = math.cos(2 * math.pi * (day.timetuple().tm_yday - 15) / 365.25)
+    return max(0.0, rng.gauss(9.0 + 4.0 * season, 1.5))
+
+def make_daily_history(years, rng):
+    """Storico giornaliero {data ISO: cumulativo} di 'years' anni fino a END_DATE."""
+    data = {}
+    total = 0.0
+    day = END_DATE - timedelta(days=round(365.25 * years) - 1)
+    while day <= END_DATE:
+        total = round(total + daily_kwh(rng, day), 3)
+        data[day.isoformat()] = total
+        day += timedelta(days=1)
+    return data
+
+def make_intervals(years, slot_minutes, rng):
+    """Array (slot, kWh) semiorari di 'years' anni fino a END_DATE, con il profilo giornaliero tipico."""
+    slot_seconds = slot_minutes * 60
+    start = dt_util.start_of_local_day(END_DATE - timedelta(days=round(365.25 * years) - 1))
+    end = dt_util.start_of_local_day(END_DATE + timedelta(days=1))
+    first = int(start.timestamp()) // slot_seconds
+    count = (int(end.timestamp()) - int(start.timestamp())) // slot_seconds
+    slots = array('d', (float(first + k) for k in range(count)))
+    values = array('d')
+    for k in range(count):
+        hour = (k * slot_minutes / 60) % 24
+        # Picchi al mattino e alla sera, consumo di base la notte.
+        profile = 0.08 + 0.25 * math.exp(-((hour - 8) ** 2) / 4) + 0.4 * math.exp(-((hour - 20) ** 2) / 6)
+        values.append(round(max(0.0, rng.gauss(profile, 0.05)) * slot_minutes / 30, 3))
+    return slots, values
+
+def make_prices():
+    """Prezzi con un cambio per trimestre negli ultimi 30 anni: il costo usa davvero la funzione a gradini."""
+    prices = PriceHistory(None)
+    points = []
+    day = date(END_DATE.year - 31, 1, 1)
+    rng = random.Random(SEED)
+    while day <= END_DATE:
+        points.append([day.isoformat(), round(rng.uniform(0.15, 0.45), 4)])
+        day = (day + timedelta(days=92)).replace(day=1)
+    prices._set_points(points)
+    return prices
+
+def timing_summary(timings):
+    return {
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(stats_mod.median(timings), 3),
+        "max_ms": round(max(timings), 3),
+    }
+
+def measure(func, repeat, setup=None):
+    """Esegue func 'repeat' volte (con setup facoltativo non misurato) e restituisce i tempi in ms e l'ultimo risultato."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timing_summary(timings), result
+
+def measure_setup(hass, storage_format, repeat):
+    """
+    Configurazione della entry: async_load di un coordinatore nuovo su un core di HA in memoria (senza avvio:
+    il lavoro differito a EVENT_HOMEASSISTANT_STARTED non fa parte della configurazione).
+    Restituisce i tempi in ms e se il riepilogo letto era non aggiornato (valori provvisori).
+    """
+    entry = SimpleNamespace(entry_id=ENTRY_ID, data={
+        "data_sensor": "sensor.benchmark_date", "value_sensor": "sensor.benchmark_kwh",
+        "price_type": "Fisso", "fixed_price": 0.25, "storage_format": storage_format,
+    })
+
+    async def setup_once():
+        core = HomeAssistant(hass.config.config_dir)
+        coordinator = OctopusCoordinator(core, entry)
+        start = time.perf_counter()
+        await coordinator.async_load()
+        elapsed = (time.perf_counter() - start) * 1000
+        stale = coordinator.history.stale
+        await coordinator.async_stop()
+        return elapsed, stale
+
+    timings = []
+    stale = None
+    for _ in range(repeat):
+        elapsed, stale = asyncio.run(setup_once())
+        timings.append(elapsed)
+    return timing_summary(timings), stale
+
+def file_size(hass, filename):
+    path = hass.config.path(os.path.dirname(filename), ENTRY_ID, os.path.basename(filename))
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def bench_daily(years, storage_format, prices, collector, repeat):
+    """Misure di uno storico giornaliero di 'years' anni nel formato indicato."""
+    from custom_components.octopus_energy_adapter import storage
+
+    rng = random.Random(SEED + years)
+    data = make_daily_history(years, rng)
+    hass = FakeHass()
+    result = {"scenario": f"daily_{years}y", "format": storage_format, "records": len(data)}
+
+    try:
+        # Salvataggio completo nel formato configurato (snapshot JSON, compattazione del journal o file binario).
+        if storage_format == STORAGE_FORMAT_BINARY:
+            save = lambda: save_binary_sync(hass, data, ENTRY_ID)
+            data_file = storage.BINARY_FILE
+        elif storage_format == STORAGE_FORMAT_JOURNAL:
+            save = lambda: compact_journal_sync(hass, data, ENTRY_ID)
+            data_file = storage.STORAGE_FILE
+        else:
+            save = lambda: save_data_sync(hass, data, ENTRY_ID)
+            data_file = storage.STORAGE_FILE
+        result["save_full"], _ = measure(save, repeat)
+        result["bytes_on_disk"] = file_size(hass, data_file)
+
+        # Caricamento completo: lettura, conversione e costruzione dell'indice (dal binario solo la mappatura delle colonne).
+        def load_full():
+            loaded = load_history_sync(hass, storage_format, ENTRY_ID)
+            if loaded[3] is not None:
+                loaded[3].close()
+            return loaded
+        result["load_full"], _ = measure(load_full, repeat)
+        # Indice in memoria per riepilogo e interrogazioni (quello del file binario mappato è già chiuso).
+        index = HistoryIndex.from_data(data)
+        result["checksum"], _ = measure(lambda: history_checksum(data), repeat)
+
+        # Avvio tipico: solo il riepilogo (ultima lettura, aperture dei mesi, ultimi giorni).
+        summary = build_summary(index, history_checksum(data), storage_format)
+        save_summary_sync(hass, summary, ENTRY_ID)
+        result["load_summary"], _ = measure(lambda: summary_index(load_summary_sync(hass, ENTRY_ID)), repeat)
+        result["summary_bytes"] = file_size(hass, storage.SUMMARY_FILE)
+        # Configurazione della entry con riepilogo aggiornato (riavvio tipico): deve restare costante al crescere dello storico.
+        result["setup"], _ = measure_setup(hass, storage_format, repeat)
+
+        # Aggiunta di una lettura: una riga accodata (journal), un record (binario) o l'intero file (JSON).
+        next_day = [END_DATE]
+        last_total = [data[END_DATE.isoformat()]]
+
+        def next_entry():
+            next_day[0] += timedelta(days=1)
+            last_total[0] = round(last_total[0] + 10.0, 3)
+            return next_day[0].isoformat(), last_total[0]
+
+        if storage_format == STORAGE_FORMAT_BINARY:
+            append = lambda: append_binary_sync(hass, [next_entry()], ENTRY_ID)
+        elif storage_format == STORAGE_FORMAT_JOURNAL:
+            append = lambda: append_journal_sync(hass, [next_entry()], ENTRY_ID)
+        else:
+            def append():
+                date_str, value = next_entry()
+                data[date_str] = value
+                return save_data_sync(hass, data, ENTRY_ID)
+        result["append_day"], _ = measure(append, repeat)
+
+        # I file sono cambiati dopo l'ultimo riepilogo: la configurazione usa il riepilogo come ultimo stato noto
+        # e il caricamento completo passa in background. Anche questo tempo non deve dipendere dallo storico.
+        result["setup_stale_summary"], stale = measure_setup(hass, storage_format, repeat)
+        result["setup_stale_detected"] = stale
+
+        # Interrogazioni dei sensori sull'indice completo (il formato non conta: una volta sola basta).
+        if storage_format == STORAGE_FORMAT_JSON:
+            result["month_to_date"], _ = measure(lambda: index.month_to_date(END_DATE), repeat)
+            aggregates = RollingAggregates()
+            # Ricostruzione esatta (correzioni retroattive) contro un giorno nuovo accumulato in O(1).
+            result["aggregates_rebuild"], _ = measure(lambda: aggregates.rebuild(index, prices), repeat)
+            next_day = iter(range(aggregates.last + 1, aggregates.last + 1 + repeat))
+            result["aggregates_add_day"], _ = measure(
+                lambda: aggregates.add(date.fromordinal(next(next_day)), 10.0, index, prices), repeat
+            )
+            coordinator = SimpleNamespace(
+                history=SimpleNamespace(index=index, stale=False), prices=prices, rolling_days=30, metrics=NULL_METRICS,
+                aggregates=aggregates, current_price=0.25,
+            )
+            result["compute_sensors"], _ = measure(lambda: OctopusCoordinator._compute(coordinator), repeat)
+
+            sorted_dates = sorted(data)
+            result["build_statistics_rows"], rows = measure(
+                lambda: statistics._build_statistics_rows(data, sorted_dates, prices), repeat
+            )
+            result["statistics_rows"] = len(rows[0]) + len(rows[1])
+
+            def push_all():
+                collector.reset()
+                asyncio.run(statistics.push_bulk_statistics_chunked(None, data, prices, log_interval=float("inf"), entry_id=ENTRY_ID))
+                return collector.calls
+            result["push_bulk_statistics_chunked"], calls = measure(push_all, repeat)
+            result["recorder_calls"] = calls
+    finally:
+        shutil.rmtree(hass.config.config_dir, ignore_errors=True)
+    return result
+
+def bench_intervals(years, slot_minutes, prices, collector, repeat):
+    """Misure della variante a intervalli (file binario degli slot e statistiche orarie)."""
+    rng = random.Random(SEED + 1000 + years)
+    slots, values = make_intervals(years, slot_minutes, rng)
+    hass = FakeHass()
+    result = {"scenario": f"interval_{slot_minutes}min_{years}y", "format": "intervals", "records": len(slots)}
+
+    try:
+        result["save_full"], _ = measure(lambda: save_intervals_sync(hass, slot_minutes, slots, values, ENTRY_ID), repeat)
+        result["load_full"], loaded = measure(lambda: load_intervals_sync(hass, slot_minutes, ENTRY_ID), repeat)
+
+        next_slot = [slots[-1]]
+
+        def append():
+            next_slot[0] += 1
+            return append_intervals_sync(hass, slot_minutes, [(next_slot[0], 0.2)], ENTRY_ID)
+        result["append_interval"], _ = measure(append, repeat)
+
+        intervals = IntervalHistory(hass, ENTRY_ID, slot_minutes)
+        intervals.slots, intervals.values = slots, values
+        result["day_total"], _ = measure(lambda: intervals.day_total(END_DATE), repeat)
+
+        # Storico giornaliero derivato dagli intervalli, come lo mantiene il coordinatore.
+        data = {}
+        total = 0.0
+        day = intervals.first_date()
+        while day <= END_DATE:
+            total = round(total + intervals.day_total(day), 3)
+            data[day.isoformat()] = total
+            day += timedelta(days=1)
+
+        result["build_interval_rows"], rows = measure(
+            lambda: statistics._build_interval_rows(intervals, 0, len(intervals), prices), repeat
+        )
+        result["statistics_rows"] = len(rows[0]) + len(rows[1])
+
+        def push_all():
+            collector.reset()
+            asyncio.run(statistics.push_interval_statistics_chunked(
+                None, data, intervals, prices, log_interval=float("inf"), entry_id=ENTRY_ID
+            ))
+            return collector.calls
+        result["push_interval_statistics_chunked"], calls = measure(push_all, repeat)
+        result["recorder_calls"] = calls
+    finally:
+        shutil.rmtree(hass.config.config_dir, ignore_errors=True)
+    return result
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di storage, indice e statistiche di Octopus Energy Adapter")
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 10, 30], help="Anni degli storici giornalieri")
+    parser.add_argument("--interval-years", type=int, nargs="*", default=[1], help="Anni della variante a intervalli")
+    parser.add_argument("--slot-minutes", type=int, default=30, help="Durata degli intervalli (30 o 60 minuti)")
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=FORMATS, help="Formati di salvataggio")
+    parser.add_argument("--repeat", type=int, default=3, help="Ripetizioni di ogni misura")
+    parser.add_argument("--output", help="File JSON dei risultati (default: stdout)")
+    args = parser.parse_args(argv)
+
+    dt_util.set_default_time_zone(dt_util.get_time_zone(TIME_ZONE))
+    collector = StatisticsCollector().install()
+    prices = make_prices()
+
+    results = []
+    for years in args.years:
+        for storage_format in args.formats:
+            results.append(bench_daily(years, storage_format, prices, collector, args.repeat))
+            print(f"{results[-1]['scenario']} {storage_format}: completato", file=sys.stderr)
+    for years in args.interval_years:
+        results.append(bench_intervals(years, args.slot_minutes, prices, collector, args.repeat))
+        print(f"{results[-1]['scenario']}: completato", file=sys.stderr)
+
+    report = {
+        "benchmark": "storage",
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": statistics.np is not None,
+        "repeat": args.repeat,
+        "seed": SEED,
+        "end_date": END_DATE.isoformat(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
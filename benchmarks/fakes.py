@@ -0,0 +1,110 @@
+"""
+Sostituti locali e leggeri di Home Assistant per i benchmark: permettono di eseguire le funzioni
+dell'integrazione senza un'istanza di HA, senza Recorder e senza rete.
+Solo le parti realmente usate dal codice misurato sono riprodotte.
+"""
+
+import os
+import sys
+import tempfile
+
+# I benchmark importano l'integrazione direttamente dal repository (custom_components/...).
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+class FakeConfig:
+    """Equivalente minimo di hass.config: cartella di configurazione e path()."""
+
+    def __init__(self, config_dir):
+        self.config_dir = config_dir
+
+    def path(self, *parts):
+        return os.path.join(self.config_dir, *parts)
+
+class FakeHass:
+    """
+    Sostituto di 'hass' per le funzioni sincrone di storage e per la costruzione delle statistiche.
+    La cartella di configurazione è temporanea (viene creata se non indicata).
+    """
+
+    def __init__(self, config_dir=None):
+        self.config = FakeConfig(config_dir or tempfile.mkdtemp(prefix="octopus_bench_"))
+        self.data = {}
+
+class FakeRecorder:
+    """
+    Sostituto in memoria del Recorder: coda sempre vuota per la contropressione delle statistiche e,
+    se creato con 'hass', registro degli stati cambiati per le interrogazioni della cronologia
+    usate dal recupero dei giorni mancanti (nessun database).
+    """
+
+    backlog = 0
+    keep_days = 10
+
+    def __init__(self, hass=None):
+        self.hass = hass
+        self.states = {}
+        if hass is not None:
+            from homeassistant.const import EVENT_STATE_CHANGED
+
+            hass.bus.async_listen(EVENT_STATE_CHANGED, self._async_on_state_changed)
+
+    def _async_on_state_changed(self, event):
+        new_state = event.data.get("new_state")
+        if new_state is not None:
+            self.states.setdefault(event.data["entity_id"], []).append(new_state)
+
+    async def async_add_executor_job(self, func, *args):
+        return await self.hass.async_add_executor_job(func, *args)
+
+    def get_significant_states(self, hass, start_time, end_time=None, entity_ids=None, include_start_time_state=True, **kwargs):
+        """Stessa forma di recorder.history.get_significant_states, con lo stato in vigore a start_time."""
+        result = {}
+        for entity_id in entity_ids or self.states:
+            states = self.states.get(entity_id, [])
+            selected = [
+                s for s in states
+                if s.last_updated >= start_time and (end_time is None or s.last_updated < end_time)
+            ]
+            if include_start_time_state:
+                before = [s for s in states if s.last_updated < start_time]
+                selected = before[-1:] + selected
+            if selected:
+                result[entity_id] = selected
+        return result
+
+    def install(self):
+        """Sostituisce il Recorder nei moduli dell'integrazione che lo interrogano."""
+        from custom_components.octopus_energy_adapter import backfill, statistics
+
+        statistics.get_instance = lambda hass: self
+        backfill.get_instance = lambda hass: self
+        backfill.get_significant_states = self.get_significant_states
+        return self
+
+class StatisticsCollector:
+    """
+    Sostituto di async_add_external_statistics: conta chiamate e righe ricevute invece di scriverle nel database.
+    install() lo aggancia al modulo statistics dell'integrazione insieme a un Recorder fittizio.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+
+    def __call__(self, hass, metadata, rows):
+        self.calls += 1
+        self.rows += len(rows)
+
+    def reset(self):
+        self.calls = 0
+        self.rows = 0
+
+    def install(self, recorder=None):
+        """Aggancia il raccoglitore e il Recorder indicato (o uno vuoto) ai moduli dell'integrazione."""
+        from custom_components.octopus_energy_adapter import statistics
+
+        statistics.async_add_external_statistics = self
+        (recorder or FakeRecorder()).install()
+        return self
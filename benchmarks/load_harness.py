@@ -0,0 +1,334 @@
+"""
+Harness di carico e concorrenza: N entry (contatori) nella stessa istanza.
+
+Avvia il core di Home Assistant in memoria (macchina degli stati e bus degli eventi reali, nessun server HTTP)
+con un Recorder fittizio (fakes.FakeRecorder), configura N entry passando da async_setup_entry durante
+l'avvio simulato di HA (tempo di configurazione), invia EVENT_HOMEASSISTANT_STARTED e attende il lavoro
+differito delle entry (caricamento, recupero e sincronizzazione delle statistiche in background), poi simula
+le pubblicazioni di Octopus: a ogni giro tutti i sensori data/valore cambiano nello stesso istante,
+poi cambia il sensore di prezzo condiviso. Per ogni giro misura la latenza dal cambio della sorgente
+all'aggiornamento dello stato di ogni sensore 'Octopus Costo Mensile'.
+
+Durante tutta l'esecuzione vengono inoltre registrati:
+- blocco del loop di eventi (ritardo massimo e totale di un timer da pochi millisecondi);
+- profondità massima delle code degli esecutori (pool di HA e thread di I/O delle entry);
+- file scritti nella cartella dei dati per evento sorgente (salvataggi differiti e scarico finale compresi).
+
+Il risultato è un JSON (stdout o --output). Il codice di uscita è 1 se il 95° percentile della latenza
+supera il budget (--budget-ms), così l'harness può essere usato come controllo in CI.
+
+Esempi:
+    python benchmarks/load_harness.py --entries 30
+    python benchmarks/load_harness.py --entries 50 --rounds 5 --budget-ms 4000 --output carico.json
+"""
+
+import argparse
+import asyncio
+import builtins
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics as stats_mod
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from fakes import REPO_ROOT, FakeRecorder, StatisticsCollector
+
+from homeassistant import config_entries, loader
+from homeassistant.const import EVENT_HOMEASSISTANT_STARTED, EVENT_STATE_CHANGED
+from homeassistant.core import CoreState, HomeAssistant
+from homeassistant.helpers import entity_registry as er
+from homeassistant.setup import async_setup_component
+
+from custom_components.octopus_energy_adapter.const import DOMAIN
+from custom_components.octopus_energy_adapter.coordinator import INGEST_COALESCE_DELAY
+from custom_components.octopus_energy_adapter.storage import SAVE_DELAY
+
+TIME_ZONE = "Europe/Rome"
+PRICE_SENSOR = "sensor.harness_price"
+# Periodo del timer che misura il blocco del loop (secondi)
+LAG_PROBE_INTERVAL = 0.005
+# Attesa massima dell'aggiornamento di tutti i sensori dopo un evento (secondi)
+ROUND_TIMEOUT = 30
+
+class WriteCounter:
+    """Conta i file aperti in scrittura sotto una cartella (sostituisce temporaneamente builtins.open)."""
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._open = builtins.open
+
+    def __enter__(self):
+        original = self._open
+
+        def counting_open(file, mode="r", *args, **kwargs):
+            if isinstance(file, (str, bytes, os.PathLike)) and any(c in mode for c in "wa+"):
+                if os.path.realpath(os.fsdecode(file)).startswith(self.root):
+                    with self._lock:
+                        self.writes += 1
+            return original(file, mode, *args, **kwargs)
+
+        builtins.open = counting_open
+        return self
+
+    def __exit__(self, *exc):
+        builtins.open = self._open
+
+class LoopMonitor:
+    """Timer periodico sul loop: il ritardo rispetto al periodo atteso è il tempo in cui il loop era bloccato."""
+
+    def __init__(self, hass):
+        self.hass = hass
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.max_queue = 0
+        self._task = None
+
+    def queue_depth(self):
+        """Lavori in attesa negli esecutori: pool condiviso del loop e thread di I/O di ogni entry."""
+        executors = [getattr(self.hass.loop, "_default_executor", None)]
+        executors += [coordinator.io._executor for coordinator in self.hass.data.get(DOMAIN, {}).values()]
+        return sum(executor._work_queue.qsize() for executor in executors if executor is not None)
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            lag = time.perf_counter() - start - LAG_PROBE_INTERVAL
+            if lag > 0:
+                self.total_lag += lag
+                self.max_lag = max(self.max_lag, lag)
+            self.max_queue = max(self.max_queue, self.queue_depth())
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+def set_core_state(hass, state):
+    hass.set_state(state) if hasattr(hass, "set_state") else setattr(hass, "state", state)
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def latency_summary(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 1) if latencies else None,
+        "max_ms": round(max(latencies), 1) if latencies else None,
+        "mean_ms": round(stats_mod.mean(latencies), 1) if latencies else None,
+    }
+
+def write_history(config_dir, entry_id, days, today):
+    """Storico sintetico della entry fino all'altro ieri (formato JSON, letto da qualsiasi formato configurato)."""
+    folder = os.path.join(config_dir, "octopus_data", entry_id)
+    os.makedirs(folder, exist_ok=True)
+    data = {}
+    total = 0.0
+    for k in range(days, 1, -1):
+        total = round(total + 8.0 + (k % 7) * 0.5, 3)
+        data[(today - timedelta(days=k)).isoformat()] = total
+    with open(os.path.join(folder, "octopus_energy.json"), "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+async def async_start_hass(config_dir):
+    """Core di HA in memoria con l'integrazione caricabile dalla cartella custom_components del repository."""
+    os.symlink(os.path.join(REPO_ROOT, "custom_components"), os.path.join(config_dir, "custom_components"))
+    hass = HomeAssistant(config_dir)
+    hass.config.set_time_zone(TIME_ZONE)
+    hass.config.skip_pip = True
+    loader.async_setup(hass)
+    from homeassistant import bootstrap
+
+    hass.config_entries = config_entries.ConfigEntries(hass, {})
+    await bootstrap.async_load_base_functionality(hass)
+    set_core_state(hass, CoreState.running)
+    assert await async_setup_component(hass, "homeassistant", {})
+    # Dipendenze del manifest sostituite: nessun server HTTP (solo la registrazione della vista) né database.
+    hass.config.components.update({"http", "recorder"})
+    hass.http = SimpleNamespace(register_view=lambda view: None)
+    return hass
+
+async def async_run(args):
+    config_dir = tempfile.mkdtemp(prefix="octopus_harness_")
+    hass = await async_start_hass(config_dir)
+    recorder = FakeRecorder(hass)
+    collector = StatisticsCollector().install(recorder)
+    today = date.today()
+
+    hass.states.async_set(PRICE_SENSOR, "0.25")
+    entries = []
+    for i in range(args.entries):
+        date_sensor, value_sensor = f"sensor.harness_date_{i}", f"sensor.harness_kwh_{i}"
+        hass.states.async_set(date_sensor, "unknown")
+        hass.states.async_set(value_sensor, "unknown")
+        entry = config_entries.ConfigEntry(
+            version=2, minor_version=1, domain=DOMAIN, title=f"Contatore {i}", source="user", options={},
+            data={
+                "data_sensor": date_sensor, "value_sensor": value_sensor, "price_type": "Sensore",
+                "price_sensor": PRICE_SENSOR, "fixed_price": 0.0, "storage_format": args.format,
+                # Nessun limite tra due cambi di prezzo: ogni giro ne misura la latenza completa.
+                "price_min_interval": 0,
+            },
+        )
+        write_history(config_dir, entry.entry_id, args.history_days, today)
+        entries.append((entry, date_sensor, value_sensor))
+
+    monitor = LoopMonitor(hass)
+    monitor.start()
+    with WriteCounter(os.path.join(config_dir, "octopus_data")) as writes:
+        # Configurazione di tutte le entry (async_setup_entry di ognuna tramite il gestore delle config entry)
+        # con HA ancora in avvio, come al boot: il lavoro proporzionale allo storico deve restarne fuori.
+        set_core_state(hass, CoreState.starting)
+        setup_start = time.perf_counter()
+        for entry, _, _ in entries:
+            await hass.config_entries.async_add(entry)
+        await hass.async_block_till_done()
+        setup_ms = (time.perf_counter() - setup_start) * 1000
+
+        # Avvio completato: parte il lavoro differito di ogni entry, in background.
+        startup_start = time.perf_counter()
+        set_core_state(hass, CoreState.running)
+        hass.bus.async_fire(EVENT_HOMEASSISTANT_STARTED)
+        await hass.async_block_till_done()
+        await asyncio.gather(*(
+            coordinator._startup_task for coordinator in hass.data[DOMAIN].values()
+            if coordinator._startup_task is not None
+        ))
+        startup_background_ms = (time.perf_counter() - startup_start) * 1000
+        setup_writes = writes.writes
+
+        registry = er.async_get(hass)
+        cost_entities = {
+            registry.async_get_entity_id("sensor", DOMAIN, f"octopus_monthly_cost_{entry.entry_id}"): entry.entry_id
+            for entry, _, _ in entries
+        }
+
+        pending = {}
+        latencies = {"reading": [], "price": []}
+
+        def on_state_changed(event):
+            entity_id = event.data["entity_id"]
+            if entity_id in pending:
+                kind, started = pending.pop(entity_id)
+                latencies[kind].append((time.perf_counter() - started) * 1000)
+                if not pending:
+                    done.set()
+
+        hass.bus.async_listen(EVENT_STATE_CHANGED, on_state_changed)
+        timeouts = 0
+        source_events = 0
+
+        for r in range(args.rounds):
+            # Pubblicazione sincronizzata: la lettura di oggi di tutti i contatori (valore diverso a ogni giro).
+            done = asyncio.Event()
+            started = time.perf_counter()
+            pending = {entity_id: ("reading", started) for entity_id in cost_entities}
+            for _, date_sensor, value_sensor in entries:
+                hass.states.async_set(date_sensor, today.strftime("%d/%m/%Y"))
+                hass.states.async_set(value_sensor, str(8.0 + r * 0.5))
+            source_events += len(entries)
+            try:
+                await asyncio.wait_for(done.wait(), ROUND_TIMEOUT)
+            except asyncio.TimeoutError:
+                timeouts += len(pending)
+
+            # Cambio del prezzo condiviso: tutti i costi mensili vengono ricalcolati.
+            done = asyncio.Event()
+            started = time.perf_counter()
+            pending = {entity_id: ("price", started) for entity_id in cost_entities}
+            hass.states.async_set(PRICE_SENSOR, str(round(0.25 + (r + 1) * 0.01, 4)))
+            source_events += 1
+            try:
+                await asyncio.wait_for(done.wait(), ROUND_TIMEOUT)
+            except asyncio.TimeoutError:
+                timeouts += len(pending)
+            await asyncio.sleep(args.interval)
+
+        # I salvataggi differiti scadono, poi lo scarico finale delle entry.
+        await asyncio.sleep(SAVE_DELAY + 1)
+        for entry, _, _ in entries:
+            await hass.config_entries.async_unload(entry.entry_id)
+        await hass.async_block_till_done()
+        event_writes = writes.writes - setup_writes
+
+    monitor.stop()
+    await hass.async_stop()
+    shutil.rmtree(config_dir, ignore_errors=True)
+
+    reading = latency_summary(latencies["reading"])
+    passed = timeouts == 0 and reading["p95_ms"] is not None and reading["p95_ms"] <= args.budget_ms
+    return {
+        "benchmark": "load",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "entries": args.entries,
+        "rounds": args.rounds,
+        "format": args.format,
+        "history_days": args.history_days,
+        "setup_ms": round(setup_ms, 1),
+        "setup_ms_per_entry": round(setup_ms / args.entries, 2),
+        "startup_background_ms": round(startup_background_ms, 1),
+        "reading_latency": reading,
+        "price_latency": latency_summary(latencies["price"]),
+        "ingest_coalesce_delay_ms": INGEST_COALESCE_DELAY * 1000,
+        "loop_max_lag_ms": round(monitor.max_lag * 1000, 2),
+        "loop_total_lag_ms": round(monitor.total_lag * 1000, 1),
+        "executor_max_queue": monitor.max_queue,
+        "source_events": source_events,
+        "file_writes_setup": setup_writes,
+        "file_writes": event_writes,
+        "file_writes_per_event": round(event_writes / source_events, 3) if source_events else None,
+        "recorder_calls": collector.calls,
+        "statistics_rows": collector.rows,
+        "timeouts": timeouts,
+        "budget_ms": args.budget_ms,
+        "passed": passed,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Harness di carico di Octopus Energy Adapter con N entry")
+    parser.add_argument("--entries", type=int, default=20, help="Numero di entry (contatori)")
+    parser.add_argument("--rounds", type=int, default=3, help="Giri di pubblicazione (lettura + prezzo)")
+    parser.add_argument("--interval", type=float, default=1.0, help="Pausa tra un giro e il successivo (secondi)")
+    parser.add_argument("--history-days", type=int, default=365, help="Giorni di storico di ogni entry")
+    parser.add_argument("--format", default="Journal", choices=("JSON", "Journal", "Binario"), help="Formato di salvataggio")
+    parser.add_argument(
+        "--budget-ms", type=float, default=INGEST_COALESCE_DELAY * 1000 + 1000,
+        help="Budget del 95° percentile della latenza lettura -> costo mensile (include l'attesa di accorpamento)",
+    )
+    parser.add_argument("--output", help="File JSON dei risultati (default: stdout)")
+    parser.add_argument("--verbose", action="store_true", help="Mostra i log dell'integrazione")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    report = asyncio.run(async_run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    status = "OK" if report["passed"] else "FALLITO"
+    print(
+        f"{status}: p95 latenza {report['reading_latency']['p95_ms']} ms (budget {args.budget_ms} ms), "
+        f"{report['timeouts']} aggiornamenti mancati",
+        file=sys.stderr,
+    )
+    return 0 if report["passed"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,9 +3,65 @@ Questo è il file principale dell'integrazione (Entry Point).
 Gestisce il ciclo di vita dell'integrazione: caricamento, aggiornamento delle opzioni e rimozione.
 """
 
+import asyncio
+import logging
+
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
-from .const import DOMAIN
+from homeassistant.helpers import config_validation as cv
+from .const import DOMAIN, CONF_LEGACY_STATISTICS, CONF_STORAGE_FORMAT, STORAGE_FORMAT_JOURNAL
+from .coordinator import OctopusCoordinator
+from .services import async_setup_services
+from .views import OctopusExportView
+from .prices import PRICES_FILE
+from .storage import (
+    STORAGE_FILE,
+    JOURNAL_FILE,
+    INTERVALS_FILE,
+    WATERMARK_FILE,
+    migrate_legacy_files_sync,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# L'integrazione si configura solo dall'interfaccia (nessuna chiave in configuration.yaml).
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+# Le migrazioni di più entry possono partire in parallelo: solo una deve ereditare i file condivisi.
+_MIGRATION_LOCK = asyncio.Lock()
+
+async def async_setup(hass: HomeAssistant, config) -> bool:
+    """Registra i servizi e la vista HTTP di esportazione, disponibili per tutte le entry."""
+    async_setup_services(hass)
+    hass.http.register_view(OctopusExportView)
+    return True
+
+async def async_migrate_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    """
+    Migrazione dalla versione 1 (file e statistiche condivisi da tutte le entry) alla versione 2
+    (file in octopus_data/<entry_id>/ e statistic_id con l'entry_id).
+    La prima entry migrata eredita lo storico esistente e continua a usare gli statistic_id condivisi
+    (il Recorder non permette di rinominare statistiche esterne), così grafici e Pannello Energia
+    restano collegati; le altre entry ripartono da uno storico vuoto con statistiche proprie.
+    Le entry migrate passano al formato journal: lo snapshot JSON esistente resta valido così com'è
+    e ogni nuova lettura accoda una riga invece di riscrivere l'intero file.
+    """
+    if entry.version == 1:
+        async with _MIGRATION_LOCK:
+            moved = await hass.async_add_executor_job(
+                migrate_legacy_files_sync,
+                hass,
+                entry.entry_id,
+                (STORAGE_FILE, JOURNAL_FILE, INTERVALS_FILE, WATERMARK_FILE, PRICES_FILE),
+            )
+            data = dict(entry.data)
+            data.setdefault(CONF_STORAGE_FORMAT, STORAGE_FORMAT_JOURNAL)
+            if moved:
+                _LOGGER.info(f"Storico Octopus condiviso assegnato alla entry {entry.entry_id}: {', '.join(moved)}")
+                data[CONF_LEGACY_STATISTICS] = True
+        hass.config_entries.async_update_entry(entry, data=data, version=2)
+
+    return True
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """
@@ -17,9 +73,14 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     # setdefault assicura che se DOMAIN non esiste nel dizionario globale hass.data, venga creato.
     hass.data.setdefault(DOMAIN, {})
     
-    # Memorizziamo i dati della configurazione (sensori scelti, prezzi, ecc.) 
-    # associandoli all'ID univoco di questa specifica installazione.
-    hass.data[DOMAIN][entry.entry_id] = entry.data
+    # Il coordinatore carica storico, prezzi e intervalli una sola volta: da qui in avanti i sensori
+    # mostrano i valori calcolati sulla copia in memoria e le scritture su disco vengono accorpate
+    # dal salvataggio differito.
+    coordinator = OctopusCoordinator(hass, entry)
+    await coordinator.async_load()
+
+    # Memorizziamo il coordinatore associandolo all'ID univoco di questa specifica installazione.
+    hass.data[DOMAIN][entry.entry_id] = coordinator
     
     # Registra un 'listener' (ascoltatore): se l'utente va nelle opzioni e cambia un sensore 
     # o il prezzo, viene chiamata automaticamente la funzione 'update_listener'.
@@ -30,6 +91,9 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     # Questo comando dice a HA di andare a cercare il file 'sensor.py' e di avviare il setup dei sensori.
     # Nelle versioni recenti di HA si usa async_forward_entry_setups (al plurale).
     await hass.config_entries.async_forward_entry_setups(entry, ["sensor"])
+
+    # Con i sensori pronti, il coordinatore inizia ad ascoltare le sorgenti.
+    coordinator.async_start()
     
     # Restituire True conferma a Home Assistant che l'integrazione è stata avviata con successo.
     return True
@@ -43,9 +107,11 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     # Comunica alla piattaforma 'sensor' di spegnersi e rimuovere le entità dalla dashboard.
     unload_ok = await hass.config_entries.async_forward_entry_unload(entry, "sensor")
     
-    # Se la disattivazione dei sensori è andata a buon fine, rimuoviamo i dati dalla memoria RAM.
+    # Se la disattivazione dei sensori è andata a buon fine, scarichiamo su disco le modifiche
+    # ancora pendenti e rimuoviamo i dati dalla memoria RAM.
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        coordinator = hass.data[DOMAIN].pop(entry.entry_id)
+        await coordinator.async_stop()
         
     return unload_ok
 
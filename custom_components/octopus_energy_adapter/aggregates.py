@@ -0,0 +1,177 @@
+"""
+Questo modulo contiene gli accumulatori incrementali dei sensori di media e previsione:
+consumo medio giornaliero sulle finestre mobili (7 e 30 giorni), consumo e costo del mese dell'ultima lettura,
+consumo dello stesso periodo dell'anno precedente e previsione di fine mese.
+Ogni giorno nuovo (o l'aggiornamento dell'ultimo giorno, es. con le letture a intervalli) costa O(1):
+niente riscansione dello storico ad ogni lettura. Solo le correzioni retroattive, i recuperi e le importazioni
+ricostruiscono gli accumulatori in modo esatto dall'indice, leggendo poche decine di giorni (vedi rebuild).
+Lo stato viene salvato nel riepilogo dello storico: al riavvio non serve alcuna ricostruzione.
+"""
+
+import calendar
+from collections import deque
+from datetime import date, timedelta
+
+# Finestre (giorni) delle medie giornaliere; la più lunga è anche quella usata per la previsione di fine mese
+AVERAGE_WINDOWS = (7, 30)
+
+def same_day_last_year(day):
+    """Stesso giorno dell'anno precedente (il 29 febbraio diventa il 28)."""
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:
+        return day.replace(year=day.year - 1, day=28)
+
+def month_end(day):
+    """Ultimo giorno del mese di 'day'."""
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+class RollingAggregates:
+    """
+    Accumulatori ancorati all'ultima lettura registrata (i dati Octopus arrivano con qualche giorno di ritardo):
+    le finestre contengono i giorni fino all'ultima lettura, il mese è quello dell'ultima lettura.
+    """
+
+    def __init__(self, windows=AVERAGE_WINDOWS):
+        self.windows = tuple(windows)
+        # Ordinale dell'ultimo giorno accumulato (None se non è stato accumulato nulla)
+        self.last = None
+        # Per ogni finestra: coppie (ordinale, kWh) dei giorni che vi rientrano e loro somma
+        self._days = {window: deque() for window in self.windows}
+        self._sums = {window: 0.0 for window in self.windows}
+        # Mese dell'ultima lettura (ordinale del primo giorno), consumo e costo dal primo giorno all'ultima lettura
+        # e consumo dello stesso periodo (dal primo del mese allo stesso giorno) dell'anno precedente
+        self.month = None
+        self.month_kwh = 0.0
+        self.month_cost = 0.0
+        self.last_year_kwh = 0.0
+        # False se lo storico non arriva all'inizio dello stesso periodo dell'anno precedente (nessun confronto)
+        self.last_year_known = False
+
+    def reset(self):
+        self.__init__(self.windows)
+
+    def add(self, day, kwh, index, prices):
+        """
+        Accumula il consumo 'kwh' del giorno 'day' in O(1) (più le ricerche binarie dell'anno precedente):
+        un giorno successivo all'ultimo entra nelle finestre facendone uscire i più vecchi, lo stesso giorno
+        dell'ultima lettura viene aggiornato della sola differenza.
+        'index' (HistoryIndex completo) serve per il consumo dell'anno precedente, 'prices' per il costo.
+        Restituisce False per un giorno precedente all'ultimo: gli accumulatori vanno ricostruiti (vedi rebuild).
+        """
+        ordinal = day.toordinal()
+        kwh = float(kwh)
+        if self.last is not None and ordinal < self.last:
+            return False
+
+        if ordinal == self.last:
+            previous = self._days[self.windows[0]][-1][1]
+            delta = kwh - previous
+            for window in self.windows:
+                self._days[window][-1] = (ordinal, kwh)
+                self._sums[window] += delta
+            self.month_kwh += delta
+            self.month_cost += delta * prices.price_on(ordinal)
+            return True
+
+        first = day.replace(day=1)
+        if self.month != first.toordinal():
+            self.month = first.toordinal()
+            self.month_kwh = self.month_cost = self.last_year_kwh = 0.0
+            start = same_day_last_year(first)
+            oldest = index.first()
+            self.last_year_known = oldest is not None and oldest[0] <= start.isoformat()
+        else:
+            # Giorni dell'anno precedente successivi a quelli già accumulati, fino al corrispondente di 'day'
+            # (anche quelli senza lettura quest'anno; il 29 febbraio non aggiunge nulla: è già il 28).
+            start = same_day_last_year(date.fromordinal(self.last)) + timedelta(days=1)
+        self.last_year_kwh += index.total_between(start, same_day_last_year(day))
+        self.month_kwh += kwh
+        self.month_cost += kwh * prices.price_on(ordinal)
+
+        for window in self.windows:
+            days = self._days[window]
+            days.append((ordinal, kwh))
+            self._sums[window] += kwh
+            while days[0][0] <= ordinal - window:
+                self._sums[window] -= days.popleft()[1]
+        self.last = ordinal
+        return True
+
+    def rebuild(self, index, prices):
+        """
+        Ricostruzione esatta dall'indice (storico completo): solo i giorni della finestra più lunga
+        e del mese dell'ultima lettura, con due ricerche binarie per l'anno precedente.
+        """
+        self.reset()
+        last = index.last()
+        if last is None:
+            return
+        last_day = date.fromisoformat(last[0])
+        start = min(last_day - timedelta(days=max(self.windows) - 1), last_day.replace(day=1))
+        for ordinal, kwh in index.daily_since(start):
+            self.add(date.fromordinal(ordinal), kwh, index, prices)
+
+    def average(self, window):
+        """Consumo medio giornaliero dei giorni registrati nella finestra (None senza letture)."""
+        days = self._days[window]
+        if not days:
+            return None
+        return round(self._sums[window] / len(days), 3)
+
+    def forecast(self, today, price):
+        """
+        Previsione (kWh, EUR) per il mese di 'today': consumo e costo già registrati più i giorni rimanenti
+        fino a fine mese stimati con la media della finestra più lunga, al prezzo 'price'.
+        Restituisce (None, None) senza letture nella finestra.
+        """
+        average = self.average(max(self.windows))
+        if average is None:
+            return None, None
+        first = today.replace(day=1).toordinal()
+        if self.month == first:
+            kwh, cost, last = self.month_kwh, self.month_cost, self.last
+        else:
+            # Nessuna lettura del mese corrente: l'intero mese è una stima.
+            kwh, cost, last = 0.0, 0.0, first - 1
+        remaining = max(0, month_end(today).toordinal() - last)
+        return round(kwh + average * remaining, 3), round(cost + average * remaining * price, 2)
+
+    def same_period_last_year(self, today):
+        """
+        Consumo dell'anno precedente nello stesso periodo del mese di 'today' coperto dalle letture.
+        None se non ci sono ancora letture del mese di 'today' o se lo storico non copre l'anno precedente.
+        """
+        if self.month != today.replace(day=1).toordinal() or not self.last_year_known:
+            return None
+        return round(self.last_year_kwh, 3)
+
+    def to_dict(self):
+        """Stato serializzabile, salvato nel riepilogo dello storico."""
+        longest = max(self.windows)
+        return {
+            "last": self.last,
+            "days": [list(pair) for pair in self._days[longest]],
+            "month": self.month,
+            "month_kwh": self.month_kwh,
+            "month_cost": self.month_cost,
+            "last_year_kwh": self.last_year_kwh,
+            "last_year_known": self.last_year_known,
+        }
+
+    def load(self, state):
+        """Ripristina lo stato salvato da to_dict(): le finestre più corte si ricavano dai giorni della più lunga."""
+        self.reset()
+        self.last = state.get("last")
+        if self.last is None:
+            return
+        for ordinal, kwh in state.get("days", []):
+            for window in self.windows:
+                if ordinal > self.last - window:
+                    self._days[window].append((int(ordinal), float(kwh)))
+                    self._sums[window] += float(kwh)
+        self.month = state.get("month")
+        self.month_kwh = float(state.get("month_kwh", 0.0))
+        self.month_cost = float(state.get("month_cost", 0.0))
+        self.last_year_kwh = float(state.get("last_year_kwh", 0.0))
+        self.last_year_known = bool(state.get("last_year_known", False))
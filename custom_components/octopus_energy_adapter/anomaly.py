@@ -0,0 +1,281 @@
+"""
+Questo modulo contiene il filtro adattivo delle letture anomale.
+Al posto di un limite fisso uguale per tutti (150 kWh), la soglia viene ricavata dalle ultime N letture
+accettate: mediana + sensibilità × dispersione, dove la dispersione è la MAD (deviazione assoluta mediana)
+riportata alla scala della deviazione standard. Un'abitazione piccola ottiene così una soglia stretta
+e un impianto grande una soglia ampia.
+Le letture della finestra sono tenute anche in una skip list indicizzabile (ordinata, con le larghezze dei
+collegamenti): inserimento e uscita di una lettura in O(log N) attesi, mediana in O(log N) e MAD in O(log² N)
+(k-esimo elemento di due sequenze ordinate di deviazioni, ogni accesso per posizione costa O(log N)),
+senza mai riscorrere lo storico né spostare gli elementi di una lista.
+Le letture sopra soglia finiscono in quarantena, in attesa di essere accettate o scartate dall'utente.
+"""
+
+import math
+import random
+from collections import deque
+
+from .const import MAX_READING_KWH
+
+# Fattore che rende la MAD una stima della deviazione standard per dati normali
+MAD_SCALE = 1.4826
+
+# Letture minime nella finestra prima di usare la soglia adattiva (prima vale il limite fisso MAX_READING_KWH)
+OUTLIER_MIN_SAMPLES = 7
+
+# Dispersione minima, relativa alla mediana e assoluta (kWh): consumi molto regolari (o intervalli quasi
+# sempre a zero) non devono produrre soglie così strette da mettere in quarantena un normale picco di utilizzo.
+OUTLIER_MIN_SCALE_RATIO = 0.1
+OUTLIER_MIN_SCALE_KWH = 1.0
+
+# Letture in quarantena conservate al massimo (le più vecchie vengono scartate)
+QUARANTINE_MAX = 50
+
+class _End:
+    """Sentinella di fine livello della skip list: maggiore di qualsiasi lettura."""
+
+    __slots__ = ()
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return False
+
+class _Node:
+    __slots__ = ("value", "next", "width")
+
+    def __init__(self, value, levels):
+        self.value = value
+        # Collegamento al nodo successivo e numero di posizioni scavalcate, per ogni livello
+        self.next = [None] * levels
+        self.width = [0] * levels
+
+_NIL = _Node(_End(), 0)
+
+class IndexableSkipList:
+    """
+    Sequenza ordinata con inserimento, rimozione, accesso per posizione e ricerca della posizione in O(log N) attesi.
+    Ogni collegamento conosce quante posizioni scavalca: l'accesso per posizione scende di livello in livello
+    sommando le larghezze, come una ricerca binaria. I livelli dei nodi sono casuali (generatore con seme fisso,
+    quindi riproducibile); il loro numero è dimensionato sulla finestra prevista.
+    """
+
+    def __init__(self, expected_size=100):
+        self.size = 0
+        self.levels = max(1, int(1 + math.log2(max(expected_size, 2))))
+        self._head = _Node(None, self.levels)
+        self._head.next = [_NIL] * self.levels
+        self._head.width = [1] * self.levels
+        self._random = random.Random(0)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        node = self._head
+        i += 1
+        for level in reversed(range(self.levels)):
+            while node.width[level] <= i:
+                i -= node.width[level]
+                node = node.next[level]
+        return node.value
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not _NIL:
+            yield node.value
+            node = node.next[0]
+
+    def bisect_left(self, value):
+        """Numero di elementi minori di 'value' (posizione di inserimento a sinistra)."""
+        node = self._head
+        position = 0
+        for level in reversed(range(self.levels)):
+            while node.next[level].value < value:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def insert(self, value):
+        chain = [None] * self.levels
+        steps = [0] * self.levels
+        node = self._head
+        for level in reversed(range(self.levels)):
+            while node.next[level].value <= value:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        # Livelli del nuovo nodo: ciascuno con probabilità 1/2 rispetto al precedente
+        height = min(self.levels, 1 - int(math.log2(1.0 - self._random.random())))
+        new = _Node(value, height)
+        distance = 0
+        for level in range(height):
+            previous = chain[level]
+            new.next[level] = previous.next[level]
+            previous.next[level] = new
+            new.width[level] = previous.width[level] - distance
+            previous.width[level] = distance + 1
+            distance += steps[level]
+        for level in range(height, self.levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, value):
+        """Rimuove un elemento uguale a 'value' (KeyError se non presente)."""
+        chain = [None] * self.levels
+        node = self._head
+        for level in reversed(range(self.levels)):
+            while node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target is _NIL or target.value != value:
+            raise KeyError(value)
+        for level in range(len(target.next)):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+        for level in range(len(target.next), self.levels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+class OutlierFilter:
+    """
+    Finestra mobile delle ultime 'window' letture accettate e quarantena delle letture sopra soglia.
+    Con sensibilità 0 il filtro è disattivato e resta solo il limite fisso.
+    """
+
+    def __init__(self, window, sensitivity, min_samples=OUTLIER_MIN_SAMPLES):
+        self.window = window
+        self.sensitivity = sensitivity
+        self.min_samples = min_samples
+        # Letture in ordine di arrivo (per sapere quale esce dalla finestra) e le stesse ordinate
+        self._recent = deque()
+        self._sorted = IndexableSkipList(window)
+        # Letture sospese: [{"reading": chiave, "kwh": valore, "threshold": soglia}, ...]
+        self.quarantine = []
+        # Letture scartate dall'utente {chiave: kWh}: se il sensore sorgente le ripropone non tornano in quarantena
+        self.rejected = {}
+
+    def __len__(self):
+        return len(self._recent)
+
+    def add(self, value):
+        """
+        Aggiunge una lettura accettata alla finestra, facendo uscire la più vecchia se la finestra è piena.
+        O(log N) attesi: nessuno spostamento di elementi.
+        """
+        value = float(value)
+        self._recent.append(value)
+        self._sorted.insert(value)
+        while len(self._recent) > self.window:
+            self._sorted.remove(self._recent.popleft())
+
+    def seed(self, values):
+        """Riempie la finestra con letture già accettate (es. dallo storico quando non c'è uno stato salvato)."""
+        for value in list(values)[-self.window:]:
+            self.add(value)
+
+    def median(self):
+        s = self._sorted
+        n = len(s)
+        return s[n // 2] if n % 2 else (s[n // 2 - 1] + s[n // 2]) / 2
+
+    def _deviation(self, k, m):
+        """
+        k-esima (da 0) deviazione assoluta dalla mediana m, in O(log² N): O(log N) passi di ricerca binaria, ciascuno con accessi per posizione in O(log N).
+        Le deviazioni formano due sequenze crescenti: m - x per i valori sotto m (letti all'indietro)
+        e x - m per gli altri; si cerca quanti elementi prendere dalla prima con una ricerca binaria.
+        """
+        s = self._sorted
+        split = s.bisect_left(m)
+        a_len, b_len = split, len(s) - split
+
+        def a(i):
+            return m - s[split - 1 - i]
+
+        def b(j):
+            return s[split + j] - m
+
+        lo, hi = max(0, k + 1 - b_len), min(k + 1, a_len)
+        while lo < hi:
+            i = (lo + hi) // 2
+            if a(i) < b(k - i):
+                lo = i + 1
+            else:
+                hi = i
+        i, j = lo, k + 1 - lo
+        return max(a(i - 1) if i else float("-inf"), b(j - 1) if j else float("-inf"))
+
+    def mad(self):
+        """Deviazione assoluta mediana della finestra."""
+        n = len(self._sorted)
+        m = self.median()
+        if n % 2:
+            return self._deviation(n // 2, m)
+        return (self._deviation(n // 2 - 1, m) + self._deviation(n // 2, m)) / 2
+
+    def threshold(self):
+        """Soglia corrente: adattiva se la finestra ha abbastanza letture, altrimenti il limite fisso."""
+        if not self.sensitivity or len(self._sorted) < self.min_samples:
+            return MAX_READING_KWH
+        m = self.median()
+        scale = max(MAD_SCALE * self.mad(), OUTLIER_MIN_SCALE_RATIO * m, OUTLIER_MIN_SCALE_KWH)
+        return m + self.sensitivity * scale
+
+    def quarantine_add(self, reading, kwh, threshold):
+        """
+        Mette in quarantena la lettura 'reading' (data o inizio dell'intervallo). Una lettura già presente
+        viene aggiornata. Restituisce False se era già in quarantena con lo stesso valore.
+        """
+        for entry in self.quarantine:
+            if entry["reading"] == reading:
+                if entry["kwh"] == kwh:
+                    return False
+                self.quarantine.remove(entry)
+                break
+        self.quarantine.append({"reading": reading, "kwh": kwh, "threshold": round(threshold, 3)})
+        del self.quarantine[:-QUARANTINE_MAX]
+        return True
+
+    def quarantine_pop(self, reading, reject=False):
+        """
+        Toglie dalla quarantena la lettura indicata e la restituisce (None se non c'è).
+        Con 'reject' la lettura viene ricordata come scartata.
+        """
+        for entry in self.quarantine:
+            if entry["reading"] == reading:
+                self.quarantine.remove(entry)
+                if reject:
+                    self.rejected[reading] = entry["kwh"]
+                    # Solo le ultime QUARANTINE_MAX (i dizionari mantengono l'ordine di inserimento).
+                    for key in list(self.rejected)[:-QUARANTINE_MAX]:
+                        del self.rejected[key]
+                return entry
+        return None
+
+    def is_rejected(self, reading, kwh):
+        """True se la stessa lettura (stessa chiave e stesso valore) è già stata scartata dall'utente."""
+        return self.rejected.get(reading) == kwh
+
+    def to_dict(self):
+        """Stato serializzabile, salvato nel riepilogo dello storico."""
+        return {
+            "window": list(self._recent),
+            "quarantine": [dict(entry) for entry in self.quarantine],
+            "rejected": dict(self.rejected),
+        }
+
+    def load(self, state):
+        """Ripristina lo stato salvato da to_dict()."""
+        self._recent.clear()
+        self._sorted = IndexableSkipList(self.window)
+        self.seed(state.get("window", []))
+        self.quarantine = [dict(entry) for entry in state.get("quarantine", [])][-QUARANTINE_MAX:]
+        self.rejected = dict(state.get("rejected", {}))
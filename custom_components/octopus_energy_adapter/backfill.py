@@ -0,0 +1,97 @@
+"""
+Questo modulo ricostruisce le letture giornaliere mancanti dallo storico del Recorder.
+I dati Octopus arrivano con 2-3 giorni di ritardo: se Home Assistant era spento o il sensore data
+ha saltato un giorno, la lettura di quel giorno non viene mai vista dal coordinatore.
+Gli stati registrati dei due sensori sorgente vengono letti con un'unica interrogazione per l'intero
+intervallo mancante e accoppiati (data, valore) come farebbe l'aggiornamento in tempo reale.
+"""
+
+import logging
+from datetime import timedelta
+from functools import partial
+
+from homeassistant.util import dt as dt_util
+
+_LOGGER = logging.getLogger(__name__)
+
+# Giorni massimi da recuperare se la conservazione del Recorder non è nota
+BACKFILL_DEFAULT_DAYS = 10
+
+# Il Recorder viene importato solo al primo recupero (dopo l'avvio di HA), non al caricamento dell'integrazione.
+def get_instance(hass):
+    from homeassistant.components.recorder import get_instance as recorder_instance
+
+    return recorder_instance(hass)
+
+def get_significant_states(*args, **kwargs):
+    from homeassistant.components.recorder import history
+
+    return history.get_significant_states(*args, **kwargs)
+
+def missing_days(index, start, end):
+    """
+    Giorni compresi tra start ed end (inclusi) che non hanno una lettura nell'indice.
+    Usa solo le letture da 'start' in avanti (disponibili anche dal riepilogo dello storico).
+    """
+    if end < start:
+        return []
+    present = {ordinal for ordinal, _ in index.records_since(start)}
+    return [
+        day for day in (start + timedelta(days=i) for i in range((end - start).days + 1))
+        if day.toordinal() not in present
+    ]
+
+def backfill_window(hass, today):
+    """Primo giorno recuperabile: gli stati più vecchi della conservazione del Recorder non esistono più."""
+    keep_days = getattr(get_instance(hass), "keep_days", None) or BACKFILL_DEFAULT_DAYS
+    return today - timedelta(days=keep_days)
+
+async def async_fetch_source_states(hass, entity_ids, start_time, end_time=None):
+    """
+    Stati registrati dei sensori sorgente tra start_time ed end_time, con una sola interrogazione
+    al Recorder per tutte le entità (eseguita sul thread del database, non sul loop).
+    Include lo stato in vigore all'inizio dell'intervallo.
+    """
+    states = await get_instance(hass).async_add_executor_job(
+        partial(
+            get_significant_states,
+            hass,
+            start_time,
+            end_time,
+            entity_ids,
+            include_start_time_state=True,
+            significant_changes_only=False,
+            no_attributes=True,
+        )
+    )
+    return {entity_id: states.get(entity_id, []) for entity_id in entity_ids}
+
+def pair_source_states(date_states, value_states, settle_seconds):
+    """
+    Ricostruisce le coppie (stato del sensore data, stato del sensore valore) dalla sequenza temporale
+    dei due sensori. Una coppia è valida solo se è rimasta stabile per almeno 'settle_seconds'
+    (o se è l'ultima): è la stessa finestra di accorpamento dell'aggiornamento in tempo reale, così un
+    sensore che cambia qualche istante prima dell'altro non produce coppie miste.
+    Per ogni stato del sensore data viene tenuto l'ultimo valore visto. Restituisce {stato data: stato valore}.
+    """
+    events = sorted(
+        [(s.last_updated, 0, s.state) for s in date_states] + [(s.last_updated, 1, s.state) for s in value_states],
+        key=lambda e: e[0],
+    )
+    pairs = {}
+    current = [None, None]
+    for i, (when, which, state) in enumerate(events):
+        current[which] = state
+        if i + 1 < len(events):
+            next_when = events[i + 1][0]
+            if next_when == when or (next_when - when).total_seconds() < settle_seconds:
+                continue
+        date_state, value_state = current
+        if date_state in (None, "unknown", "unavailable") or value_state in (None, "unknown", "unavailable"):
+            continue
+        pairs[date_state] = value_state
+    return pairs
+
+def start_of_day(day):
+    """Inizio (UTC) del giorno locale 'day', per delimitare l'interrogazione al Recorder."""
+    return dt_util.as_utc(dt_util.start_of_local_day(day))
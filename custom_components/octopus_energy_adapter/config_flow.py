@@ -14,8 +14,30 @@ from .const import (
     CONF_PRICE_TYPE, 
     CONF_FIXED_PRICE, 
     CONF_PRICE_SENSOR,
+    CONF_STORAGE_FORMAT,
+    CONF_ROLLING_DAYS,
+    CONF_INTERVAL_MODE,
+    CONF_PRICE_MIN_INTERVAL,
+    CONF_PRICE_MIN_DELTA,
+    CONF_RETENTION_MONTHS,
+    CONF_OUTLIER_SENSITIVITY,
+    CONF_OUTLIER_WINDOW,
+    CONF_DIAGNOSTIC_METRICS,
+    DEFAULT_ROLLING_DAYS,
+    DEFAULT_RETENTION_MONTHS,
+    DEFAULT_OUTLIER_SENSITIVITY,
+    DEFAULT_OUTLIER_WINDOW,
+    DEFAULT_DIAGNOSTIC_METRICS,
+    DEFAULT_PRICE_MIN_INTERVAL,
+    DEFAULT_PRICE_MIN_DELTA,
+    INTERVAL_DAILY,
+    INTERVAL_30,
+    INTERVAL_60,
     PRICE_TYPE_FIXED, 
-    PRICE_TYPE_SENSOR
+    PRICE_TYPE_SENSOR,
+    STORAGE_FORMAT_JSON,
+    STORAGE_FORMAT_JOURNAL,
+    STORAGE_FORMAT_BINARY,
 )
 
 class OctopusAdapterConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
@@ -23,7 +45,7 @@ class OctopusAdapterConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     Gestisce la prima installazione dell'integrazione.
     Viene attivato quando l'utente clicca su 'Aggiungi Integrazione'.
     """
-    VERSION = 1 # Versione dello schema dati (utile se in futuro cambiano i campi)
+    VERSION = 2 # Versione dello schema dati: la 2 salva storico e statistiche per entry (vedi async_migrate_entry)
 
     @staticmethod
     @callback
@@ -85,6 +107,32 @@ class OctopusAdapterConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 vol.Optional(CONF_PRICE_SENSOR): selector.EntitySelector(
                     selector.EntitySelectorConfig(domain="sensor")
                 ),
+                # Limitazione degli aggiornamenti per sensori di prezzo ad alta frequenza
+                vol.Optional(CONF_PRICE_MIN_INTERVAL, default=DEFAULT_PRICE_MIN_INTERVAL): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                vol.Optional(CONF_PRICE_MIN_DELTA, default=DEFAULT_PRICE_MIN_DELTA): vol.All(vol.Coerce(float), vol.Range(min=0)),
+                # Formato del file di storico: il journal accoda solo le letture nuove, il binario è mappato in memoria
+                vol.Required(CONF_STORAGE_FORMAT, default=STORAGE_FORMAT_JOURNAL): selector.SelectSelector(
+                    selector.SelectSelectorConfig(
+                        options=[STORAGE_FORMAT_JSON, STORAGE_FORMAT_JOURNAL, STORAGE_FORMAT_BINARY],
+                        mode=selector.SelectSelectorMode.LIST
+                    )
+                ),
+                # Ampiezza in giorni del sensore di consumo a finestra mobile
+                vol.Optional(CONF_ROLLING_DAYS, default=DEFAULT_ROLLING_DAYS): vol.All(vol.Coerce(int), vol.Range(min=1)),
+                # Mesi conservati con il dettaglio giornaliero: i più vecchi restano solo come totali di fine mese (0 = tutti)
+                vol.Optional(CONF_RETENTION_MONTHS, default=DEFAULT_RETENTION_MONTHS): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                # Filtro anomalie: sensibilità (0 = solo limite fisso) e giorni di letture su cui calcolare la soglia
+                vol.Optional(CONF_OUTLIER_SENSITIVITY, default=DEFAULT_OUTLIER_SENSITIVITY): vol.All(vol.Coerce(float), vol.Range(min=0)),
+                vol.Optional(CONF_OUTLIER_WINDOW, default=DEFAULT_OUTLIER_WINDOW): vol.All(vol.Coerce(int), vol.Range(min=7)),
+                # Granularità delle letture: giornaliera oppure consumo per intervallo (30/60 minuti)
+                vol.Required(CONF_INTERVAL_MODE, default=INTERVAL_DAILY): selector.SelectSelector(
+                    selector.SelectSelectorConfig(
+                        options=[INTERVAL_DAILY, INTERVAL_30, INTERVAL_60],
+                        mode=selector.SelectSelectorMode.LIST
+                    )
+                ),
+                # Strumentazione dei percorsi critici (download di diagnostica e sensori diagnostici)
+                vol.Optional(CONF_DIAGNOSTIC_METRICS, default=DEFAULT_DIAGNOSTIC_METRICS): selector.BooleanSelector(),
             }),
             errors=errors # Passiamo gli eventuali errori riscontrati per visualizzarli in rosso
         )
@@ -121,7 +169,8 @@ class OctopusOptionsFlowHandler(config_entries.OptionsFlow):
                 if price_type == PRICE_TYPE_FIXED:
                     user_input[CONF_PRICE_SENSOR] = None
                 
-                self.hass.config_entries.async_update_entry(config_entry, data=user_input)
+                # I campi interni non presenti nel form (es. legacy_statistics) vengono conservati.
+                self.hass.config_entries.async_update_entry(config_entry, data={**config_entry.data, **user_input})
                 return self.async_create_entry(title="", data=user_input)
 
         # Recuperiamo i dati attuali dai dati della entry
@@ -143,6 +192,25 @@ class OctopusOptionsFlowHandler(config_entries.OptionsFlow):
                 )
             ),
             vol.Optional(CONF_FIXED_PRICE, default=current_data.get(CONF_FIXED_PRICE, 0.0)): vol.Coerce(float),
+            vol.Optional(CONF_PRICE_MIN_INTERVAL, default=current_data.get(CONF_PRICE_MIN_INTERVAL, DEFAULT_PRICE_MIN_INTERVAL)): vol.All(vol.Coerce(int), vol.Range(min=0)),
+            vol.Optional(CONF_PRICE_MIN_DELTA, default=current_data.get(CONF_PRICE_MIN_DELTA, DEFAULT_PRICE_MIN_DELTA)): vol.All(vol.Coerce(float), vol.Range(min=0)),
+            vol.Required(CONF_STORAGE_FORMAT, default=current_data.get(CONF_STORAGE_FORMAT, STORAGE_FORMAT_JOURNAL)): selector.SelectSelector(
+                selector.SelectSelectorConfig(
+                    options=[STORAGE_FORMAT_JSON, STORAGE_FORMAT_JOURNAL, STORAGE_FORMAT_BINARY],
+                    mode=selector.SelectSelectorMode.LIST
+                )
+            ),
+            vol.Optional(CONF_ROLLING_DAYS, default=current_data.get(CONF_ROLLING_DAYS, DEFAULT_ROLLING_DAYS)): vol.All(vol.Coerce(int), vol.Range(min=1)),
+            vol.Optional(CONF_RETENTION_MONTHS, default=current_data.get(CONF_RETENTION_MONTHS, DEFAULT_RETENTION_MONTHS)): vol.All(vol.Coerce(int), vol.Range(min=0)),
+            vol.Optional(CONF_OUTLIER_SENSITIVITY, default=current_data.get(CONF_OUTLIER_SENSITIVITY, DEFAULT_OUTLIER_SENSITIVITY)): vol.All(vol.Coerce(float), vol.Range(min=0)),
+            vol.Optional(CONF_OUTLIER_WINDOW, default=current_data.get(CONF_OUTLIER_WINDOW, DEFAULT_OUTLIER_WINDOW)): vol.All(vol.Coerce(int), vol.Range(min=7)),
+            vol.Required(CONF_INTERVAL_MODE, default=current_data.get(CONF_INTERVAL_MODE, INTERVAL_DAILY)): selector.SelectSelector(
+                selector.SelectSelectorConfig(
+                    options=[INTERVAL_DAILY, INTERVAL_30, INTERVAL_60],
+                    mode=selector.SelectSelectorMode.LIST
+                )
+            ),
+            vol.Optional(CONF_DIAGNOSTIC_METRICS, default=current_data.get(CONF_DIAGNOSTIC_METRICS, DEFAULT_DIAGNOSTIC_METRICS)): selector.BooleanSelector(),
         }
 
         # Per il sensore di prezzo, aggiungiamo il default SOLO SE esiste ed è valido
@@ -4,6 +4,53 @@ CONF_VALUE_SENSOR = "value_sensor"
 CONF_PRICE_TYPE = "price_type"
 CONF_FIXED_PRICE = "fixed_price"
 CONF_PRICE_SENSOR = "price_sensor"
+CONF_STORAGE_FORMAT = "storage_format"
+CONF_ROLLING_DAYS = "rolling_days"
+CONF_INTERVAL_MODE = "interval_mode"
+CONF_PRICE_MIN_INTERVAL = "price_min_interval"
+CONF_PRICE_MIN_DELTA = "price_min_delta"
+CONF_RETENTION_MONTHS = "retention_months"
+CONF_OUTLIER_SENSITIVITY = "outlier_sensitivity"
+CONF_OUTLIER_WINDOW = "outlier_window"
+CONF_DIAGNOSTIC_METRICS = "diagnostic_metrics"
+# Impostato dalla migrazione sulla entry che ha ereditato lo storico condiviso (statistic_id senza entry_id)
+CONF_LEGACY_STATISTICS = "legacy_statistics"
 
 PRICE_TYPE_FIXED = "Fisso"
-PRICE_TYPE_SENSOR = "Sensore"
\ No newline at end of file
+PRICE_TYPE_SENSOR = "Sensore"
+
+# Formati di salvataggio dello storico
+STORAGE_FORMAT_JSON = "JSON"
+STORAGE_FORMAT_JOURNAL = "Journal"
+STORAGE_FORMAT_BINARY = "Binario"
+
+# Granularità delle letture: giornaliera (storico cumulativo) oppure a intervalli (kWh per intervallo)
+INTERVAL_DAILY = "Giornaliero"
+INTERVAL_30 = "30 minuti"
+INTERVAL_60 = "60 minuti"
+INTERVAL_MINUTES = {INTERVAL_30: 30, INTERVAL_60: 60}
+
+# Ampiezza predefinita (giorni) del sensore a finestra mobile
+DEFAULT_ROLLING_DAYS = 30
+
+# Limitazione degli aggiornamenti del prezzo dinamico: secondi minimi tra due ricalcoli
+# e variazione relativa minima (%) perché un nuovo prezzo venga considerato
+DEFAULT_PRICE_MIN_INTERVAL = 60
+DEFAULT_PRICE_MIN_DELTA = 0.0
+
+# Mesi di storico conservati con il dettaglio giornaliero (e a intervalli); 0 = nessun limite.
+# I mesi più vecchi vengono ridotti alla sola lettura di fine mese (vedi retention.py).
+DEFAULT_RETENTION_MONTHS = 0
+
+# Limite fisso di una lettura (kWh): vale finché il filtro anomalie non ha abbastanza letture,
+# quando il filtro è disattivato e per le importazioni da file.
+MAX_READING_KWH = 150
+
+# Filtro adattivo delle letture anomale (vedi anomaly.py): soglia = mediana + sensibilità × dispersione
+# delle letture degli ultimi N giorni. Sensibilità 0 = filtro disattivato (resta solo il limite fisso).
+DEFAULT_OUTLIER_SENSITIVITY = 6.0
+DEFAULT_OUTLIER_WINDOW = 30
+
+# Strumentazione dei percorsi critici (vedi metrics.py): disattivata per impostazione predefinita.
+# Se attiva, le misure compaiono nel download di diagnostica e nei sensori diagnostici.
+DEFAULT_DIAGNOSTIC_METRICS = False
@@ -0,0 +1,826 @@
+"""
+Questo modulo contiene il coordinatore di una singola entry (contatore).
+Il coordinatore possiede storico, indice, storico prezzi e sincronizzazione delle statistiche:
+ascolta i sensori sorgente, registra le nuove letture e calcola una sola volta per ogni cambiamento
+i valori derivati (consumi per periodo, costo del mese, prezzo attuale), che poi notifica ai sensori.
+I sensori si limitano a mostrare i valori già calcolati.
+"""
+
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+
+from homeassistant.core import callback
+from homeassistant.helpers.debounce import Debouncer
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import async_track_state_change_event, async_track_time_change
+from homeassistant.helpers.start import async_at_started
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    DOMAIN,
+    CONF_DATA_SENSOR,
+    CONF_VALUE_SENSOR,
+    CONF_PRICE_TYPE,
+    CONF_PRICE_SENSOR,
+    CONF_ROLLING_DAYS,
+    CONF_STORAGE_FORMAT,
+    CONF_INTERVAL_MODE,
+    CONF_LEGACY_STATISTICS,
+    CONF_PRICE_MIN_INTERVAL,
+    CONF_PRICE_MIN_DELTA,
+    CONF_RETENTION_MONTHS,
+    CONF_OUTLIER_SENSITIVITY,
+    CONF_OUTLIER_WINDOW,
+    CONF_DIAGNOSTIC_METRICS,
+    DEFAULT_ROLLING_DAYS,
+    DEFAULT_RETENTION_MONTHS,
+    DEFAULT_OUTLIER_SENSITIVITY,
+    DEFAULT_OUTLIER_WINDOW,
+    DEFAULT_DIAGNOSTIC_METRICS,
+    DEFAULT_PRICE_MIN_INTERVAL,
+    DEFAULT_PRICE_MIN_DELTA,
+    INTERVAL_MINUTES,
+    PRICE_TYPE_FIXED,
+    STORAGE_FORMAT_JOURNAL,
+)
+from .aggregates import AVERAGE_WINDOWS, RollingAggregates
+from .anomaly import OutlierFilter
+from .backfill import async_fetch_source_states, backfill_window, missing_days, pair_source_states, start_of_day
+from .importer import read_import_file_sync
+from .metrics import Metrics
+from .prices import PriceHistory, get_configured_price
+from .retention import (
+    checkpoint_prices,
+    load_checkpoints_sync,
+    monthly_checkpoints,
+    retention_cutoff,
+    save_checkpoints_sync,
+)
+from .statistics import StatisticsSync
+from .storage import OctopusHistory, IntervalHistory, StorageExecutor, SUMMARY_TAIL_DAYS, async_run_io
+
+_LOGGER = logging.getLogger(__name__)
+
+# Segnale del dispatcher inviato dal coordinatore quando i valori derivati cambiano.
+# Include l'entry_id (vedi .format()): i sensori di un contatore non reagiscono agli altri.
+SIGNAL_UPDATE = f"{DOMAIN}_updated_{{}}"
+
+# Secondi di attesa dopo un cambio dei sensori sorgente: il sensore data e il sensore valore
+# cambiano quasi insieme quando Octopus pubblica un nuovo giorno e vanno elaborati in un solo aggiornamento.
+INGEST_COALESCE_DELAY = 2
+
+# Orario (locale) del lavoro di manutenzione giornaliero: compattazione dello storico secondo la conservazione
+MAINTENANCE_TIME = {"hour": 3, "minute": 30, "second": 0}
+
+# Chiave dello stato del filtro anomalie nel riepilogo dello storico (vedi OctopusHistory.async_set_extra)
+OUTLIER_STATE_KEY = "outliers"
+
+# Chiave dello stato degli accumulatori di medie e previsione nel riepilogo dello storico
+AGGREGATES_STATE_KEY = "aggregates"
+
+class OctopusCoordinator:
+    """
+    Coordinatore condiviso dai sensori di una entry, creato in __init__.async_setup_entry
+    e memorizzato in hass.data[DOMAIN][entry_id].
+    """
+
+    def __init__(self, hass, entry):
+        self.hass = hass
+        self.entry_id = entry.entry_id
+        self.config = entry.data
+        self.signal = SIGNAL_UPDATE.format(entry.entry_id)
+
+        self.rolling_days = int(self.config.get(CONF_ROLLING_DAYS, DEFAULT_ROLLING_DAYS))
+        self.retention_months = int(self.config.get(CONF_RETENTION_MONTHS, DEFAULT_RETENTION_MONTHS))
+        # Stato della compattazione dello storico (vedi retention.py)
+        self._checkpoints = {}
+
+        self.outlier_window = int(self.config.get(CONF_OUTLIER_WINDOW, DEFAULT_OUTLIER_WINDOW))
+
+        # Strumentazione dei percorsi critici, condivisa da storico, intervalli e statistiche (vedi metrics.py)
+        self.metrics = Metrics(bool(self.config.get(CONF_DIAGNOSTIC_METRICS, DEFAULT_DIAGNOSTIC_METRICS)))
+
+        # Tutto l'I/O su disco della entry passa da un unico thread dedicato, in ordine.
+        self.io = StorageExecutor(hass, entry.entry_id)
+        # Le entry senza l'opzione usano il journal, che legge lo snapshot JSON esistente così com'è.
+        # Il riepilogo dello storico deve coprire anche l'intera finestra mobile e quella del filtro anomalie.
+        self.history = OctopusHistory(
+            hass, entry.entry_id, self.config.get(CONF_STORAGE_FORMAT, STORAGE_FORMAT_JOURNAL), io=self.io,
+            tail_days=max(SUMMARY_TAIL_DAYS, self.rolling_days, self.outlier_window), metrics=self.metrics,
+        )
+        self.prices = PriceHistory(hass, entry.entry_id, io=self.io, metrics=self.metrics)
+        # Letture a intervalli (30/60 minuti): consumi per intervallo in array compatti, da cui derivano
+        # i totali giornalieri dello storico e le statistiche orarie.
+        slot_minutes = INTERVAL_MINUTES.get(self.config.get(CONF_INTERVAL_MODE))
+        self.intervals = (
+            IntervalHistory(hass, entry.entry_id, slot_minutes, io=self.io, metrics=self.metrics) if slot_minutes else None
+        )
+        # Filtro adattivo delle letture anomale: la finestra contiene le letture (giorni o intervalli) degli ultimi N giorni.
+        readings_per_day = 24 * 60 // slot_minutes if slot_minutes else 1
+        self.outliers = OutlierFilter(
+            self.outlier_window * readings_per_day,
+            float(self.config.get(CONF_OUTLIER_SENSITIVITY, DEFAULT_OUTLIER_SENSITIVITY)),
+        )
+        # Medie giornaliere, stesso periodo dell'anno precedente e previsione di fine mese (vedi aggregates.py)
+        self.aggregates = RollingAggregates()
+        self.stats_sync = StatisticsSync(
+            hass, entry.entry_id, self.history, self.prices, self.intervals,
+            legacy_ids=self.config.get(CONF_LEGACY_STATISTICS, False), io=self.io, metrics=self.metrics,
+        )
+
+        # Valori derivati, letti dai sensori
+        self.current_price = 0.0
+        self.monthly_energy = 0.0
+        self.monthly_cost = 0.0
+        self.weekly_energy = 0.0
+        self.yearly_energy = 0.0
+        self.rolling_energy = 0.0
+        self.average_energy = {window: None for window in AVERAGE_WINDOWS}
+        self.last_year_energy = None
+        self.forecast_energy = None
+        self.forecast_cost = None
+
+        self._unsub = []
+        # Gli aggiornamenti (nuove letture e cambi di prezzo) della entry vengono eseguiti uno alla volta.
+        self._update_lock = asyncio.Lock()
+        # Gli eventi dei sensori sorgente ravvicinati confluiscono in un solo aggiornamento.
+        self._ingest_debouncer = Debouncer(
+            hass, _LOGGER, cooldown=INGEST_COALESCE_DELAY, immediate=False, function=self._async_ingest,
+        )
+        # Sensori di prezzo ad alta frequenza: il primo cambio viene applicato subito, i successivi
+        # al più una volta ogni 'price_min_interval' secondi (sempre con l'ultimo valore disponibile).
+        self._price_min_delta = float(self.config.get(CONF_PRICE_MIN_DELTA, DEFAULT_PRICE_MIN_DELTA))
+        self._price_debouncer = Debouncer(
+            hass, _LOGGER,
+            cooldown=int(self.config.get(CONF_PRICE_MIN_INTERVAL, DEFAULT_PRICE_MIN_INTERVAL)),
+            immediate=True, function=self._async_price_update,
+        )
+        # Ultimi valori notificati ai sensori: se il ricalcolo non cambia nulla, nessuna scrittura di stato.
+        self._published = None
+        # Lavoro differito dell'avvio (vedi async_start) e stato del filtro anomalie già ripristinato
+        self._startup_task = None
+        self._outliers_loaded = False
+        # False se gli accumulatori vanno ricostruiti dallo storico completo (stato assente o non più valido)
+        self._aggregates_valid = False
+
+    async def async_load(self):
+        """
+        Carica il riepilogo dello storico, i prezzi e gli intervalli e calcola i valori iniziali.
+        Lo storico completo viene caricato solo quando serve (vedi OctopusHistory.async_ensure_loaded):
+        se il riepilogo non è aggiornato i sensori mostrano l'ultimo stato noto fino al caricamento in background.
+        """
+        with self.metrics.timer("setup_load_ms"):
+            await self.history.async_load()
+            await self.prices.async_load()
+            self._checkpoints = await async_run_io(self.hass, self.io, load_checkpoints_sync, self.hass, self.entry_id)
+            self.prices.set_overrides(checkpoint_prices(self._checkpoints))
+            if self.intervals is not None:
+                await self.intervals.async_load()
+            # Con un riepilogo non aggiornato la finestra del filtro viene ricavata dopo il caricamento completo.
+            if not self.history.stale:
+                self._async_load_outliers()
+            self._async_load_aggregates()
+
+            # Il prezzo configurato all'avvio (es. un prezzo fisso appena modificato dalle opzioni)
+            # diventa un punto di cambio se diverso da quello in vigore. Un sensore di prezzo non ancora
+            # disponibile durante l'avvio di HA viene sostituito dall'ultimo prezzo registrato.
+            price = get_configured_price(self.hass, self.config)
+            if price is not None:
+                changed_from = self.prices.async_record(price)
+                # Un cambio che tocca giorni già accumulati cambia il costo del mese: ricostruzione in background.
+                if changed_from is not None and self.aggregates.last is not None \
+                        and date.fromisoformat(changed_from).toordinal() <= self.aggregates.last:
+                    self._aggregates_valid = False
+            self.current_price = price if price is not None else self.prices.price_on(date.today().toordinal())
+            self._compute()
+
+    @callback
+    def _async_load_outliers(self):
+        """
+        Ripristina il filtro anomalie dal riepilogo dello storico. Alla prima esecuzione (nessuno stato salvato)
+        la finestra viene riempita con le letture degli ultimi giorni già presenti nello storico.
+        """
+        state = self.history.extras.get(OUTLIER_STATE_KEY)
+        if state is not None:
+            self.outliers.load(state)
+        elif self.intervals is not None:
+            self.outliers.seed(self.intervals.values[-self.outliers.window:])
+        else:
+            start = date.today() - timedelta(days=self.outlier_window)
+            self.outliers.seed(kwh for _, kwh in self.history.index.daily_since(start))
+        self._outliers_loaded = True
+
+    @callback
+    def _async_save_outliers(self):
+        """Salva lo stato del filtro anomalie insieme al riepilogo (scrittura differita)."""
+        self.history.async_set_extra(OUTLIER_STATE_KEY, self.outliers.to_dict())
+
+    @callback
+    def _async_load_aggregates(self):
+        """
+        Ripristina gli accumulatori dal riepilogo dello storico. Lo stato è valido solo se il riepilogo è aggiornato
+        e arriva fino all'ultima lettura; altrimenti viene mostrato come ultimo stato noto (se presente)
+        e ricostruito dallo storico completo nel lavoro differito dell'avvio.
+        """
+        state = self.history.extras.get(AGGREGATES_STATE_KEY)
+        if state is not None:
+            self.aggregates.load(state)
+        last_date = self.history.last_date
+        last = date.fromisoformat(last_date).toordinal() if last_date is not None else None
+        self._aggregates_valid = state is not None and not self.history.stale and self.aggregates.last == last
+
+    @callback
+    def _async_update_aggregates(self, reading_date=None):
+        """
+        Aggiorna gli accumulatori con il giorno 'reading_date' appena registrato (O(1)) e li salva nel riepilogo.
+        Senza 'reading_date', o per un giorno precedente all'ultimo accumulato, vengono ricostruiti in modo esatto
+        dallo storico completo (che deve essere già caricato).
+        """
+        index = self.history.index
+        # Uno stato non valido (es. lettura arrivata prima della ricostruzione dell'avvio) non va aggiornato ma ricostruito.
+        if reading_date is None or not self._aggregates_valid or not self.aggregates.add(
+            date.fromisoformat(reading_date), index.day_value(date.fromisoformat(reading_date)), index, self.prices
+        ):
+            self.aggregates.rebuild(index, self.prices)
+        self._aggregates_valid = True
+        self.history.async_set_extra(AGGREGATES_STATE_KEY, self.aggregates.to_dict())
+
+    @callback
+    def _async_screen(self, reading, kwh):
+        """
+        Controlla una lettura (data ISO o inizio dell'intervallo) con il filtro anomalie.
+        Restituisce True se supera la soglia: la lettura va in quarantena invece che nello storico.
+        """
+        if self.outliers.is_rejected(reading, kwh):
+            return True
+        threshold = self.outliers.threshold()
+        if kwh <= threshold:
+            return False
+        if self.outliers.quarantine_add(reading, kwh, threshold):
+            _LOGGER.warning(
+                f"Lettura sospetta messa in quarantena: {kwh} kWh ({reading}), soglia {round(threshold, 3)} kWh. "
+                f"Usare il servizio {DOMAIN}.review_quarantine per accettarla o scartarla."
+            )
+            self._async_save_outliers()
+            self.async_update_listeners()
+        return True
+
+    @callback
+    def _async_accept_reading(self, kwh):
+        """Una lettura nuova registrata nello storico entra nella finestra del filtro anomalie."""
+        self.outliers.add(kwh)
+        self._async_save_outliers()
+
+    async def async_review_quarantine(self, reading, accept):
+        """
+        Accetta (registrandola nello storico) o scarta una lettura in quarantena.
+        Solleva KeyError se la lettura non è in quarantena.
+        """
+        async with self._update_lock:
+            entry = self.outliers.quarantine_pop(reading, reject=not accept)
+            if entry is None:
+                raise KeyError(reading)
+            self._async_save_outliers()
+            if accept:
+                _LOGGER.info(f"Lettura in quarantena accettata: {entry['kwh']} kWh ({reading})")
+                if self.intervals is not None:
+                    await self._async_ingest_interval(dt_util.parse_datetime(reading), entry["kwh"], screen=False)
+                else:
+                    await self._async_record_day(reading, entry["kwh"])
+                    self._async_accept_reading(entry["kwh"])
+            else:
+                _LOGGER.info(f"Lettura in quarantena scartata: {entry['kwh']} kWh ({reading})")
+        self.async_update_listeners()
+
+    @callback
+    def async_start(self):
+        """
+        Pianifica l'avvio del coordinatore. Durante l'avvio di Home Assistant i sensori mostrano i valori
+        del riepilogo; l'ascolto dei sensori sorgente e tutto il lavoro proporzionale allo storico
+        (caricamento completo, recupero dal Recorder, sincronizzazione delle statistiche) partono solo
+        con Home Assistant avviato (EVENT_HOMEASSISTANT_STARTED), in un task in background.
+        """
+        # A mezzanotte i periodi (mese, settimana, finestra mobile) cambiano anche senza nuove letture.
+        self._unsub.append(async_track_time_change(self.hass, self._async_on_midnight, hour=0, minute=0, second=5))
+        if self.retention_months:
+            self._unsub.append(async_track_time_change(self.hass, self._async_on_maintenance, **MAINTENANCE_TIME))
+
+        # Con Home Assistant già avviato (entry aggiunta o ricaricata) la callback viene eseguita subito.
+        self._unsub.append(async_at_started(self.hass, self._async_on_started))
+
+    @callback
+    def _async_on_started(self, _hass):
+        """Home Assistant avviato: ascolto delle sorgenti e avvio del lavoro differito a bassa priorità."""
+        # Traccia il sensore della data e dei kWh.
+        sources = [self.config.get(CONF_DATA_SENSOR), self.config.get(CONF_VALUE_SENSOR)]
+        self._unsub.append(async_track_state_change_event(self.hass, sources, self._async_on_source_event))
+
+        # Se la tariffa è dinamica, dobbiamo "osservare" il sensore del prezzo per reagire ai cambi.
+        p_src = self.config.get(CONF_PRICE_SENSOR)
+        if self.config.get(CONF_PRICE_TYPE) != PRICE_TYPE_FIXED and p_src:
+            self._unsub.append(async_track_state_change_event(self.hass, [p_src], self._async_on_price_change))
+
+        # Task in background: non ritarda l'avvio né async_block_till_done, e viene annullato allo scaricamento.
+        self._startup_task = self.hass.async_create_background_task(
+            self._async_initial_refresh(), f"{DOMAIN} startup {self.entry_id}"
+        )
+
+    async def _async_initial_refresh(self):
+        """
+        Lavoro differito dell'avvio: caricamento completo dello storico se il riepilogo non era aggiornato,
+        prezzo e lettura correnti dei sensori (che durante l'avvio potevano non essere ancora disponibili),
+        recupero dei giorni mancanti e sincronizzazione delle statistiche a lungo termine.
+        """
+        if self.history.stale:
+            async with self._update_lock:
+                await self.history.async_ensure_loaded()
+        if not self._outliers_loaded:
+            self._async_load_outliers()
+        async with self._update_lock:
+            if not self._aggregates_valid:
+                # Prima esecuzione (nessuno stato salvato), riepilogo non aggiornato o prezzi cambiati all'avvio.
+                await self.history.async_ensure_loaded()
+                self._async_update_aggregates()
+            await self._async_apply_price()
+
+        # Per la strumentazione la lettura iniziale conta come un evento dei sensori sorgente.
+        self.metrics.count("source_events")
+        await self._async_ingest()
+        # Giorni persi mentre Home Assistant era spento: le statistiche vengono inviate dalla sincronizzazione seguente.
+        async with self._update_lock:
+            try:
+                await self._async_backfill(push_statistics=False)
+            except Exception as e:
+                _LOGGER.error(f"Errore durante il recupero dei giorni mancanti dal Recorder: {e}")
+        if self.history.last_date is not None:
+            # Grazie al watermark vengono inviati solo i giorni nuovi o modificati dall'ultimo avvio.
+            # Sotto lo stesso lock degli aggiornamenti: una nuova lettura non modifica il watermark a metà sincronizzazione.
+            async with self._update_lock:
+                await self.stats_sync.async_sync(self.history)
+        if self.retention_months:
+            self._async_on_maintenance(None)
+
+    async def async_stop(self):
+        """Rimuove gli ascoltatori e scarica su disco le modifiche ancora pendenti."""
+        while self._unsub:
+            self._unsub.pop()()
+        if self._startup_task is not None and not self._startup_task.done():
+            self._startup_task.cancel()
+            try:
+                await self._startup_task
+            except asyncio.CancelledError:
+                pass
+        self._ingest_debouncer.async_cancel()
+        self._price_debouncer.async_cancel()
+        await self.history.async_close()
+        await self.prices.async_close()
+        if self.intervals is not None:
+            await self.intervals.async_close()
+        self.io.shutdown()
+
+    @callback
+    def _compute(self):
+        """Ricalcola tutti i valori derivati dall'indice ordinato (poche ricerche binarie)."""
+        if self.history.stale and not len(self.history.index):
+            # Nessuno stato precedente (riepilogo assente): i sensori restano 'sconosciuto' fino al caricamento completo.
+            self.monthly_energy = self.monthly_cost = None
+            self.weekly_energy = self.yearly_energy = self.rolling_energy = None
+            self.average_energy = {window: None for window in AVERAGE_WINDOWS}
+            self.last_year_energy = self.forecast_energy = self.forecast_cost = None
+            return
+        with self.metrics.timer("compute_ms"):
+            index = self.history.index
+            today = date.today()
+            self.monthly_energy = index.month_to_date(today)
+            self.weekly_energy = index.week_to_date(today)
+            self.yearly_energy = index.year_to_date(today)
+            self.rolling_energy = index.rolling(self.rolling_days, today)
+            # Costo = somma dei kWh di ogni giorno del mese * prezzo in vigore in quel giorno.
+            self.monthly_cost = round(
+                sum(kwh * self.prices.price_on(ordinal) for ordinal, kwh in index.daily_since(today.replace(day=1))),
+                2,
+            )
+            # Medie, stesso periodo dell'anno precedente e previsione: O(1) dagli accumulatori.
+            if self.aggregates.last is None:
+                self.average_energy = {window: None for window in AVERAGE_WINDOWS}
+                self.last_year_energy = self.forecast_energy = self.forecast_cost = None
+            else:
+                self.average_energy = {window: self.aggregates.average(window) for window in AVERAGE_WINDOWS}
+                self.last_year_energy = self.aggregates.same_period_last_year(today)
+                self.forecast_energy, self.forecast_cost = self.aggregates.forecast(today, self.current_price)
+
+    @callback
+    def async_update_listeners(self):
+        """
+        Ricalcola i valori derivati e li notifica ai sensori della entry.
+        Se nessun valore (già arrotondato) è cambiato, i sensori non vengono riscritti.
+        """
+        self._compute()
+        values = (
+            self.current_price, self.monthly_energy, self.monthly_cost,
+            self.weekly_energy, self.yearly_energy, self.rolling_energy,
+            tuple(self.average_energy.values()), self.last_year_energy, self.forecast_energy, self.forecast_cost,
+            # La quarantena è un attributo del sensore mensile: anche un suo cambio va notificato.
+            tuple((entry["reading"], entry["kwh"]) for entry in self.outliers.quarantine),
+        )
+        if values == self._published:
+            self.metrics.count("sensor_updates_skipped")
+            return
+        self._published = values
+        self.metrics.count("sensor_updates")
+        async_dispatcher_send(self.hass, self.signal)
+
+    def events_summary(self):
+        """
+        Eventi dei sensori sorgente accorpati dalla finestra di accorpamento e cambi del sensore di prezzo
+        scartati (solo attributi o sotto la variazione minima) o accorpati dal limitatore (strumentazione).
+        """
+        return {
+            "source_events_coalesced": self.metrics.coalesced("source_events", "ingest_runs"),
+            "price_events_dropped": self.metrics.counters.get("price_events_dropped", 0),
+            "price_events_coalesced": self.metrics.coalesced("price_events", "price_events_dropped", "price_updates"),
+        }
+
+    async def _async_on_midnight(self, _now):
+        self.async_update_listeners()
+
+    @callback
+    def _async_on_maintenance(self, _now):
+        """Avvia la compattazione in background: non ritarda l'avvio né gli altri task."""
+        self.hass.async_create_background_task(self.async_apply_retention(), f"{DOMAIN} retention {self.entry_id}")
+
+    async def async_apply_retention(self):
+        """
+        Riduce le letture (e gli intervalli) più vecchie della conservazione configurata a un checkpoint
+        di fine mese. Il limite avanza una volta al mese: negli altri giorni non viene caricato nulla.
+        Le statistiche già inviate restano valide (i cumulativi conservati non cambiano), quindi viene
+        ricalcolato solo il watermark. Restituisce il numero di letture eliminate.
+        """
+        if not self.retention_months:
+            return 0
+        cutoff = retention_cutoff(date.today(), self.retention_months, max(self.rolling_days, SUMMARY_TAIL_DAYS))
+        if self._checkpoints.get("compacted_before", "") >= cutoff.isoformat():
+            return 0
+
+        async with self._update_lock:
+            try:
+                await self.history.async_ensure_loaded()
+                keep, overrides = monthly_checkpoints(self.history.index, self.prices, cutoff)
+                # Gli intervalli vanno eliminati per primi: i giorni compattati non devono più avere righe orarie.
+                slots = self.intervals.async_drop_before(cutoff) if self.intervals is not None else 0
+                removed = self.history.async_drop_before(cutoff, keep)
+
+                prices = {**checkpoint_prices(self._checkpoints), **overrides}
+                self.prices.set_overrides(prices)
+                self._checkpoints = {
+                    "compacted_before": cutoff.isoformat(),
+                    "prices": sorted([date.fromordinal(o).isoformat(), p] for o, p in prices.items()),
+                }
+                await self.history.async_flush()
+                if self.intervals is not None:
+                    await self.intervals.async_flush()
+                await async_run_io(self.hass, self.io, save_checkpoints_sync, self.hass, self._checkpoints, self.entry_id)
+                if removed:
+                    await self.stats_sync.async_rebase(self.history.data, self.history.checksum)
+            except Exception as e:
+                _LOGGER.error(f"Errore durante la compattazione dello storico della entry {self.entry_id}: {e}")
+                return 0
+
+        if removed or slots:
+            _LOGGER.info(
+                f"Storico della entry {self.entry_id} compattato prima del {cutoff}: "
+                f"{removed} letture giornaliere e {slots} intervalli sostituiti da {len(keep)} checkpoint mensili"
+            )
+        return removed
+
+    @callback
+    def _async_on_source_event(self, event):
+        """
+        Chiamato ogni volta che il sensore data o il sensore kWh cambiano.
+        L'elaborazione parte allo scadere della finestra di accorpamento e legge lo stato più recente
+        di entrambi i sensori: N eventi ravvicinati producono un solo aggiornamento.
+        """
+        self.metrics.count("source_events")
+        self._ingest_debouncer.async_schedule_call()
+
+    async def _async_ingest(self):
+        """Registra la lettura corrente e aggiorna i sensori (serializzato con gli altri aggiornamenti)."""
+        self.metrics.count("ingest_runs")
+        with self.metrics.timer("ingest_ms"):
+            async with self._update_lock:
+                await self.async_refresh_reading()
+                self.async_update_listeners()
+
+    @callback
+    def _async_on_price_change(self, event):
+        """
+        Reazione al cambiamento di stato del sensore di prezzo esterno.
+        Vengono scartati i cambi dei soli attributi e le variazioni sotto la soglia relativa;
+        gli altri passano dal limitatore di frequenza.
+        """
+        self.metrics.count("price_events")
+        old_state = event.data.get("old_state")
+        new_state = event.data.get("new_state")
+        if new_state is None or (old_state is not None and old_state.state == new_state.state):
+            self.metrics.count("price_events_dropped")
+            return
+
+        price = get_configured_price(self.hass, self.config)
+        if price is not None and self._price_min_delta and self.current_price:
+            delta = abs(price - self.current_price) / abs(self.current_price) * 100
+            if delta < self._price_min_delta:
+                self.metrics.count("price_events_dropped")
+                return
+
+        self._price_debouncer.async_schedule_call()
+
+    async def _async_price_update(self):
+        """Applica il prezzo corrente del sensore (serializzato con gli altri aggiornamenti)."""
+        self.metrics.count("price_updates")
+        with self.metrics.timer("price_update_ms"):
+            async with self._update_lock:
+                await self._async_apply_price()
+
+    async def _async_apply_price(self):
+        price = get_configured_price(self.hass, self.config)
+        # Sensore di prezzo non disponibile: resta in vigore l'ultimo prezzo registrato (come all'avvio).
+        self.current_price = price if price is not None else self.prices.price_on(date.today().toordinal())
+
+        # Registra il cambio nello storico prezzi (solo se il sensore ha un valore valido):
+        # la serie del costo viene ricalcolata e reinviata solo dalla data del cambio in avanti.
+        if price is not None:
+            changed_from = self.prices.async_record(price)
+            if changed_from is not None:
+                # Lo storico completo serve solo se il cambio riguarda giorni già registrati: di norma il prezzo
+                # cambia da oggi e le letture arrivano con qualche giorno di ritardo, quindi non c'è nulla da reinviare.
+                last_date = self.history.last_date
+                if last_date is not None and changed_from <= last_date:
+                    await self.history.async_ensure_loaded()
+                await self.stats_sync.async_push_cost_from(changed_from)
+                # Il costo del mese accumulato cambia solo se il cambio riguarda giorni già registrati.
+                if self.aggregates.last is not None and date.fromisoformat(changed_from).toordinal() <= self.aggregates.last:
+                    self._async_update_aggregates()
+        self.async_update_listeners()
+
+    async def async_refresh_reading(self):
+        """Logica principale di salvataggio dati giornalieri con protezione spike (filtro anomalie adattivo)."""
+        try:
+            d_st = self.hass.states.get(self.config.get(CONF_DATA_SENSOR))
+            v_st = self.hass.states.get(self.config.get(CONF_VALUE_SENSOR))
+
+            if not d_st or not v_st or d_st.state in ["unknown", "unavailable"]:
+                return
+
+            if self.intervals is not None:
+                reading = self._parse_interval_reading(d_st.state, v_st.state)
+                if reading is not None:
+                    await self._async_ingest_interval(*reading)
+                return
+
+            reading = self._parse_daily_reading(d_st.state, v_st.state)
+            if reading is None:
+                return
+            reading_date, daily_val = reading
+
+            # La lettura già registrata con lo stesso valore (caso tipico all'avvio) viene riconosciuta
+            # dal solo riepilogo; un giorno nuovo, passato o con un valore diverso viene registrato.
+            if await self.history.async_has_date(reading_date):
+                recorded = self.history.day_kwh(reading_date)
+                if recorded is not None and abs(recorded - daily_val) < 0.0005:
+                    return
+
+            if self._async_screen(reading_date, daily_val):
+                return
+            last_date = self.history.last_date
+            await self._async_record_day(reading_date, daily_val)
+            # Solo i giorni nuovi entrano nella finestra (le correzioni non aggiungono una lettura).
+            if last_date is None or reading_date > last_date:
+                self._async_accept_reading(daily_val)
+
+        except Exception as e:
+            _LOGGER.error("Errore durante l'aggiornamento dei dati energia: %s", e)
+
+    @staticmethod
+    def _parse_daily_reading(date_state, value_state):
+        """
+        Converte gli stati dei sensori sorgente in (data ISO, kWh del giorno) scartando le letture negative.
+        Restituisce None se la lettura non è valida. Le letture troppo alte sono compito del filtro anomalie
+        (vedi _async_screen), che sostituisce il vecchio limite fisso di 150 kWh.
+        """
+        # Trasforma il formato data da quello del sensore (DD/MM/YYYY) a quello ISO (YYYY-MM-DD) per il JSON.
+        try:
+            reading_date = datetime.strptime(date_state, "%d/%m/%Y").strftime("%Y-%m-%d")
+            daily_val = float(value_state)
+        except (ValueError, TypeError):
+            return None
+
+        # --- INIZIO PATCH VALIDAZIONE (v1.1.1) ---
+        # Protezione contro letture sporche dell'integrazione Octopus
+        if daily_val < 0:
+            _LOGGER.warning(f"Scartata lettura negativa anomala: {daily_val} il {reading_date}. Verificare sensore sorgente.")
+            return None
+        # --- FINE PATCH VALIDAZIONE ---
+
+        return reading_date, daily_val
+
+    def _parse_interval_reading(self, end_state, value_state):
+        """
+        Letture a intervalli: il sensore data indica la FINE dell'intervallo, il sensore valore i kWh dell'intervallo.
+        Restituisce (inizio dell'intervallo, kWh) oppure None se la lettura non è valida.
+        """
+        try:
+            interval_end = dt_util.parse_datetime(end_state)
+            if interval_end is None:
+                interval_end = datetime.strptime(end_state, "%d/%m/%Y %H:%M")
+            kwh = float(value_state)
+        except (ValueError, TypeError):
+            return None
+        if interval_end.tzinfo is None:
+            # Orario senza fuso: è l'ora locale di Home Assistant.
+            interval_end = interval_end.replace(tzinfo=dt_util.DEFAULT_TIME_ZONE)
+        interval_start = interval_end - timedelta(minutes=self.intervals.slot_minutes)
+
+        # Stessa protezione delle letture giornaliere (le letture troppo alte passano dal filtro anomalie).
+        if kwh < 0:
+            _LOGGER.warning(f"Scartata lettura negativa anomala: {kwh} alle {interval_start}. Verificare sensore sorgente.")
+            return None
+
+        return interval_start, kwh
+
+    async def _async_record_day(self, reading_date, kwh):
+        """
+        Registra il consumo di un giorno e aggiorna le statistiche a lungo termine.
+        Il giorno può essere nuovo, precedente all'ultimo registrato (dati Octopus arrivati in ritardo)
+        oppure una correzione: in questi ultimi casi i cumulativi successivi vengono ricalcolati
+        e le statistiche reinviate solo dal giorno modificato in avanti.
+        """
+        if self._aggregates_valid:
+            # Un giorno nuovo viene accodato anche dal solo riepilogo: nessun caricamento dello storico completo
+            # alla prima lettura dopo un riavvio (vedi OctopusHistory.async_ensure_writable).
+            await self.history.async_ensure_writable(reading_date)
+        else:
+            await self.history.async_ensure_loaded()
+        last_date = self.history.last_date
+        previous = self.history.value_of(reading_date)
+
+        # Aggiorna il database in memoria; la scrittura su disco è differita e accorpata.
+        if not self.history.async_set_daily(reading_date, kwh):
+            return
+
+        if last_date is not None and reading_date < last_date:
+            kind = "Correzione" if previous is not None else "Inserimento retroattivo"
+            _LOGGER.info(f"{kind} del {reading_date} ({kwh} kWh): ricalcolati i cumulativi fino al {last_date}")
+            await self.stats_sync.async_push_from(reading_date, checksum=self.history.checksum)
+            # Solo le correzioni retroattive ricostruiscono gli accumulatori (poche decine di giorni).
+            self._async_update_aggregates()
+        else:
+            # Invia il nuovo punto dati alle statistiche a lungo termine di HA.
+            await self.stats_sync.async_push_day(
+                reading_date, self.history.value_of(reading_date), previous, checksum=self.history.checksum,
+            )
+            self._async_update_aggregates(reading_date)
+
+    async def _async_ingest_interval(self, interval_start, kwh, screen=True):
+        """
+        Il kWh dell'intervallo viene salvato nello slot corrispondente; il totale cumulativo del giorno
+        nello storico giornaliero diventa 'cumulativo del giorno precedente + somma degli intervalli del giorno',
+        così sensori mensili, indice e costi continuano a lavorare sui giorni. Gli intervalli di giorni passati
+        (arrivati in ritardo o corretti) ricalcolano i cumulativi dei giorni successivi.
+        Con 'screen' False (lettura accettata dalla quarantena) il filtro anomalie non viene applicato.
+        """
+        day = dt_util.as_local(interval_start).date()
+        slot = self.intervals.slot_for(interval_start)
+        # Un intervallo già registrato con lo stesso valore non passa dal filtro (né rientra nella finestra).
+        recorded = self.intervals.slot_value(slot)
+        if recorded == float(kwh):
+            return
+        if screen and self._async_screen(dt_util.as_utc(interval_start).isoformat(), kwh):
+            return
+        if not self.intervals.async_set(slot, kwh):
+            return
+        if recorded is None:
+            self._async_accept_reading(kwh)
+
+        # Statistiche orarie dal giorno dell'intervallo (gli intervalli vengono raggruppati per ora).
+        await self._async_record_day(day.isoformat(), self.intervals.day_total(day))
+
+    async def async_backfill(self):
+        """Recupero dei giorni mancanti richiesto dal servizio (serializzato con gli altri aggiornamenti)."""
+        async with self._update_lock:
+            return await self._async_backfill()
+
+    async def _async_backfill(self, push_statistics=True):
+        """
+        Ricostruisce dallo storico del Recorder le letture dei giorni mancanti (entro la conservazione del Recorder).
+        Gli stati dei due sensori sorgente vengono letti con un'unica interrogazione per l'intero intervallo,
+        i giorni recuperati vengono inseriti con una sola scrittura su disco e un solo invio delle statistiche
+        (dal primo giorno recuperato in avanti). Restituisce il numero di giorni recuperati.
+        """
+        today = date.today()
+        start = backfill_window(self.hass, today)
+        if self.intervals is not None:
+            missing = self.intervals.incomplete_days(start, today)
+        else:
+            missing = missing_days(self.history.index, start, today)
+        if not missing:
+            return 0
+
+        date_entity = self.config.get(CONF_DATA_SENSOR)
+        value_entity = self.config.get(CONF_VALUE_SENSOR)
+        states = await async_fetch_source_states(self.hass, [date_entity, value_entity], start_of_day(missing[0]))
+        pairs = pair_source_states(states[date_entity], states[value_entity], INGEST_COALESCE_DELAY)
+
+        wanted = {day.isoformat() for day in missing}
+        filled = {}
+        for date_state, value_state in pairs.items():
+            if self.intervals is not None:
+                reading = self._parse_interval_reading(date_state, value_state)
+                if reading is None:
+                    continue
+                interval_start, kwh = reading
+                day = dt_util.as_local(interval_start).date().isoformat()
+                slot = self.intervals.slot_for(interval_start)
+                # Solo gli intervalli mai ricevuti: quelli già presenti restano invariati.
+                if day not in wanted or self.intervals.has_slot(slot):
+                    continue
+                if not self._async_screen(dt_util.as_utc(interval_start).isoformat(), kwh) and self.intervals.async_set(slot, kwh):
+                    filled[day] = None
+            else:
+                reading = self._parse_daily_reading(date_state, value_state)
+                if reading is not None and reading[0] in wanted and not self._async_screen(*reading):
+                    filled[reading[0]] = reading[1]
+        if not filled:
+            return 0
+
+        await self.history.async_ensure_loaded()
+        for day in sorted(filled):
+            kwh = self.intervals.day_total(date.fromisoformat(day)) if self.intervals is not None else filled[day]
+            self.history.async_set_daily(day, kwh)
+
+        self._async_update_aggregates()
+        # Una sola scrittura per tutti i giorni recuperati.
+        await self.history.async_flush()
+        if self.intervals is not None:
+            await self.intervals.async_flush()
+        first = min(filled)
+        _LOGGER.info(f"Recuperati dal Recorder {len(filled)} giorni mancanti dal {first} per la entry {self.entry_id}")
+
+        if push_statistics:
+            await self.stats_sync.async_push_from(first, checksum=self.history.checksum)
+        self.async_update_listeners()
+        return len(filled)
+
+    async def async_import_history(self, path, overwrite=False):
+        """
+        Importa nello storico un file di esportazione (CSV o JSON-lines) con letture giornaliere o a intervalli.
+        Il file viene letto in streaming sul thread di I/O e validato con le stesse regole dei sensori;
+        le letture vengono unite allo storico in un solo passaggio, salvate con una sola riscrittura e
+        inviate alle statistiche dal primo giorno modificato (a blocchi mensili).
+        Senza 'overwrite' i giorni (o gli intervalli) già presenti restano invariati.
+        Restituisce il riepilogo dell'importazione (righe lette, scartate, giorni modificati).
+        """
+        async with self._update_lock:
+            slot_minutes = self.intervals.slot_minutes if self.intervals is not None else None
+            result = await self.io.async_run(read_import_file_sync, path, slot_minutes)
+            await self.history.async_ensure_loaded()
+
+            readings = result["daily"]
+            if self.intervals is not None:
+                changed_days = []
+                if len(result["slots"]):
+                    changed_days = await self.intervals.async_merge(result["slots"], result["values"], overwrite)
+                # Le letture giornaliere servono solo per i giorni senza intervalli (es. prima del contatore orario);
+                # i giorni toccati dagli intervalli prendono sempre il totale ricalcolato dagli intervalli.
+                readings = {
+                    day: kwh for day, kwh in readings.items()
+                    if not self.intervals.has_day(date.fromisoformat(day))
+                    and (overwrite or self.history.day_kwh(day) is None)
+                }
+                for day in changed_days:
+                    readings[day.isoformat()] = round(self.intervals.day_total(day), 3)
+                overwrite = True
+
+            first = self.history.async_merge_daily(readings, overwrite)
+            if first is not None:
+                self._async_update_aggregates()
+            await self.history.async_flush()
+            if self.intervals is not None:
+                await self.intervals.async_flush()
+
+            summary = {
+                "rows": result["rows"], "rejected": result["rejected"], "merged": result["merged"], "days": 0, "first": first,
+            }
+            if first is None:
+                _LOGGER.info(f"Importazione di {path}: nessun giorno nuovo o modificato ({result['rows']} righe lette)")
+                return summary
+
+            summary["days"] = sum(1 for day in readings if day >= first)
+            _LOGGER.info(
+                f"Importazione di {path}: {result['rows']} righe lette ({result['rejected']} scartate, "
+                f"{result['merged']} sommate ad altre dello stesso intervallo), "
+                f"storico aggiornato dal {first} per la entry {self.entry_id}"
+            )
+            await self.stats_sync.async_push_from(first, checksum=self.history.checksum)
+            self.async_update_listeners()
+            return summary
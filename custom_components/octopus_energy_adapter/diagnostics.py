@@ -0,0 +1,50 @@
+"""
+Questo modulo fornisce il download di diagnostica della entry (Impostazioni > Dispositivi e servizi >
+Octopus Energy Adapter > Scarica diagnostica): stato dello storico, valori pubblicati dai sensori,
+filtro anomalie e, se la strumentazione è attiva, tutte le misure dei percorsi critici (vedi metrics.py).
+"""
+
+from .const import DOMAIN, CONF_STORAGE_FORMAT, STORAGE_FORMAT_JOURNAL
+
+async def async_get_config_entry_diagnostics(hass, entry):
+    """Chiamato da Home Assistant alla richiesta del download di diagnostica della entry."""
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    history = coordinator.history
+    intervals = coordinator.intervals
+
+    return {
+        # La configurazione contiene solo entità e parametri: nessun dato da oscurare.
+        "config": dict(entry.data),
+        "history": {
+            "storage_format": coordinator.config.get(CONF_STORAGE_FORMAT, STORAGE_FORMAT_JOURNAL),
+            # False finché i sensori lavorano sul solo riepilogo
+            "loaded": history.loaded,
+            "records": history.count,
+            "last_date": history.last_date,
+            "checksum": format(history.checksum, "x"),
+        },
+        "intervals": None if intervals is None else {
+            "slot_minutes": intervals.slot_minutes,
+            "slots": len(intervals),
+        },
+        "values": {
+            "current_price": coordinator.current_price,
+            "monthly_energy": coordinator.monthly_energy,
+            "monthly_cost": coordinator.monthly_cost,
+            "weekly_energy": coordinator.weekly_energy,
+            "yearly_energy": coordinator.yearly_energy,
+            "rolling_energy": coordinator.rolling_energy,
+            "average_energy": dict(coordinator.average_energy),
+            "last_year_energy": coordinator.last_year_energy,
+            "forecast_energy": coordinator.forecast_energy,
+            "forecast_cost": coordinator.forecast_cost,
+        },
+        "statistics_sync_progress": coordinator.stats_sync.progress,
+        "outliers": {
+            "window": len(coordinator.outliers),
+            "threshold": round(coordinator.outliers.threshold(), 3),
+            "quarantine": list(coordinator.outliers.quarantine),
+        },
+        "events": coordinator.events_summary(),
+        "metrics": coordinator.metrics.as_dict(),
+    }
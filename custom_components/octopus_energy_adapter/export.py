@@ -0,0 +1,170 @@
+"""
+Questo modulo esporta lo storico memorizzato in CSV o NDJSON (una riga JSON per lettura), insieme ai valori
+derivati: kWh del giorno (o dell'intervallo), prezzo in vigore, costo e totali progressivi.
+Le righe vengono prodotte a blocchi: ogni blocco individua la propria posizione con una ricerca binaria
+sull'indice ordinato (o sugli slot degli intervalli), quindi un filtro per date non scorre l'intero storico
+e l'esportazione di anni di intervalli non costruisce mai l'intero risultato in memoria.
+Tra un blocco e l'altro il loop di eventi resta libero di servire altre richieste.
+"""
+
+import asyncio
+import csv
+import io
+import json
+import os
+from bisect import bisect_left
+from datetime import date, timedelta
+
+from homeassistant.util import dt as dt_util
+
+from .index import ordinal_to_date
+
+EXPORT_FORMAT_CSV = "csv"
+EXPORT_FORMAT_NDJSON = "ndjson"
+EXPORT_FORMATS = (EXPORT_FORMAT_CSV, EXPORT_FORMAT_NDJSON)
+
+EXPORT_LEVEL_DAILY = "daily"
+EXPORT_LEVEL_INTERVAL = "interval"
+EXPORT_LEVELS = (EXPORT_LEVEL_DAILY, EXPORT_LEVEL_INTERVAL)
+
+# Righe per blocco: abbastanza per ammortizzare le ricerche binarie, poche per non trattenere il loop.
+EXPORT_CHUNK_ROWS = 1000
+
+# Colonne esportate. 'total_kwh' del giornaliero è il cumulativo memorizzato; 'cost_total' (e 'total_kwh'
+# degli intervalli) sono progressivi dall'inizio dell'intervallo esportato.
+DAILY_FIELDS = ("date", "kwh", "total_kwh", "price", "cost", "cost_total")
+INTERVAL_FIELDS = ("start", "end", "kwh", "total_kwh", "price", "cost", "cost_total")
+
+CONTENT_TYPES = {EXPORT_FORMAT_CSV: "text/csv", EXPORT_FORMAT_NDJSON: "application/x-ndjson"}
+
+def iter_daily_rows(index, prices, start=None, end=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Blocchi (liste) di righe giornaliere tra start ed end (date incluse, None = senza limite).
+    I kWh del primo giorno sono calcolati rispetto alla lettura precedente a 'start', come nei sensori.
+    """
+    first = start.toordinal() if start else 1
+    last = end.toordinal() if end else date.max.toordinal()
+    previous = index.value_at(first - 1)
+    cost_total = 0.0
+    while True:
+        records = index.records_between(first, last, chunk_rows)
+        if not records:
+            return
+        rows = []
+        for (ordinal, value), price in zip(records, prices.prices_for([o for o, _ in records])):
+            kwh = value - previous
+            previous = value
+            cost = kwh * price
+            cost_total += cost
+            rows.append({
+                "date": ordinal_to_date(ordinal),
+                "kwh": round(kwh, 3),
+                "total_kwh": round(value, 3),
+                "price": price,
+                "cost": round(cost, 4),
+                "cost_total": round(cost_total, 2),
+            })
+        yield rows
+        # Il blocco successivo riparte dal giorno dopo l'ultimo esportato (nuova ricerca binaria).
+        first = records[-1][0] + 1
+
+def iter_interval_rows(intervals, prices, start=None, end=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Blocchi (liste) di righe a intervalli dei giorni locali tra start ed end (inclusi, None = senza limite).
+    Il prezzo è quello in vigore nel giorno locale dell'intervallo, come nelle statistiche orarie.
+    """
+    cursor = intervals.slot_for(dt_util.start_of_local_day(start)) if start else float("-inf")
+    stop = intervals.slot_for(dt_util.start_of_local_day(end + timedelta(days=1))) if end else float("inf")
+    slot_duration = timedelta(seconds=intervals.slot_seconds)
+    total = cost_total = 0.0
+    price_day = price = None
+    while True:
+        i = bisect_left(intervals.slots, cursor)
+        j = min(bisect_left(intervals.slots, stop), i + chunk_rows)
+        if i >= j:
+            return
+        rows = []
+        for k in range(i, j):
+            slot_start = dt_util.as_local(intervals.slot_start(intervals.slots[k]))
+            day = slot_start.date()
+            if day != price_day:
+                price_day, price = day, prices.price_on(day.toordinal())
+            kwh = intervals.values[k]
+            total += kwh
+            cost = kwh * price
+            cost_total += cost
+            rows.append({
+                "start": slot_start.isoformat(),
+                "end": (slot_start + slot_duration).isoformat(),
+                "kwh": round(kwh, 3),
+                "total_kwh": round(total, 3),
+                "price": price,
+                "cost": round(cost, 4),
+                "cost_total": round(cost_total, 2),
+            })
+        yield rows
+        cursor = intervals.slots[j - 1] + 1
+
+def format_rows(rows, export_format, fields, header=False):
+    """Testo di un blocco di righe nel formato richiesto (con l'intestazione CSV se 'header')."""
+    if export_format == EXPORT_FORMAT_NDJSON:
+        return "".join(json.dumps(row) + "\n" for row in rows)
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields, lineterminator="\n")
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buf.getvalue()
+
+async def async_iter_export(coordinator, export_format=EXPORT_FORMAT_CSV, level=EXPORT_LEVEL_DAILY, start=None, end=None):
+    """
+    Testo dell'esportazione di una entry, un blocco alla volta.
+    Solleva ValueError se il livello a intervalli è richiesto per una entry con letture giornaliere.
+    """
+    if level == EXPORT_LEVEL_INTERVAL:
+        if coordinator.intervals is None:
+            raise ValueError("La entry non registra letture a intervalli")
+        chunks = iter_interval_rows(coordinator.intervals, coordinator.prices, start, end)
+        fields = INTERVAL_FIELDS
+    else:
+        await coordinator.history.async_ensure_loaded()
+        chunks = iter_daily_rows(coordinator.history.index, coordinator.prices, start, end)
+        fields = DAILY_FIELDS
+
+    header = export_format == EXPORT_FORMAT_CSV
+    if header:
+        yield format_rows([], export_format, fields, header=True)
+    for rows in chunks:
+        yield format_rows(rows, export_format, fields)
+        # Lascia spazio agli altri task del loop tra un blocco e l'altro.
+        await asyncio.sleep(0)
+
+def export_filename(export_format, level, start=None, end=None):
+    """Nome di file suggerito per l'esportazione (es. octopus_daily_2024-01-01_2024-12-31.csv)."""
+    parts = ["octopus", level]
+    if start or end:
+        parts.append(f"{start or 'inizio'}_{end or 'oggi'}")
+    return f"{'_'.join(str(p) for p in parts)}.{export_format}"
+
+async def async_write_export(coordinator, path, export_format=EXPORT_FORMAT_CSV, level=EXPORT_LEVEL_DAILY, start=None, end=None):
+    """
+    Scrive l'esportazione su file, blocco per blocco, sul thread di I/O della entry
+    (file temporaneo + rinomina atomica). Restituisce il numero di caratteri scritti.
+    """
+    tmp_path = f"{path}.tmp"
+    f = await coordinator.io.async_run(_open_export_sync, tmp_path)
+    written = 0
+    try:
+        async for text in async_iter_export(coordinator, export_format, level, start, end):
+            written += await coordinator.io.async_run(f.write, text)
+    except BaseException:
+        await coordinator.io.async_run(f.close)
+        await coordinator.io.async_run(os.remove, tmp_path)
+        raise
+    await coordinator.io.async_run(f.close)
+    await coordinator.io.async_run(os.replace, tmp_path, path)
+    return written
+
+def _open_export_sync(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, 'w', encoding='utf-8', newline='')
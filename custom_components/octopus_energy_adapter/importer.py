@@ -0,0 +1,259 @@
+"""
+Questo modulo legge i file di esportazione dei consumi (CSV o JSON-lines) per l'importazione dello storico.
+Il file viene letto riga per riga senza caricarlo interamente in memoria: le letture giornaliere
+confluiscono in un dizionario {data: kWh} (un elemento per giorno) e quelle a intervalli in due array
+tipizzati (slot, kWh), quindi anche file pluriennali da centinaia di migliaia di righe occupano poca memoria.
+Gli intervalli del file possono essere più fini dello slot della entry (es. esportazione semioraria in una
+entry oraria): i kWh degli intervalli dello stesso slot vengono sommati. Intervalli più lunghi dello slot
+non possono essere suddivisi e il file viene scartato.
+Tutte le funzioni sono sincrone e vanno eseguite sul thread di I/O della entry.
+"""
+
+import csv
+import json
+import logging
+from array import array
+from datetime import datetime, timedelta
+
+from homeassistant.util import dt as dt_util
+
+from .const import MAX_READING_KWH
+
+_LOGGER = logging.getLogger(__name__)
+
+# Nomi di colonna riconosciuti (confronto senza maiuscole e spazi), in ordine di preferenza
+DATE_COLUMNS = ("date", "data", "day", "giorno")
+START_COLUMNS = ("start", "interval_start", "inizio", "from", "dalle")
+END_COLUMNS = ("end", "interval_end", "fine", "to", "alle")
+VALUE_COLUMNS = ("kwh", "consumption", "consumo", "value", "valore", "energia")
+
+# Righe scartate riportate singolarmente nel log prima di passare al solo conteggio
+MAX_LOGGED_REJECTS = 20
+
+def _pick(row, candidates):
+    """Valore della prima colonna presente tra i nomi candidati (None se nessuna è presente o è vuota)."""
+    for name in candidates:
+        value = row.get(name)
+        if value not in (None, ""):
+            return value
+    return None
+
+def _parse_number(value):
+    """Numero dal file: accetta anche la virgola decimale delle esportazioni italiane."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    if "," in text and "." not in text:
+        text = text.replace(",", ".")
+    return float(text)
+
+def _parse_day(value):
+    """Data nei formati ISO (YYYY-MM-DD) o del sensore Octopus (DD/MM/YYYY)."""
+    text = str(value).strip()[:10]
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"data non riconosciuta: {value!r}")
+
+def _parse_moment(value):
+    """Data e ora ISO o 'DD/MM/YYYY HH:MM'; senza fuso viene usata l'ora locale di Home Assistant."""
+    text = str(value).strip()
+    moment = dt_util.parse_datetime(text)
+    if moment is None:
+        moment = datetime.strptime(text, "%d/%m/%Y %H:%M")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=dt_util.DEFAULT_TIME_ZONE)
+    return moment
+
+def parse_import_row(row):
+    """
+    Interpreta una riga (dizionario con le chiavi già normalizzate) dell'esportazione.
+    Restituisce ("day", data, kWh) per le letture giornaliere, ("start", inizio, kWh) per gli intervalli
+    con l'orario di inizio oppure ("end", fine, kWh) per quelli con il solo orario di fine: la durata
+    dell'intervallo si ricava dall'intero file (vedi _interval_seconds).
+    Solleva ValueError se la riga non è valida o non supera la protezione spike.
+    """
+    if row is None:
+        raise ValueError("riga non interpretabile")
+    value = _pick(row, VALUE_COLUMNS)
+    if value is None:
+        raise ValueError("colonna dei kWh mancante")
+    kwh = _parse_number(value)
+    if kwh < 0:
+        raise ValueError(f"lettura negativa anomala: {kwh}")
+    if kwh > MAX_READING_KWH:
+        raise ValueError(f"lettura sospetta troppo alta: {kwh} kWh")
+
+    start = _pick(row, START_COLUMNS)
+    end = _pick(row, END_COLUMNS)
+    if start is not None:
+        return "start", _parse_moment(start), kwh
+    if end is not None:
+        return "end", _parse_moment(end), kwh
+
+    day = _pick(row, DATE_COLUMNS)
+    if day is None:
+        raise ValueError("colonna della data mancante")
+    return "day", _parse_day(day), kwh
+
+def _normalize(row):
+    return {str(k).strip().lower(): v for k, v in row.items() if k is not None}
+
+def iter_import_rows(path):
+    """
+    Righe del file come dizionari con chiavi normalizzate (None se la riga non è interpretabile),
+    lette una alla volta.
+    I file .jsonl/.ndjson/.json contengono un oggetto JSON per riga; gli altri sono CSV
+    con separatore rilevato automaticamente (',' oppure ';').
+    """
+    if path.lower().endswith((".jsonl", ".ndjson", ".json")):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                # Le righe non valide vengono passate come None e scartate da parse_import_row.
+                yield _normalize(row) if isinstance(row, dict) else None
+        return
+
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        for row in csv.DictReader(f, dialect=dialect):
+            yield _normalize(row)
+
+def _sorted_by_moment(moments, values):
+    """Ordina le letture per istante (ordinamento stabile: le righe ripetute restano nell'ordine del file)."""
+    if any(a > b for a, b in zip(moments, moments[1:])):
+        order = sorted(range(len(moments)), key=moments.__getitem__)
+        moments = array('d', (moments[i] for i in order))
+        values = array('d', (values[i] for i in order))
+    return moments, values
+
+def _interval_seconds(*moment_arrays):
+    """
+    Durata (secondi) degli intervalli del file: la minima distanza positiva tra due istanti consecutivi
+    (già ordinati) della stessa colonna. None se il file non ha almeno due istanti distinti.
+    """
+    gaps = [b - a for moments in moment_arrays for a, b in zip(moments, moments[1:]) if b > a]
+    return int(min(gaps)) if gaps else None
+
+def _merge_slots(moments, values, slot_seconds):
+    """
+    Raggruppa per slot le letture ordinate per istante di inizio.
+    Un istante ripetuto sostituisce il valore precedente (riga duplicata o corretta nel file); istanti diversi
+    dello stesso slot (intervalli più fini dello slot) vengono sommati.
+    Restituisce (slot, kWh, righe sostituite, righe sommate).
+    """
+    slots = array('d')
+    totals = array('d')
+    replaced = merged = 0
+    last_moment = last_kwh = None
+    for moment, kwh in zip(moments, values):
+        slot = float(int(moment) // slot_seconds)
+        if moment == last_moment:
+            replaced += 1
+            totals[-1] += kwh - last_kwh
+        elif slots and slots[-1] == slot:
+            merged += 1
+            totals[-1] += kwh
+        else:
+            slots.append(slot)
+            totals.append(kwh)
+        last_moment, last_kwh = moment, kwh
+    # Arrotondamento solo contro il rumore delle somme in virgola mobile (i valori del file restano invariati).
+    return slots, array('d', (round(total, 6) for total in totals)), replaced, merged
+
+def read_import_file_sync(path, slot_minutes=None):
+    """
+    Legge e valida l'intero file in streaming.
+    Con slot_minutes=None (modalità giornaliera) gli intervalli vengono sommati per giorno locale;
+    altrimenti vengono restituiti come array ordinati di slot (indice dall'epoca Unix) e kWh, con gli
+    intervalli più fini dello slot sommati (vedi _merge_slots).
+    Restituisce un dizionario con 'daily' ({data ISO: kWh}), 'slots', 'values', 'rows', 'rejected'
+    e 'merged' (righe sommate a un'altra dello stesso slot).
+    """
+    daily = {}
+    interval_days = {}
+    # Istanti (secondi dall'epoca) e kWh degli intervalli, separati per colonna di inizio o di fine
+    starts, start_values = array('d'), array('d')
+    ends, end_values = array('d'), array('d')
+    rows = rejected = 0
+    slot_seconds = slot_minutes * 60 if slot_minutes else None
+
+    for line, row in enumerate(iter_import_rows(path), start=1):
+        rows += 1
+        try:
+            kind, moment, kwh = parse_import_row(row)
+        except (ValueError, TypeError, KeyError) as e:
+            rejected += 1
+            if rejected <= MAX_LOGGED_REJECTS:
+                _LOGGER.warning(f"Importazione: riga {line} scartata ({e})")
+            continue
+
+        if kind == "day":
+            daily[moment.isoformat()] = kwh
+        elif slot_seconds is None:
+            # Basta collocare l'intervallo nel giorno giusto: con il solo orario di fine, un istante prima.
+            if kind == "end":
+                moment -= timedelta(seconds=1)
+            day = dt_util.as_local(moment).date().isoformat()
+            interval_days[day] = interval_days.get(day, 0.0) + kwh
+        elif kind == "start":
+            starts.append(moment.timestamp())
+            start_values.append(kwh)
+        else:
+            ends.append(moment.timestamp())
+            end_values.append(kwh)
+
+    # Modalità giornaliera: il totale di un giorno ricavato dagli intervalli deve rispettare lo stesso limite.
+    for day, kwh in interval_days.items():
+        if kwh > MAX_READING_KWH:
+            rejected += 1
+            _LOGGER.warning(f"Importazione: giorno {day} scartato (totale sospetto troppo alto: {round(kwh, 3)} kWh)")
+            continue
+        daily[day] = round(kwh, 3)
+
+    if rejected > MAX_LOGGED_REJECTS:
+        _LOGGER.warning(f"Importazione: {rejected} righe scartate in totale")
+
+    slots, values = array('d'), array('d')
+    merged = 0
+    if starts or ends:
+        starts, start_values = _sorted_by_moment(starts, start_values)
+        ends, end_values = _sorted_by_moment(ends, end_values)
+        interval = _interval_seconds(starts, ends) or slot_seconds
+        if interval > slot_seconds or slot_seconds % interval:
+            # Un intervallo più lungo dello slot (o non suo divisore) andrebbe ripartito su più slot senza
+            # conoscere la distribuzione dei consumi: meglio scartare le righe che importare dati falsati.
+            rejected += len(starts) + len(ends)
+            _LOGGER.error(
+                f"Importazione: intervalli di {interval // 60} minuti non compatibili con la granularità della entry "
+                f"({slot_minutes} minuti): {len(starts) + len(ends)} righe a intervalli scartate"
+            )
+        else:
+            # Con il solo orario di fine l'inizio è la fine meno la durata degli intervalli del file.
+            moments = starts + array('d', (end - interval for end in ends))
+            moments, values = _sorted_by_moment(moments, start_values + end_values)
+            slots, values, replaced, merged = _merge_slots(moments, values, slot_seconds)
+            if merged:
+                _LOGGER.info(
+                    f"Importazione: intervalli di {interval // 60} minuti sommati negli slot di {slot_minutes} minuti "
+                    f"({merged} righe sommate)"
+                )
+            if replaced:
+                _LOGGER.warning(f"Importazione: {replaced} righe con lo stesso orario di una precedente (vale l'ultima)")
+
+    return {
+        "daily": daily, "slots": slots, "values": values, "rows": rows, "rejected": rejected, "merged": merged,
+    }
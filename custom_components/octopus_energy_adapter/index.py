@@ -0,0 +1,342 @@
+"""
+Questo modulo contiene l'indice ordinato dello storico.
+Le date sono memorizzate come ordinali (giorni dall'anno 1) in una lista ordinata, affiancata dai
+totali cumulativi: essendo il cumulativo già una somma prefissa dei consumi giornalieri, il consumo
+tra due date si ottiene con due ricerche binarie (bisect) e una sottrazione, senza riordinare nulla.
+Le correzioni retroattive (un giorno già registrato che cambia valore) spostano tutti i cumulativi successivi:
+lo spostamento viene registrato in un albero di Fenwick in O(log n) invece di riscrivere la coda dell'indice.
+"""
+
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+
+_LOGGER = logging.getLogger(__name__)
+
+def date_to_ordinal(date_str):
+    """Converte una data 'YYYY-MM-DD' nel suo ordinale (intero crescente giorno per giorno)."""
+    return date.fromisoformat(date_str).toordinal()
+
+def ordinal_to_date(ordinal):
+    """Operazione inversa di date_to_ordinal."""
+    return date.fromordinal(ordinal).isoformat()
+
+class FenwickTree:
+    """
+    Albero di Fenwick (Binary Indexed Tree) con aggiornamento su intervallo e lettura puntuale:
+    add_from(i, delta) somma delta a tutte le posizioni >= i, point(i) restituisce la somma applicata
+    alla posizione i. Entrambe le operazioni costano O(log n).
+    """
+
+    def __init__(self, size):
+        self._tree = [0.0] * (size + 1)
+
+    def __len__(self):
+        return len(self._tree) - 1
+
+    def append(self):
+        """Aggiunge una posizione in coda, che eredita gli spostamenti già applicati alle posizioni precedenti."""
+        i = len(self._tree)
+        # Il nodo i copre le posizioni (i - lowbit(i), i]: vale la somma delle differenze già registrate lì.
+        low = i - (i & -i)
+        self._tree.append(self._prefix(i - 1) - self._prefix(low))
+
+    def _prefix(self, i):
+        total = 0.0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def add_from(self, pos, delta):
+        """Somma delta a tutte le posizioni >= pos (base 0)."""
+        i = pos + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def point(self, pos):
+        """Spostamento totale applicato alla posizione pos (base 0)."""
+        return self._prefix(pos + 1)
+
+class HistoryIndex:
+    """
+    Indice ordinato (ordinali dei giorni + totali cumulativi) costruito una sola volta
+    dallo storico e poi aggiornato ad ogni nuova lettura.
+    Tutte le interrogazioni per periodo costano O(log n).
+    Il cumulativo della posizione i è _values[i] più lo spostamento registrato in _offsets (se presente).
+    """
+
+    def __init__(self):
+        self._ordinals = []
+        self._values = []
+        # Spostamenti dovuti alle correzioni retroattive (None finché non ce ne sono)
+        # e prima posizione spostata: quelle precedenti non hanno spostamenti da consolidare.
+        self._offsets = None
+        self._shifted_from = None
+
+    @classmethod
+    def from_data(cls, data):
+        """Costruisce l'indice da un dizionario {data: cumulativo}. Unico ordinamento dell'intero storico."""
+        index = cls()
+        pairs = []
+        for date_str, value in data.items():
+            try:
+                pairs.append((date_to_ordinal(date_str), float(value)))
+            except (ValueError, TypeError) as e:
+                _LOGGER.warning(f"Lettura ignorata dall'indice per data {date_str}: {e}")
+        pairs.sort()
+        index._ordinals = [o for o, _ in pairs]
+        index._values = [v for _, v in pairs]
+        return index
+
+    @classmethod
+    def from_columns(cls, ordinals, values):
+        """
+        Costruisce l'indice su due sequenze già ordinate (es. le colonne del file binario mappato in memoria).
+        Nessuna copia né ordinamento: le ricerche binarie leggono direttamente le sequenze, che vengono
+        convertite in liste solo alla prima modifica.
+        """
+        index = cls()
+        index._ordinals = ordinals
+        index._values = values
+        return index
+
+    def _materialize(self):
+        """Converte in liste le colonne in sola lettura (una volta sola, alla prima modifica)."""
+        if not isinstance(self._ordinals, list):
+            self._ordinals = list(self._ordinals)
+            self._values = list(self._values)
+
+    def _fold(self):
+        """Riporta gli spostamenti nei valori (O(n)): necessario solo prima di inserire un giorno in mezzo."""
+        if self._offsets is not None:
+            self._values = [self._value(pos) for pos in range(len(self._values))]
+            self._offsets = None
+            self._shifted_from = None
+
+    def _value(self, pos):
+        """Cumulativo della posizione pos, comprensivo degli spostamenti delle correzioni."""
+        if pos < 0:
+            pos += len(self._values)
+        if self._offsets is None:
+            return self._values[pos]
+        return self._values[pos] + self._offsets.point(pos)
+
+    def _values_from(self, pos):
+        """Cumulativi dalla posizione pos in avanti."""
+        if self._offsets is None:
+            return self._values[pos:]
+        return [self._value(i) for i in range(pos, len(self._values))]
+
+    def __len__(self):
+        return len(self._ordinals)
+
+    def set(self, date_str, value):
+        """
+        Inserisce o aggiorna una lettura.
+        Il caso tipico (giorno successivo all'ultimo) è un append in O(1).
+        Restituisce il valore memorizzato in precedenza per quel giorno, senza gli spostamenti non ancora
+        consolidati (None se il giorno è nuovo): è il valore che apply_offsets() avrebbe riportato come precedente.
+        """
+        ordinal = date_to_ordinal(date_str)
+        value = float(value)
+        self._materialize()
+        if not self._ordinals or ordinal > self._ordinals[-1]:
+            self._ordinals.append(ordinal)
+            self._values.append(value)
+            if self._offsets is not None:
+                self._offsets.append()
+                self._clear_offset(len(self._values) - 1)
+            return None
+        pos = bisect_left(self._ordinals, ordinal)
+        if pos < len(self._ordinals) and self._ordinals[pos] == ordinal:
+            previous = self._values[pos]
+            self._values[pos] = value
+            if self._offsets is not None:
+                self._clear_offset(pos)
+            return previous
+        # Inserimento in mezzo: le posizioni successive scorrono, gli spostamenti vanno prima consolidati.
+        self._fold()
+        self._ordinals.insert(pos, ordinal)
+        self._values.insert(pos, value)
+        return None
+
+    def _clear_offset(self, pos):
+        """Azzera lo spostamento della sola posizione pos (il suo valore è stato appena impostato), in O(log n)."""
+        shift = self._offsets.point(pos)
+        if shift:
+            self._offsets.add_from(pos, -shift)
+            self._offsets.add_from(pos + 1, shift)
+
+    def shift_after(self, day, delta):
+        """
+        Somma delta ai cumulativi di tutte le letture successive al giorno 'day' in O(log n):
+        è l'effetto di una correzione (o di un inserimento retroattivo) del consumo di quel giorno.
+        """
+        self._materialize()
+        pos = bisect_right(self._ordinals, day.toordinal())
+        if pos >= len(self._ordinals) or not delta:
+            return
+        if self._offsets is None:
+            self._offsets = FenwickTree(len(self._values))
+        self._offsets.add_from(pos, delta)
+        self._shifted_from = pos if self._shifted_from is None else min(self._shifted_from, pos)
+
+    def apply_offsets(self, ndigits=None):
+        """
+        Riporta nei valori gli spostamenti delle correzioni (arrotondati a 'ndigits' decimali, se indicato)
+        e restituisce le terne (ordinale, valore precedente, valore nuovo) delle letture cambiate.
+        Legge solo le posizioni dalla prima spostata: O(k log n) per le k letture successive alla correzione
+        più vecchia, una volta sola per tutte le correzioni registrate nel frattempo.
+        """
+        if self._offsets is None:
+            return []
+        changed = []
+        for pos in range(self._shifted_from, len(self._values)):
+            shift = self._offsets.point(pos)
+            if not shift:
+                continue
+            previous = self._values[pos]
+            value = previous + shift
+            if ndigits is not None:
+                value = round(value, ndigits)
+            self._values[pos] = value
+            if value != previous:
+                changed.append((self._ordinals[pos], previous, value))
+        self._offsets = None
+        self._shifted_from = None
+        return changed
+
+    def replace_from(self, day, records):
+        """
+        Sostituisce tutte le letture dal giorno 'day' in avanti con 'records' (coppie ordinate
+        ordinale/cumulativo). È l'operazione delle importazioni massive: un'unica ricostruzione della coda
+        al posto di un inserimento e uno spostamento per ogni giorno.
+        """
+        self._materialize()
+        self._fold()
+        pos = bisect_left(self._ordinals, day.toordinal())
+        del self._ordinals[pos:]
+        del self._values[pos:]
+        self._ordinals.extend(o for o, _ in records)
+        self._values.extend(float(v) for _, v in records)
+
+    def drop_before(self, day, keep=()):
+        """
+        Elimina le letture precedenti al giorno 'day', tranne quelle con ordinale in 'keep'.
+        I cumulativi delle letture conservate non cambiano. Restituisce gli ordinali eliminati.
+        """
+        self._materialize()
+        self._fold()
+        pos = bisect_left(self._ordinals, day.toordinal())
+        removed = [o for o in self._ordinals[:pos] if o not in keep]
+        if removed:
+            kept = [(o, v) for o, v in zip(self._ordinals[:pos], self._values[:pos]) if o in keep]
+            self._ordinals[:pos] = [o for o, _ in kept]
+            self._values[:pos] = [v for _, v in kept]
+        return removed
+
+    def records_after(self, day):
+        """Coppie (ordinale, cumulativo) delle letture successive al giorno 'day'."""
+        pos = bisect_right(self._ordinals, day.toordinal())
+        return list(zip(self._ordinals[pos:], self._values_from(pos)))
+
+    def last(self):
+        """Restituisce (data, cumulativo) dell'ultima lettura, oppure None se l'indice è vuoto."""
+        if not self._ordinals:
+            return None
+        return ordinal_to_date(self._ordinals[-1]), self._value(-1)
+
+    def first(self):
+        """Restituisce (data, cumulativo) della prima lettura, oppure None se l'indice è vuoto."""
+        if not self._ordinals:
+            return None
+        return ordinal_to_date(self._ordinals[0]), self._value(0)
+
+    def records_since(self, start):
+        """
+        Coppie (ordinale, cumulativo) dal giorno 'start' in avanti, precedute dall'ultima lettura precedente:
+        sono sufficienti per rispondere esattamente a value_at() per qualsiasi giorno >= start.
+        """
+        pos = max(bisect_left(self._ordinals, start.toordinal()) - 1, 0)
+        return list(zip(self._ordinals[pos:], self._values_from(pos)))
+
+    def records_between(self, first, last, limit=None):
+        """
+        Coppie (ordinale, cumulativo) con ordinale compreso tra first e last (inclusi), al più 'limit'.
+        Le posizioni si trovano con due ricerche binarie: leggere un intervallo non scorre l'intero storico.
+        """
+        i = bisect_left(self._ordinals, first)
+        j = bisect_right(self._ordinals, last)
+        if limit is not None:
+            j = min(j, i + limit)
+        if self._offsets is None:
+            return list(zip(self._ordinals[i:j], self._values[i:j]))
+        return [(self._ordinals[pos], self._value(pos)) for pos in range(i, j)]
+
+    def last_value(self):
+        """Totale cumulativo più recente (0.0 se non ci sono letture)."""
+        return self._value(-1) if self._values else 0.0
+
+    def value_at(self, day):
+        """
+        Totale cumulativo dell'ultima lettura con data <= day (0.0 se non esiste).
+        'day' può essere un oggetto date oppure un ordinale.
+        """
+        ordinal = day if isinstance(day, int) else day.toordinal()
+        pos = bisect_right(self._ordinals, ordinal)
+        return self._value(pos - 1) if pos else 0.0
+
+    def day_value(self, day):
+        """kWh registrati nel giorno 'day' (differenza con la lettura precedente), None se il giorno non è presente."""
+        pos = bisect_left(self._ordinals, day.toordinal())
+        if pos >= len(self._ordinals) or self._ordinals[pos] != day.toordinal():
+            return None
+        return self._value(pos) - (self._value(pos - 1) if pos else 0.0)
+
+    def total_between(self, start, end):
+        """Consumo tra le date start ed end (incluse): differenza tra due somme prefisse."""
+        if end < start:
+            return 0.0
+        return round(self.value_at(end) - self.value_at(start - timedelta(days=1)), 3)
+
+    def total_since(self, start):
+        """
+        Consumo dall'inizio del giorno 'start' all'ultima lettura disponibile.
+        È lo stesso calcolo storico del sensore mensile: ultimo totale meno l'ultima lettura precedente a 'start'.
+        """
+        if not self._values:
+            return 0.0
+        return round(self._value(-1) - self.value_at(start - timedelta(days=1)), 3)
+
+    def daily_since(self, start):
+        """
+        Coppie (ordinale, kWh del giorno) per le letture dal giorno 'start' in avanti.
+        I kWh sono la differenza con la lettura precedente; la posizione di partenza si trova con bisect.
+        """
+        pos = bisect_left(self._ordinals, start.toordinal())
+        previous = self._value(pos - 1) if pos else 0.0
+        for ordinal, value in zip(self._ordinals[pos:], self._values_from(pos)):
+            yield ordinal, value - previous
+            previous = value
+
+    def month_to_date(self, today=None):
+        """Consumo dal primo giorno del mese corrente."""
+        today = today or date.today()
+        return self.total_since(today.replace(day=1))
+
+    def year_to_date(self, today=None):
+        """Consumo dal primo gennaio dell'anno corrente."""
+        today = today or date.today()
+        return self.total_since(today.replace(month=1, day=1))
+
+    def week_to_date(self, today=None):
+        """Consumo dal lunedì della settimana corrente."""
+        today = today or date.today()
+        return self.total_since(today - timedelta(days=today.weekday()))
+
+    def rolling(self, days, today=None):
+        """Consumo degli ultimi 'days' giorni, oggi compreso."""
+        today = today or date.today()
+        return self.total_since(today - timedelta(days=days - 1))
@@ -0,0 +1,169 @@
+"""
+Questo modulo contiene la strumentazione dei percorsi critici dell'integrazione: durate (caricamento e
+salvataggio dello storico, interrogazioni dell'indice, costruzione e invio delle statistiche, gestione
+degli eventi), byte letti e scritti, righe inviate al Recorder ed eventi accorpati o scartati.
+I valori sono raccolti in istogrammi a bucket fissi (memoria costante) ed esposti dal download
+di diagnostica (diagnostics.py) e dai sensori diagnostici opzionali.
+Con la strumentazione disattivata (predefinito) ogni chiamata termina al primo controllo:
+nessuna lettura dell'orologio, nessuna allocazione e nessun accesso al disco.
+"""
+
+import os
+import time
+
+# Limiti superiori dei bucket degli istogrammi (l'ultimo bucket raccoglie i valori oltre l'ultimo limite)
+DURATION_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000, 30000)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+ROWS_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000)
+
+class Histogram:
+    """Istogramma a bucket fissi con conteggio, somma, minimo, massimo e ultimo valore osservato."""
+
+    __slots__ = ("bounds", "buckets", "count", "total", "min", "max", "last")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.last = value
+
+    def as_dict(self):
+        labels = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "mean": round(self.total / self.count, 3) if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "last": self.last,
+            "buckets": dict(zip(labels, self.buckets)),
+        }
+
+class _NullTimer:
+    """Cronometro della strumentazione disattivata: non legge nemmeno l'orologio."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    """Misura la durata (ms) del blocco 'with', anche se contiene degli await, e la registra nell'istogramma."""
+
+    __slots__ = ("_metrics", "_name", "_start")
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._metrics.observe(self._name, (time.perf_counter() - self._start) * 1000, DURATION_BUCKETS_MS)
+        return False
+
+class Metrics:
+    """
+    Contatori e istogrammi di una entry. Tutti i metodi sono chiamati dal loop di eventi.
+    Con 'enabled' False le chiamate non registrano nulla (vedi NULL_METRICS).
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, n=1):
+        """Incrementa il contatore 'name'."""
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value, bounds=DURATION_BUCKETS_MS):
+        """Registra un valore nell'istogramma 'name' (creato al primo uso con i bucket indicati)."""
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(bounds)
+        histogram.observe(value)
+
+    def timer(self, name):
+        """Cronometro da usare con 'with': la durata del blocco finisce nell'istogramma 'name' (ms)."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def last(self, name):
+        """Ultimo valore osservato dall'istogramma 'name' (None se mai osservato o strumentazione disattivata)."""
+        histogram = self.histograms.get(name)
+        return round(histogram.last, 3) if histogram is not None else None
+
+    def total(self, name):
+        """Somma dei valori osservati dall'istogramma 'name' (0 se mai osservato)."""
+        histogram = self.histograms.get(name)
+        return round(histogram.total, 3) if histogram is not None else 0
+
+    def coalesced(self, events, *handled):
+        """Eventi 'events' che non hanno prodotto un'elaborazione propria (accorpati o scartati)."""
+        return max(0, self.counters.get(events, 0) - sum(self.counters.get(name, 0) for name in handled))
+
+    def as_dict(self):
+        return {
+            "enabled": self.enabled,
+            "counters": dict(sorted(self.counters.items())),
+            "histograms": {name: h.as_dict() for name, h in sorted(self.histograms.items())},
+        }
+
+# Strumentazione disattivata condivisa: valore predefinito per chi non riceve una Metrics propria.
+NULL_METRICS = Metrics(enabled=False)
+
+def file_stamps_sync(paths):
+    """
+    Dimensione e inode dei file indicati (solo quelli esistenti), da confrontare prima e dopo una scrittura.
+    Va eseguito sul thread di I/O.
+    """
+    stamps = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stamps[path] = (st.st_size, st.st_ino)
+    return stamps
+
+def bytes_written(before, after):
+    """
+    Stima dei byte scritti tra due rilevazioni di file_stamps_sync: un file sostituito (inode diverso, scrittura
+    atomica) conta per l'intera dimensione, un file a cui sono state accodate righe conta per la sola crescita
+    (un record riscritto sul posto non cambia la dimensione e non viene contato).
+    """
+    written = 0
+    for path, (size, inode) in after.items():
+        old = before.get(path)
+        if old is None or old[1] != inode:
+            written += size
+        else:
+            written += max(0, size - old[0])
+    return written
@@ -0,0 +1,219 @@
+"""
+Questo modulo gestisce lo storico dei prezzi dell'energia.
+Ogni cambio di tariffa viene registrato come 'punto di cambio' (data, prezzo) e salvato su file
+(scrittura differita, come lo storico), così il costo di ogni giorno viene calcolato con il prezzo in vigore in quel giorno
+invece che con il prezzo attuale.
+"""
+
+import json
+import os
+import logging
+from bisect import bisect_right
+from datetime import date
+
+from homeassistant.core import callback
+
+from .const import CONF_PRICE_TYPE, CONF_FIXED_PRICE, CONF_PRICE_SENSOR, PRICE_TYPE_FIXED
+from .index import date_to_ordinal, ordinal_to_date
+from .storage import DelayedSaveStore, SAVE_DELAY, async_run_io, entry_path
+
+_LOGGER = logging.getLogger(__name__)
+
+# File dei punti di cambio prezzo, relativo alla cartella /config di Home Assistant (una copia per entry)
+PRICES_FILE = "octopus_data/octopus_prices.json"
+
+def load_prices_sync(hass, entry_id=None):
+    """Legge i punti di cambio prezzo [[data, prezzo], ...]. Restituisce una lista vuota se il file manca o è corrotto."""
+    path = entry_path(hass, PRICES_FILE, entry_id)
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        _LOGGER.error(f"Errore durante la lettura dello storico prezzi: {e}")
+        return []
+
+def save_prices_sync(hass, points, entry_id=None):
+    """Salva i punti di cambio prezzo con scrittura atomica. Restituisce False se la scrittura non è riuscita."""
+    path = entry_path(hass, PRICES_FILE, entry_id)
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(points, f, indent=4)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        _LOGGER.error(f"Errore durante il salvataggio dello storico prezzi: {e}")
+        return False
+
+def get_configured_price(hass, config):
+    """
+    Prezzo attuale secondo la configurazione (fisso o letto dal sensore).
+    Restituisce None se il sensore di prezzo non è disponibile: in quel caso non va registrato alcun cambio.
+    """
+    if config.get(CONF_PRICE_TYPE) == PRICE_TYPE_FIXED:
+        return float(config.get(CONF_FIXED_PRICE, 0.0))
+
+    p_src = config.get(CONF_PRICE_SENSOR)
+    if p_src:
+        st = hass.states.get(p_src)
+        if st and st.state not in ["unknown", "unavailable"]:
+            try:
+                return float(st.state)
+            except ValueError:
+                return None
+    return None
+
+class PriceHistory(DelayedSaveStore):
+    """
+    Prezzo in funzione del giorno: una funzione a gradini definita dai punti di cambio.
+    Il prezzo di un giorno è quello dell'ultimo cambio con data <= giorno (ricerca binaria);
+    i giorni precedenti al primo cambio usano il primo prezzo noto.
+    La granularità è giornaliera: un giorno ha un solo prezzo, anche per le letture a intervalli.
+    I cambi vengono salvati con scrittura differita (vedi DelayedSaveStore): più cambi ravvicinati, una sola scrittura.
+    """
+
+    METRICS_NAME = "prices"
+
+    def __init__(self, hass, entry_id=None, io=None, save_delay=SAVE_DELAY, metrics=None):
+        super().__init__(hass, save_delay, io, metrics)
+        self.entry_id = entry_id
+        self._ordinals = []
+        self._prices = []
+        # Prezzi effettivi dei giorni che riassumono un mese compattato (vedi retention.py): {ordinale: prezzo}
+        self._overrides = {}
+
+    async def async_load(self):
+        """Carica i punti di cambio dal file e si registra per lo scarico finale allo spegnimento."""
+        points = await async_run_io(self.hass, self._io, load_prices_sync, self.hass, self.entry_id)
+        self._set_points(points)
+        self._async_listen_final_write()
+
+    def _metric_paths(self):
+        return [entry_path(self.hass, PRICES_FILE, self.entry_id)]
+
+    async def _async_write(self):
+        return await async_run_io(self.hass, self._io, save_prices_sync, self.hass, self.to_list(), self.entry_id)
+
+    def _set_points(self, points):
+        pairs = []
+        for date_str, price in points:
+            try:
+                pairs.append((date_to_ordinal(date_str), float(price)))
+            except (ValueError, TypeError) as e:
+                _LOGGER.warning(f"Punto di cambio prezzo ignorato ({date_str}): {e}")
+        pairs.sort()
+        self._ordinals = [o for o, _ in pairs]
+        self._prices = [p for _, p in pairs]
+
+    def set_overrides(self, overrides):
+        """
+        Imposta i prezzi effettivi dei mesi compattati {ordinale: prezzo}: il consumo dell'intero mese
+        per il suo prezzo medio ponderato restituisce esattamente il costo originale del mese.
+        """
+        self._overrides = dict(overrides)
+
+    def __bool__(self):
+        return bool(self._ordinals)
+
+    def to_list(self):
+        """Punti di cambio in formato serializzabile [[data, prezzo], ...]."""
+        return [[ordinal_to_date(o), p] for o, p in zip(self._ordinals, self._prices)]
+
+    def price_on(self, ordinal):
+        """Prezzo in vigore nel giorno 'ordinal' (0.0 se non è mai stato registrato un prezzo)."""
+        if ordinal in self._overrides:
+            return self._overrides[ordinal]
+        return self._step_price(ordinal)
+
+    def _step_price(self, ordinal):
+        """Prezzo della funzione a gradini nel giorno 'ordinal', senza i prezzi effettivi dei mesi compattati."""
+        if not self._prices:
+            return 0.0
+        pos = bisect_right(self._ordinals, ordinal)
+        return self._prices[pos - 1] if pos else self._prices[0]
+
+    def prices_for(self, ordinals):
+        """Prezzi per una sequenza ordinata di giorni, con una sola ricerca binaria per cambio tariffa."""
+        if not self._prices:
+            return [0.0] * len(ordinals)
+        result = []
+        pos = None
+        for ordinal in ordinals:
+            if pos is None:
+                pos = max(bisect_right(self._ordinals, ordinal) - 1, 0)
+            while pos + 1 < len(self._ordinals) and self._ordinals[pos + 1] <= ordinal:
+                pos += 1
+            result.append(self._overrides.get(ordinal, self._prices[pos]))
+        return result
+
+    def cost_through(self, index, ordinal):
+        """
+        Costo cumulativo (non arrotondato) delle letture dell'indice fino al giorno 'ordinal' incluso, senza scorrere i giorni:
+        il consumo di ogni tratto a prezzo costante è la differenza di due somme prefisse dell'indice, a cui si aggiunge
+        la correzione dei giorni con prezzo effettivo (vedi set_overrides).
+        Costa O((cambi di prezzo + giorni con prezzo effettivo) × log n) invece di O(n).
+        """
+        cost = 0.0
+        # Primo giorno del tratto corrente (None: dall'inizio dello storico, al primo prezzo noto)
+        start = None
+        for i, price in enumerate(self._prices):
+            end = min(self._ordinals[i + 1] - 1, ordinal) if i + 1 < len(self._ordinals) else ordinal
+            if start is not None and start > end:
+                break
+            opening = index.value_at(start - 1) if start is not None else 0.0
+            cost += (index.value_at(end) - opening) * price
+            start = end + 1
+        for day, price in self._overrides.items():
+            if day <= ordinal:
+                kwh = index.day_value(date.fromordinal(day))
+                if kwh is not None:
+                    cost += kwh * (price - self._step_price(day))
+        return cost
+
+    @callback
+    def async_record(self, price, day=None):
+        """
+        Registra il prezzo in vigore da 'day' (oggi se non indicato) e pianifica il salvataggio differito.
+        Restituisce la data del cambio se il prezzo è effettivamente cambiato, altrimenti None.
+        Più cambi nello stesso giorno sovrascrivono il punto di quel giorno: tutto il consumo del giorno
+        viene valorizzato con l'ultimo prezzo registrato (con un sensore dinamico, l'ultimo accettato dal
+        limitatore di frequenza), così una correzione del prezzo fisso fatta in giornata vale già per oggi.
+        """
+        day = day or date.today()
+        ordinal = day.toordinal()
+        price = float(price)
+
+        if self._prices and self.price_on(ordinal) == price:
+            return None
+
+        pos = bisect_right(self._ordinals, ordinal)
+        if pos and self._ordinals[pos - 1] == ordinal:
+            self._prices[pos - 1] = price
+        else:
+            self._ordinals.insert(pos, ordinal)
+            self._prices.insert(pos, price)
+
+        self.async_delay_save()
+        _LOGGER.debug(f"Registrato cambio prezzo: {price} EUR/kWh dal {day.isoformat()}")
+        return day.isoformat()
+
+    def first_difference(self, points):
+        """
+        Confronta questo storico con un elenco di punti salvato in precedenza.
+        Restituisce la prima data da cui i prezzi differiscono, "" se differiscono fin dall'inizio,
+        oppure None se le due funzioni a gradini coincidono.
+        """
+        other = PriceHistory(self.hass)
+        other._set_points(points or [])
+        if not self._prices or not other._prices:
+            return None if not self._prices and not other._prices else ""
+        # Prima del primo punto entrambe valgono il loro primo prezzo.
+        if self._prices[0] != other._prices[0]:
+            return ""
+        for ordinal in sorted(set(self._ordinals) | set(other._ordinals)):
+            if self.price_on(ordinal) != other.price_on(ordinal):
+                return ordinal_to_date(ordinal)
+        return None
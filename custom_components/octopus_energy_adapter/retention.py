@@ -0,0 +1,93 @@
+"""
+Questo modulo applica la politica di conservazione dello storico.
+Le letture giornaliere (e gli intervalli) più vecchie di N mesi vengono ridotte a un checkpoint per mese:
+la lettura dell'ultimo giorno registrato del mese, il cui cumulativo resta invariato. Totali per periodo,
+statistiche a lungo termine e ricostruzioni continuano a tornare, con granularità mensile per i mesi compattati.
+Perché anche il costo resti esatto, ogni checkpoint riceve un prezzo effettivo (media dei prezzi del mese
+ponderata sui kWh): il consumo del mese per quel prezzo è proprio il costo originale del mese.
+Così caricamento, salvataggio e invii completi crescono con la finestra conservata e non con l'età dell'installazione.
+"""
+
+import json
+import logging
+import os
+from datetime import date, timedelta
+from itertools import takewhile
+
+from .storage import entry_path
+
+_LOGGER = logging.getLogger(__name__)
+
+# Stato della compattazione: primo giorno conservato con il dettaglio e prezzi effettivi dei checkpoint
+CHECKPOINTS_FILE = "octopus_data/octopus_checkpoints.json"
+
+def load_checkpoints_sync(hass, entry_id=None):
+    """Legge lo stato della compattazione. Restituisce un dizionario vuoto se il file manca o è corrotto."""
+    path = entry_path(hass, CHECKPOINTS_FILE, entry_id)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        _LOGGER.error(f"Errore durante la lettura dei checkpoint dello storico: {e}")
+        return {}
+
+def save_checkpoints_sync(hass, checkpoints, entry_id=None):
+    """Salva lo stato della compattazione con scrittura atomica."""
+    path = entry_path(hass, CHECKPOINTS_FILE, entry_id)
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoints, f)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        _LOGGER.error(f"Errore durante il salvataggio dei checkpoint dello storico: {e}")
+        return False
+
+def checkpoint_prices(checkpoints):
+    """Prezzi effettivi dei checkpoint {ordinale: prezzo} dallo stato salvato."""
+    return {date.fromisoformat(d).toordinal(): float(p) for d, p in checkpoints.get("prices", [])}
+
+def retention_cutoff(today, months, min_days=0):
+    """
+    Primo giorno conservato con il dettaglio giornaliero: l'inizio del mese di 'months' mesi fa.
+    Non è mai più recente dell'inizio del mese di 'min_days' giorni fa (finestra mobile e riepilogo restano esatti).
+    """
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    cutoff = date(year, month + 1, 1)
+    return min(cutoff, (today - timedelta(days=min_days)).replace(day=1))
+
+def monthly_checkpoints(index, prices, cutoff):
+    """
+    Raggruppa per mese le letture precedenti a 'cutoff' e sceglie i checkpoint.
+    Restituisce (ordinali da conservare, {ordinale: prezzo effettivo}) con i prezzi solo per i mesi
+    che hanno più di una lettura (quelli con una sola lettura non cambiano).
+    """
+    keep = set()
+    overrides = {}
+    month_key = None
+    month = []
+
+    def close_month():
+        if not month:
+            return
+        last = month[-1][0]
+        keep.add(last)
+        if len(month) > 1 and prices:
+            kwh = sum(k for _, k in month)
+            cost = sum(k * p for (_, k), p in zip(month, prices.prices_for([o for o, _ in month])))
+            overrides[last] = cost / kwh if kwh else prices.price_on(last)
+
+    daily = takewhile(lambda record: record[0] < cutoff.toordinal(), index.daily_since(date.min))
+    for ordinal, kwh in daily:
+        day = date.fromordinal(ordinal)
+        key = (day.year, day.month)
+        if key != month_key:
+            close_month()
+            month_key, month = key, []
+        month.append((ordinal, kwh))
+    close_month()
+    return keep, overrides
@@ -0,0 +1,186 @@
+"""
+Questo modulo registra i servizi dell'integrazione (chiamabili da automazioni, script o Strumenti per sviluppatori).
+I servizi agiscono sul coordinatore di una singola entry oppure, senza 'entry_id', su tutte le entry caricate.
+Importazione ed esportazione leggono e scrivono file: sono riservate agli amministratori e l'esportazione
+scrive solo nella cartella dedicata (o nelle cartelle di allowlist_external_dirs), senza sovrascrivere file esistenti.
+"""
+
+import logging
+import os
+
+import voluptuous as vol
+
+from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.service import async_register_admin_service
+
+from .const import DOMAIN
+from .export import EXPORT_FORMATS, EXPORT_FORMAT_CSV, EXPORT_FORMAT_NDJSON, EXPORT_LEVELS, EXPORT_LEVEL_DAILY, async_write_export
+
+_LOGGER = logging.getLogger(__name__)
+
+ATTR_ENTRY_ID = "entry_id"
+
+ATTR_FILE = "file"
+ATTR_OVERWRITE = "overwrite"
+ATTR_FORMAT = "format"
+ATTR_LEVEL = "level"
+ATTR_START = "start"
+ATTR_END = "end"
+ATTR_READING = "reading"
+ATTR_ACTION = "action"
+
+# Cartella (relativa a /config) in cui il servizio export_history crea i file indicati con un percorso relativo
+EXPORT_DIR = "octopus_exports"
+
+QUARANTINE_ACCEPT = "accept"
+QUARANTINE_REJECT = "reject"
+
+SERVICE_BACKFILL = "backfill"
+SERVICE_IMPORT_HISTORY = "import_history"
+SERVICE_EXPORT_HISTORY = "export_history"
+SERVICE_REVIEW_QUARANTINE = "review_quarantine"
+
+BACKFILL_SCHEMA = vol.Schema({vol.Optional(ATTR_ENTRY_ID): cv.string})
+
+IMPORT_HISTORY_SCHEMA = vol.Schema({
+    vol.Required(ATTR_FILE): cv.string,
+    vol.Optional(ATTR_ENTRY_ID): cv.string,
+    vol.Optional(ATTR_OVERWRITE, default=False): cv.boolean,
+})
+
+EXPORT_HISTORY_SCHEMA = vol.Schema({
+    vol.Required(ATTR_FILE): cv.string,
+    vol.Optional(ATTR_ENTRY_ID): cv.string,
+    vol.Optional(ATTR_FORMAT): vol.In(EXPORT_FORMATS),
+    vol.Optional(ATTR_LEVEL, default=EXPORT_LEVEL_DAILY): vol.In(EXPORT_LEVELS),
+    vol.Optional(ATTR_START): cv.date,
+    vol.Optional(ATTR_END): cv.date,
+    vol.Optional(ATTR_OVERWRITE, default=False): cv.boolean,
+})
+
+REVIEW_QUARANTINE_SCHEMA = vol.Schema({
+    vol.Required(ATTR_READING): cv.string,
+    vol.Required(ATTR_ACTION): vol.In((QUARANTINE_ACCEPT, QUARANTINE_REJECT)),
+    vol.Optional(ATTR_ENTRY_ID): cv.string,
+})
+
+def _coordinators(hass: HomeAssistant, call: ServiceCall):
+    """Coordinatori interessati dalla chiamata: quello della entry indicata oppure tutti."""
+    coordinators = hass.data.get(DOMAIN, {})
+    entry_id = call.data.get(ATTR_ENTRY_ID)
+    if entry_id is None:
+        return list(coordinators.values())
+    if entry_id not in coordinators:
+        raise HomeAssistantError(f"Nessuna entry Octopus Energy Adapter caricata con id {entry_id}")
+    return [coordinators[entry_id]]
+
+async def _async_backfill(hass: HomeAssistant, call: ServiceCall):
+    """Recupera dal Recorder i giorni mancanti dello storico."""
+    for coordinator in _coordinators(hass, call):
+        filled = await coordinator.async_backfill()
+        _LOGGER.info(f"Servizio {SERVICE_BACKFILL}: {filled} giorni recuperati per la entry {coordinator.entry_id}")
+
+def _single_coordinator(hass: HomeAssistant, call: ServiceCall):
+    """Coordinatore della entry indicata; senza 'entry_id' solo se ne è configurata una sola."""
+    coordinators = _coordinators(hass, call)
+    if len(coordinators) != 1:
+        raise HomeAssistantError("Con più entry configurate è necessario indicare 'entry_id'")
+    return coordinators[0]
+
+def _allowed_path(hass: HomeAssistant, file):
+    """
+    Percorso assoluto di un file da importare o esportare: i percorsi relativi partono dalla cartella /config.
+    Sono ammessi solo file nella cartella di configurazione o nelle cartelle di allowlist_external_dirs.
+    """
+    path = os.path.realpath(hass.config.path(file))
+    config_dir = os.path.realpath(hass.config.config_dir)
+    if os.path.commonpath([path, config_dir]) != config_dir and not hass.config.is_allowed_path(path):
+        raise HomeAssistantError(f"Percorso non consentito: {file} (aggiungere la cartella ad allowlist_external_dirs)")
+    return path
+
+def _export_path(hass: HomeAssistant, file):
+    """
+    Percorso assoluto del file da esportare. I percorsi relativi partono dalla cartella dedicata /config/octopus_exports
+    e non possono uscirne; i percorsi assoluti sono ammessi solo nelle cartelle di allowlist_external_dirs.
+    Così il servizio non può mai sovrascrivere configurazione, segreti o file di .storage.
+    """
+    export_dir = os.path.realpath(hass.config.path(EXPORT_DIR))
+    if os.path.isabs(file):
+        path = os.path.realpath(file)
+        if not hass.config.is_allowed_path(path):
+            raise HomeAssistantError(f"Percorso non consentito: {file} (aggiungere la cartella ad allowlist_external_dirs)")
+        return path
+    path = os.path.realpath(os.path.join(export_dir, file))
+    if os.path.commonpath([path, export_dir]) != export_dir:
+        raise HomeAssistantError(f"Percorso non consentito: {file} (deve restare nella cartella {EXPORT_DIR})")
+    return path
+
+async def _async_import_history(hass: HomeAssistant, call: ServiceCall):
+    """Importa nello storico di una entry un file di esportazione dei consumi."""
+    coordinator = _single_coordinator(hass, call)
+    path = _allowed_path(hass, call.data[ATTR_FILE])
+    if not await hass.async_add_executor_job(os.path.isfile, path):
+        raise HomeAssistantError(f"File da importare non trovato: {path}")
+
+    try:
+        result = await coordinator.async_import_history(path, call.data[ATTR_OVERWRITE])
+    except (OSError, UnicodeDecodeError) as e:
+        raise HomeAssistantError(f"Impossibile leggere il file {path}: {e}") from e
+    _LOGGER.info(
+        f"Servizio {SERVICE_IMPORT_HISTORY}: {result['days']} giorni importati da {path} "
+        f"({result['rows']} righe, {result['rejected']} scartate, {result['merged']} sommate) per la entry {coordinator.entry_id}"
+    )
+
+async def _async_export_history(hass: HomeAssistant, call: ServiceCall):
+    """Esporta su file lo storico di una entry con i valori derivati (kWh, prezzo, costo, totali)."""
+    coordinator = _single_coordinator(hass, call)
+    path = _export_path(hass, call.data[ATTR_FILE])
+    if not call.data[ATTR_OVERWRITE] and await hass.async_add_executor_job(os.path.exists, path):
+        raise HomeAssistantError(f"Il file {path} esiste già: usare 'overwrite: true' per sostituirlo")
+    # Senza formato esplicito decide l'estensione del file.
+    export_format = call.data.get(ATTR_FORMAT) or (
+        EXPORT_FORMAT_NDJSON if path.lower().endswith((".ndjson", ".jsonl")) else EXPORT_FORMAT_CSV
+    )
+    try:
+        written = await async_write_export(
+            coordinator, path, export_format, call.data[ATTR_LEVEL], call.data.get(ATTR_START), call.data.get(ATTR_END)
+        )
+    except ValueError as e:
+        raise HomeAssistantError(str(e)) from e
+    except OSError as e:
+        raise HomeAssistantError(f"Impossibile scrivere il file {path}: {e}") from e
+    _LOGGER.info(f"Servizio {SERVICE_EXPORT_HISTORY}: {written} caratteri scritti in {path} per la entry {coordinator.entry_id}")
+
+async def _async_review_quarantine(hass: HomeAssistant, call: ServiceCall):
+    """Accetta o scarta una lettura messa in quarantena dal filtro anomalie."""
+    coordinator = _single_coordinator(hass, call)
+    reading = call.data[ATTR_READING]
+    try:
+        await coordinator.async_review_quarantine(reading, call.data[ATTR_ACTION] == QUARANTINE_ACCEPT)
+    except KeyError as e:
+        raise HomeAssistantError(f"Nessuna lettura in quarantena per {reading} nella entry {coordinator.entry_id}") from e
+
+def async_setup_services(hass: HomeAssistant):
+    """Registra i servizi dell'integrazione (una sola volta, indipendentemente dal numero di entry)."""
+    if hass.services.has_service(DOMAIN, SERVICE_BACKFILL):
+        return
+
+    async def handle_backfill(call: ServiceCall):
+        await _async_backfill(hass, call)
+
+    async def handle_import_history(call: ServiceCall):
+        await _async_import_history(hass, call)
+
+    async def handle_export_history(call: ServiceCall):
+        await _async_export_history(hass, call)
+
+    async def handle_review_quarantine(call: ServiceCall):
+        await _async_review_quarantine(hass, call)
+
+    hass.services.async_register(DOMAIN, SERVICE_BACKFILL, handle_backfill, schema=BACKFILL_SCHEMA)
+    # Servizi che leggono o scrivono file: solo per gli amministratori (come la vista HTTP di esportazione).
+    async_register_admin_service(hass, DOMAIN, SERVICE_IMPORT_HISTORY, handle_import_history, schema=IMPORT_HISTORY_SCHEMA)
+    async_register_admin_service(hass, DOMAIN, SERVICE_EXPORT_HISTORY, handle_export_history, schema=EXPORT_HISTORY_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_REVIEW_QUARANTINE, handle_review_quarantine, schema=REVIEW_QUARANTINE_SCHEMA)
@@ -3,29 +3,84 @@ Questo modulo gestisce l'inserimento manuale delle statistiche a lungo termine n
 Utilizza le 'External Statistics', che permettono di iniettare dati storici non legati a un'entità fisica.
 """
 
-from homeassistant.components.recorder.statistics import async_add_external_statistics
-from homeassistant.util.dt import as_utc
-from datetime import datetime
+from homeassistant.core import callback
+from homeassistant.util import dt as dt_util
+from bisect import bisect_left
+from datetime import date, datetime
+import asyncio
+import hashlib
 import logging
+import time
+
+try:
+    # NumPy è opzionale: se presente, arrotondamenti e filtri vengono eseguiti in blocco sugli array.
+    import numpy as np
+except ImportError:
+    np = None
+
+from .index import ordinal_to_date
+from .metrics import NULL_METRICS, ROWS_BUCKETS
+from .storage import async_run_io, load_watermark_sync
 
 _LOGGER = logging.getLogger(__name__)
 
-async def push_statistics(hass, date_str, cumulative_value, price):
-    """
-    Invia un singolo punto statistico (tipicamente l'ultimo aggiornamento).
-    È un wrapper semplificato che richiama la funzione push_bulk_statistics.
-    """
-    await push_bulk_statistics(hass, {date_str: cumulative_value}, price)
+# Il modulo statistiche del Recorder viene importato solo al primo invio (dopo l'avvio di HA),
+# non al caricamento dell'integrazione: l'import resta fuori dal tempo di configurazione della entry.
+def get_instance(hass):
+    from homeassistant.components.recorder import get_instance as recorder_instance
+
+    return recorder_instance(hass)
+
+def async_add_external_statistics(hass, metadata, statistics):
+    from homeassistant.components.recorder.statistics import async_add_external_statistics as add_statistics
+
+    add_statistics(hass, metadata, statistics)
+
+# Versione del formato del watermark: se cambia, il watermark salvato viene considerato non valido.
+WATERMARK_VERSION = 2
 
-async def push_bulk_statistics(hass, data_dict, price):
+# Chiave del watermark nel riepilogo dello storico (vedi OctopusHistory.async_set_extra)
+WATERMARK_STATE_KEY = "statistics"
+
+# Differenza massima (kWh) tra il cumulativo dell'indice e quello dello stato salvato nel watermark
+# perché l'invio possa proseguire da quello stato
+STATE_TOLERANCE = 1e-6
+
+# Oltre questo numero di giorni l'invio avviene a blocchi mensili con contropressione sul Recorder.
+STATISTICS_CHUNK_THRESHOLD = 62
+
+# Contropressione: elementi massimi in coda al Recorder prima di inviare il blocco successivo,
+# intervallo di controllo e attesa massima per blocco (secondi).
+RECORDER_BACKLOG_LIMIT = 10
+RECORDER_DRAIN_POLL = 0.5
+RECORDER_DRAIN_TIMEOUT = 30
+
+# Intervallo minimo (secondi) tra due messaggi di avanzamento dell'importazione.
+STATISTICS_PROGRESS_INTERVAL = 10
+
+# Ore di letture a intervalli inviate per blocco (circa un mese)
+INTERVAL_CHUNK_HOURS = 24 * 31
+
+# Cache (fuso orario, ordinale del giorno) -> scostamento UTC della mezzanotte locale
+_UTC_OFFSET_CACHE = {}
+
+def statistic_ids(entry_id=None):
     """
-    Invia un set massivo di dati statistici. 
-    Include una protezione per evitare l'invio di dati corrotti (valori negativi).
+    Identificativi (energia, costo) delle statistiche esterne di una entry.
+    Senza entry_id restituisce gli identificativi condivisi delle versioni precedenti, mantenuti
+    dalla entry che ha ereditato lo storico durante la migrazione.
     """
-    # Identificativi univoci per le statistiche esterne. 
     # NOTA: Iniziano con 'sensor:' per essere riconosciuti dal pannello Energia.
-    energy_id = "sensor:octopus_energy_total"
-    cost_id = "sensor:octopus_energy_cost_total"
+    if entry_id is None:
+        return "sensor:octopus_energy_total", "sensor:octopus_energy_cost_total"
+    # Gli statistic_id ammettono solo minuscole, cifre e underscore.
+    suffix = "".join(c if c.isalnum() else "_" for c in entry_id.lower())
+    return f"sensor:octopus_energy_total_{suffix}", f"sensor:octopus_energy_cost_total_{suffix}"
+
+def _statistics_metadata(entry_id=None):
+    """Restituisce i metadata (energia, costo) delle due statistiche esterne della entry."""
+    # Identificativi univoci per le statistiche esterne: uno per contatore, così più entry non si sovrascrivono.
+    energy_id, cost_id = statistic_ids(entry_id)
     
     # Metadata per l'Energia: descrivono la natura del dato a Home Assistant.
     energy_metadata = {
@@ -46,54 +101,703 @@ async def push_bulk_statistics(hass, data_dict, price):
         "statistic_id": cost_id,
         "unit_of_measurement": "EUR",
     }
+    return energy_metadata, cost_metadata
 
-    energy_stats = []
-    cost_stats = []
-    
-    # Ordiniamo le date per assicurarci che vengano inserite in sequenza cronologica.
-    # Home Assistant richiede che le statistiche siano coerenti nel tempo.
-    sorted_dates = sorted(data_dict.keys())
+def _utc_offset(tz, ordinal):
+    """
+    Scostamento da UTC della mezzanotte locale del giorno 'ordinal'.
+    Il valore viene memorizzato per giorno (e fuso orario): i giorni di cambio ora legale
+    restano corretti e le ricostruzioni successive non ricalcolano nulla.
+    """
+    key = (tz, ordinal)
+    offset = _UTC_OFFSET_CACHE.get(key)
+    if offset is None:
+        offset = datetime.fromordinal(ordinal).replace(tzinfo=tz).utcoffset()
+        _UTC_OFFSET_CACHE[key] = offset
+    return offset
+
+def _running_cost(ordinals, values, prices, prev_energy=0.0, prev_cost=0.0):
+    """
+    Costo cumulativo (non arrotondato) giorno per giorno: somma progressiva di kWh giornalieri × prezzo del giorno.
+    I kWh giornalieri sono la differenza tra cumulativi consecutivi; 'prev_energy' e 'prev_cost'
+    sono lo stato del giorno precedente al primo della sequenza.
+    """
+    day_prices = prices.prices_for(ordinals)
+    if np is not None and values:
+        energy_arr = np.asarray(values, dtype=np.float64)
+        daily = np.diff(energy_arr, prepend=prev_energy)
+        return (prev_cost + np.cumsum(daily * np.asarray(day_prices, dtype=np.float64))).tolist()
 
+    costs = []
+    running = prev_cost
+    previous = prev_energy
+    for value, price in zip(values, day_prices):
+        running += (value - previous) * price
+        previous = value
+        costs.append(running)
+    return costs
+
+def _build_statistics_columns(data_dict, sorted_dates, prices, prev_energy=0.0, prev_cost=0.0):
+    """
+    Costruisce in blocco le colonne delle statistiche per le date indicate, già ordinate:
+    inizio in UTC, energia arrotondata, costo arrotondato e maschera dei valori negativi.
+    'prices' può essere un PriceHistory (costo giorno per giorno con il prezzo in vigore)
+    oppure un prezzo unico (costo = cumulativo × prezzo).
+    Le operazioni aritmetiche sono vettoriali con NumPy (se disponibile) o list comprehension altrimenti.
+    Le righe con data o valore non interpretabili vengono scartate.
+    """
+    dates = []
+    ordinals = []
+    values = []
     for date_str in sorted_dates:
         try:
-            # Conversione e arrotondamento
-            cumulative_energy = round(float(data_dict[date_str]), 3)
-            
-            # --- PATCH DI SICUREZZA ---
-            # Se per qualche motivo il dato nel JSON è negativo, lo saltiamo completamente.
-            # Questo impedisce di "sporcare" i grafici del pannello Energia.
-            if cumulative_energy < 0:
-                _LOGGER.error(f"Statistica scartata per valore negativo: {cumulative_energy} il {date_str}")
-                continue
-            # --------------------------
-
-            cumulative_cost = round(cumulative_energy * float(price), 2)
-            
-            dt_local = datetime.strptime(date_str, "%Y-%m-%d").replace(
-                hour=0, minute=0, second=0, microsecond=0
-            )
-            start_time = as_utc(dt_local)
-
-            energy_stats.append({
-                "start": start_time,
-                "last_reset": None,
-                "sum": cumulative_energy
-            })
-            
-            cost_stats.append({
-                "start": start_time,
-                "last_reset": None,
-                "sum": cumulative_cost
-            })
+            # date.fromisoformat è molto più economico di datetime.strptime
+            ordinal = date.fromisoformat(date_str).toordinal()
+            value = float(data_dict[date_str])
         except (ValueError, TypeError) as e:
             _LOGGER.warning(f"Errore formato dati per data {date_str}: {e}")
             continue
+        dates.append(date_str)
+        ordinals.append(ordinal)
+        values.append(value)
+
+    # Mezzanotte locale -> UTC, una sola conversione di fuso per giorno grazie alla cache.
+    tz = dt_util.DEFAULT_TIME_ZONE
+    starts = [
+        datetime.fromordinal(ordinal).replace(tzinfo=dt_util.UTC) - _utc_offset(tz, ordinal)
+        for ordinal in ordinals
+    ]
+
+    if isinstance(prices, (int, float)):
+        price = float(prices)
+        raw_cost = None
+    else:
+        raw_cost = _running_cost(ordinals, values, prices, prev_energy, prev_cost)
+
+    if np is not None:
+        energy_arr = np.round(np.asarray(values, dtype=np.float64), 3)
+        energy = energy_arr.tolist()
+        if raw_cost is None:
+            cost = np.round(energy_arr * price, 2).tolist()
+        else:
+            cost = np.round(np.asarray(raw_cost, dtype=np.float64), 2).tolist()
+        negative = (energy_arr < 0).tolist()
+    else:
+        energy = [round(v, 3) for v in values]
+        if raw_cost is None:
+            cost = [round(e * price, 2) for e in energy]
+        else:
+            cost = [round(c, 2) for c in raw_cost]
+        negative = [e < 0 for e in energy]
+
+    # Stato finale (cumulativo energia e costo non arrotondati) per proseguire con il blocco successivo.
+    end_state = (
+        values[-1] if values else prev_energy,
+        raw_cost[-1] if raw_cost else prev_cost,
+    )
+    return dates, starts, energy, cost, negative, end_state
+
+def _build_statistics_rows(data_dict, sorted_dates, prices, prev_energy=0.0, prev_cost=0.0):
+    """
+    Costruisce le righe statistiche (energia, costo) per le date indicate, già ordinate.
+    Include una protezione per evitare l'invio di dati corrotti (valori negativi).
+    Restituisce anche lo stato finale da passare al blocco successivo.
+    """
+    dates, starts, energy, cost, negative, end_state = _build_statistics_columns(
+        data_dict, sorted_dates, prices, prev_energy, prev_cost
+    )
+
+    # --- PATCH DI SICUREZZA ---
+    # Se per qualche motivo il dato nel JSON è negativo, lo saltiamo completamente.
+    # Questo impedisce di "sporcare" i grafici del pannello Energia.
+    if any(negative):
+        for date_str, value, is_negative in zip(dates, energy, negative):
+            if is_negative:
+                _LOGGER.error(f"Statistica scartata per valore negativo: {value} il {date_str}")
+    # --------------------------
+
+    energy_stats = [
+        {"start": start, "last_reset": None, "sum": value}
+        for start, value, is_negative in zip(starts, energy, negative)
+        if not is_negative
+    ]
+    cost_stats = [
+        {"start": start, "last_reset": None, "sum": value}
+        for start, value, is_negative in zip(starts, cost, negative)
+        if not is_negative
+    ]
+    return energy_stats, cost_stats, end_state
+
+def _split_from(data_dict, prices, from_date, until_date=None, prev_state=None):
+    """
+    Ordina le date e restituisce (date da inviare, energia e costo cumulativi del giorno precedente).
+    Le date inviate sono quelle in [from_date, until_date).
+    Lo stato precedente serve a proseguire la somma dei costi senza reinviare i giorni già presenti nel Recorder.
+    Se è già noto ('prev_state', es. dal watermark) 'data_dict' può contenere solo i giorni da inviare:
+    nessun ordinamento né somma dei costi dell'intero storico.
+    """
+    sorted_dates = sorted(data_dict.keys())
+    end = bisect_left(sorted_dates, until_date) if until_date else len(sorted_dates)
+    if not from_date:
+        return sorted_dates[:end], 0.0, 0.0
+
+    pos = bisect_left(sorted_dates, from_date)
+    if prev_state is not None:
+        return sorted_dates[pos:end], prev_state[0], prev_state[1]
+    before = sorted_dates[:pos]
+    if not before or isinstance(prices, (int, float)):
+        prev_energy = float(data_dict[before[-1]]) if before else 0.0
+        return sorted_dates[pos:end], prev_energy, 0.0
+
+    prev_energy, prev_cost = _state_before(data_dict, before, prices)
+    return sorted_dates[pos:end], prev_energy, prev_cost
+
+def _state_before(data_dict, before, prices):
+    """Energia e costo cumulativi dell'ultimo giorno di 'before' (solo aritmetica, nessuna riga costruita)."""
+    ordinals = []
+    values = []
+    for date_str in before:
+        try:
+            ordinals.append(date.fromisoformat(date_str).toordinal())
+            values.append(float(data_dict[date_str]))
+        except (ValueError, TypeError):
+            continue
+    costs = _running_cost(ordinals, values, prices)
+    return (values[-1], costs[-1]) if values else (0.0, 0.0)
+
+async def push_statistics(hass, data_dict, date_str, prices, entry_id=None):
+    """
+    Invia un singolo punto statistico (tipicamente l'ultimo aggiornamento).
+    È un wrapper semplificato che richiama la funzione push_bulk_statistics a partire da quella data.
+    """
+    await push_bulk_statistics(hass, data_dict, prices, from_date=date_str, entry_id=entry_id)
+
+async def push_bulk_statistics(hass, data_dict, prices, from_date=None, energy=True, cost=True, until_date=None, entry_id=None, metrics=NULL_METRICS, prev_state=None):
+    """
+    Invia un set di dati statistici (dal giorno 'from_date' a 'until_date' escluso) in un'unica chiamata al Recorder.
+    Adatta a pochi giorni; per storici lunghi usare push_bulk_statistics_chunked.
+    Con energy/cost si può limitare l'invio a una sola delle due serie.
+    'prev_state' è lo stato (energia, costo) del giorno precedente a 'from_date', se già noto (vedi _split_from).
+    Restituisce lo stato (energia, costo) dell'ultimo giorno inviato.
+    """
+    energy_metadata, cost_metadata = _statistics_metadata(entry_id)
+    
+    # Ordiniamo le date per assicurarci che vengano inserite in sequenza cronologica.
+    # Home Assistant richiede che le statistiche siano coerenti nel tempo.
+    with metrics.timer("statistics_build_ms"):
+        sorted_dates, prev_energy, prev_cost = _split_from(data_dict, prices, from_date, until_date, prev_state)
+        energy_stats, cost_stats, end_state = _build_statistics_rows(data_dict, sorted_dates, prices, prev_energy, prev_cost)
+
     # Se abbiamo accumulato dei dati, li iniettiamo nel database del Recorder.
-    if energy_stats:
-        _LOGGER.info(f"Inviate statistiche energia a {energy_id}")
-        # Questa funzione scrive direttamente nel database di Home Assistant
-        async_add_external_statistics(hass, energy_metadata, energy_stats)
-        
-    if cost_stats:
-        _LOGGER.info(f"Inviate statistiche costo a {cost_id}")
-        async_add_external_statistics(hass, cost_metadata, cost_stats)
\ No newline at end of file
+    rows = 0
+    with metrics.timer("statistics_recorder_ms"):
+        if energy and energy_stats:
+            _LOGGER.info(f"Inviate statistiche energia a {energy_metadata['statistic_id']}")
+            # Questa funzione scrive direttamente nel database di Home Assistant
+            async_add_external_statistics(hass, energy_metadata, energy_stats)
+            rows += len(energy_stats)
+
+        if cost and cost_stats:
+            _LOGGER.info(f"Inviate statistiche costo a {cost_metadata['statistic_id']}")
+            async_add_external_statistics(hass, cost_metadata, cost_stats)
+            rows += len(cost_stats)
+    metrics.observe("statistics_rows", rows, ROWS_BUCKETS)
+    return end_state
+
+def iter_monthly_chunks(sorted_dates):
+    """Suddivide una lista di date 'YYYY-MM-DD' già ordinate in blocchi di un mese ciascuno."""
+    chunk = []
+    month = None
+    for date_str in sorted_dates:
+        if date_str[:7] != month and chunk:
+            yield chunk
+            chunk = []
+        month = date_str[:7]
+        chunk.append(date_str)
+    if chunk:
+        yield chunk
+
+async def _async_wait_for_recorder(hass):
+    """
+    Contropressione: attende che la coda del Recorder scenda sotto la soglia prima del blocco successivo,
+    così un'importazione massiva non monopolizza le scritture delle altre integrazioni.
+    """
+    instance = get_instance(hass)
+    waited = 0.0
+    while instance.backlog > RECORDER_BACKLOG_LIMIT and waited < RECORDER_DRAIN_TIMEOUT:
+        await asyncio.sleep(RECORDER_DRAIN_POLL)
+        waited += RECORDER_DRAIN_POLL
+    # In ogni caso cediamo il controllo al loop tra un blocco e l'altro.
+    await asyncio.sleep(0)
+
+async def push_bulk_statistics_chunked(hass, data_dict, prices, from_date=None, energy=True, cost=True, progress_callback=None, log_interval=STATISTICS_PROGRESS_INTERVAL, until_date=None, entry_id=None, metrics=NULL_METRICS, prev_state=None):
+    """
+    Invia uno storico lungo un mese alla volta.
+    Le righe di ogni blocco vengono costruite solo al momento dell'invio (memoria limitata al singolo mese)
+    e tra un blocco e l'altro si attende lo svuotamento della coda del Recorder.
+    L'avanzamento viene registrato nel log (e passato a progress_callback) al massimo ogni 'log_interval' secondi.
+    Restituisce lo stato (energia, costo) dell'ultimo giorno inviato.
+    """
+    energy_metadata, cost_metadata = _statistics_metadata(entry_id)
+    with metrics.timer("statistics_build_ms"):
+        sorted_dates, prev_energy, prev_cost = _split_from(data_dict, prices, from_date, until_date, prev_state)
+    total = len(sorted_dates)
+    done = 0
+    rows = 0
+    last_report = time.monotonic()
+
+    for dates in iter_monthly_chunks(sorted_dates):
+        with metrics.timer("statistics_build_ms"):
+            energy_stats, cost_stats, (prev_energy, prev_cost) = _build_statistics_rows(
+                data_dict, dates, prices, prev_energy, prev_cost
+            )
+        with metrics.timer("statistics_recorder_ms"):
+            if energy and energy_stats:
+                async_add_external_statistics(hass, energy_metadata, energy_stats)
+                rows += len(energy_stats)
+            if cost and cost_stats:
+                async_add_external_statistics(hass, cost_metadata, cost_stats)
+                rows += len(cost_stats)
+        done += len(dates)
+
+        with metrics.timer("statistics_recorder_wait_ms"):
+            await _async_wait_for_recorder(hass)
+
+        now = time.monotonic()
+        if done == total or now - last_report >= log_interval:
+            last_report = now
+            _LOGGER.info(f"Importazione statistiche Octopus: {done}/{total} giorni ({round(done * 100 / total)}%)")
+            if progress_callback is not None:
+                progress_callback(done, total)
+    metrics.observe("statistics_rows", rows, ROWS_BUCKETS)
+    return prev_energy, prev_cost
+
+def _build_interval_rows(intervals, i, j, prices, prev_energy=0.0, prev_cost=0.0):
+    """
+    Costruisce righe statistiche orarie dagli intervalli slots[i:j] (30 o 60 minuti).
+    Ogni riga ha come 'sum' il cumulativo a fine ora; il costo usa il prezzo in vigore nel giorno locale dell'ora.
+    Restituisce anche lo stato finale (energia, costo) per il blocco successivo.
+    """
+    energy_stats = []
+    cost_stats = []
+    energy = prev_energy
+    cost = prev_cost
+    fixed_price = float(prices) if isinstance(prices, (int, float)) else None
+    slot_seconds = intervals.slot_seconds
+
+    hour_ts = None
+    price = 0.0
+    for k in range(i, j):
+        ts = int(intervals.slots[k]) * slot_seconds
+        slot_hour = ts - ts % 3600
+        if slot_hour != hour_ts:
+            if hour_ts is not None:
+                _append_hour_rows(energy_stats, cost_stats, hour_ts, energy, cost, fixed_price)
+            hour_ts = slot_hour
+            if fixed_price is None:
+                # Giorno locale dell'ora: il prezzo cambia al più una volta per ora.
+                local_day = dt_util.as_local(datetime.fromtimestamp(hour_ts, tz=dt_util.UTC)).date()
+                price = prices.price_on(local_day.toordinal())
+        kwh = intervals.values[k]
+        energy += kwh
+        if fixed_price is None:
+            cost += kwh * price
+
+    if hour_ts is not None:
+        _append_hour_rows(energy_stats, cost_stats, hour_ts, energy, cost, fixed_price)
+    return energy_stats, cost_stats, (energy, cost)
+
+def _append_hour_rows(energy_stats, cost_stats, hour_ts, energy, cost, fixed_price):
+    """Aggiunge la riga oraria di energia e costo (con la stessa protezione sui valori negativi delle righe giornaliere)."""
+    value = round(energy, 3)
+    if value < 0:
+        _LOGGER.error(f"Statistica oraria scartata per valore negativo: {value}")
+        return
+    start = datetime.fromtimestamp(hour_ts, tz=dt_util.UTC)
+    energy_stats.append({"start": start, "last_reset": None, "sum": value})
+    cost_value = round(value * fixed_price, 2) if fixed_price is not None else round(cost, 2)
+    cost_stats.append({"start": start, "last_reset": None, "sum": cost_value})
+
+async def push_interval_statistics_chunked(hass, data_dict, intervals, prices, from_date=None, energy=True, cost=True, progress_callback=None, log_interval=STATISTICS_PROGRESS_INTERVAL, entry_id=None, metrics=NULL_METRICS, prev_state=None):
+    """
+    Invia statistiche orarie ricavate dagli intervalli, dal giorno locale 'from_date' in avanti.
+    Il cumulativo di partenza è quello giornaliero del giorno precedente (oppure 'prev_state', se già noto),
+    così le serie orarie proseguono senza salti quelle giornaliere.
+    Invio a blocchi (circa un mese, allineati all'ora) con contropressione sul Recorder.
+    Restituisce lo stato (energia, costo) a fine dell'ultimo intervallo inviato (None senza intervalli).
+    """
+    energy_metadata, cost_metadata = _statistics_metadata(entry_id)
+    start_day = date.fromisoformat(from_date) if from_date else intervals.first_date()
+    if start_day is None:
+        return None
+    _dates, prev_energy, prev_cost = _split_from(data_dict, prices, start_day.isoformat(), start_day.isoformat(), prev_state)
+
+    i = bisect_left(intervals.slots, intervals.slot_for(dt_util.start_of_local_day(start_day)))
+    total = len(intervals) - i
+    chunk_slots = INTERVAL_CHUNK_HOURS * 3600 // intervals.slot_seconds
+    done = 0
+    rows = 0
+    last_report = time.monotonic()
+
+    while i < len(intervals):
+        j = min(i + chunk_slots, len(intervals))
+        # Il blocco termina su un confine d'ora: un'ora non viene mai divisa tra due invii.
+        while j < len(intervals) and (int(intervals.slots[j]) * intervals.slot_seconds) % 3600:
+            j += 1
+        with metrics.timer("statistics_build_ms"):
+            energy_stats, cost_stats, (prev_energy, prev_cost) = _build_interval_rows(
+                intervals, i, j, prices, prev_energy, prev_cost
+            )
+        with metrics.timer("statistics_recorder_ms"):
+            if energy and energy_stats:
+                async_add_external_statistics(hass, energy_metadata, energy_stats)
+                rows += len(energy_stats)
+            if cost and cost_stats:
+                async_add_external_statistics(hass, cost_metadata, cost_stats)
+                rows += len(cost_stats)
+        done += j - i
+        i = j
+
+        with metrics.timer("statistics_recorder_wait_ms"):
+            await _async_wait_for_recorder(hass)
+
+        now = time.monotonic()
+        if done == total or now - last_report >= log_interval:
+            last_report = now
+            _LOGGER.info(f"Importazione statistiche orarie Octopus: {done}/{total} intervalli ({round(done * 100 / total)}%)")
+            if progress_callback is not None:
+                progress_callback(done, total)
+    metrics.observe("statistics_rows", rows, ROWS_BUCKETS)
+    return prev_energy, prev_cost
+
+def _entry_hash(date_str, cumulative_value):
+    """Impronta a 64 bit di una singola lettura (data + valore arrotondato come nelle statistiche)."""
+    payload = f"{date_str}={round(float(cumulative_value), 3)}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), "big")
+
+def compute_month_hashes(data_dict, until=None):
+    """
+    Calcola un'impronta per ogni mese ('YYYY-MM') dello storico, considerando solo le date <= until.
+    L'impronta è la somma modulo 2^64 delle impronte delle singole letture: non dipende dall'ordine
+    e può essere aggiornata in O(1) quando si aggiunge un giorno.
+    """
+    hashes = {}
+    for date_str, value in data_dict.items():
+        if until is not None and date_str > until:
+            continue
+        try:
+            h = _entry_hash(date_str, value)
+        except (ValueError, TypeError):
+            continue
+        month = date_str[:7]
+        hashes[month] = (hashes.get(month, 0) + h) & 0xFFFFFFFFFFFFFFFF
+    return hashes
+
+class StatisticsSync:
+    """
+    Sincronizzazione incrementale delle statistiche esterne.
+    Mantiene un watermark persistente (ultima data inviata, punti di cambio prezzo usati e impronta di ogni mese)
+    così all'avvio vengono inviati al Recorder solo i giorni nuovi o i mesi modificati,
+    invece di reimportare l'intero storico ad ogni riavvio.
+    Un cambio di prezzo reinvia solo la serie del costo, dalla data del cambio in avanti.
+    Il watermark è salvato nel riepilogo dello storico 'history': viene scritto dallo stesso salvataggio differito
+    delle letture (nessun file in più per ogni giorno) e non può mai precedere su disco le letture che descrive.
+    """
+
+    def __init__(self, hass, entry_id, history, prices, intervals=None, legacy_ids=False, io=None, metrics=None):
+        self.hass = hass
+        self.entry_id = entry_id
+        self._history = history
+        self._io = io
+        self.metrics = metrics or NULL_METRICS
+        # La entry migrata dalla versione condivisa mantiene gli statistic_id storici.
+        self._statistics_key = None if legacy_ids else entry_id
+        self._prices = prices
+        # Con le letture a intervalli, i giorni coperti vengono inviati come statistiche orarie.
+        self._intervals = intervals
+        self._watermark = None
+        # Avanzamento dell'ultima sincronizzazione (esposto come attributo dal sensore Energia)
+        self.progress = None
+        self._progress_listeners = []
+
+    def async_add_progress_listener(self, listener):
+        """Registra una callback chiamata ad ogni aggiornamento dell'avanzamento. Restituisce la funzione di rimozione."""
+        self._progress_listeners.append(listener)
+        return lambda: self._progress_listeners.remove(listener)
+
+    def _set_progress(self, done, total):
+        self.progress = round(done * 100 / total) if total else 100
+        for listener in list(self._progress_listeners):
+            listener()
+
+    def _is_valid(self, watermark):
+        """Il watermark è utilizzabile solo se è completo e della versione corrente."""
+        return (
+            isinstance(watermark, dict)
+            and watermark.get("version") == WATERMARK_VERSION
+            and isinstance(watermark.get("last_date"), str)
+            and isinstance(watermark.get("months"), dict)
+            and isinstance(watermark.get("prices"), list)
+        )
+
+    def _energy_start(self, data_dict, watermark):
+        """
+        Prima data da reinviare per la serie dell'energia (None se non serve inviare nulla):
+        il giorno successivo al watermark, oppure l'inizio del primo mese modificato
+        (una correzione cambia anche i cumulativi dei giorni successivi).
+        """
+        last_date = watermark["last_date"]
+        saved = watermark["months"]
+        current = compute_month_hashes(data_dict, until=last_date)
+
+        changed = [m for m in set(saved) | set(current) if saved.get(m) != format(current.get(m, 0), "x")]
+        if changed:
+            return f"{min(changed)}-01"
+
+        newer = [d for d in data_dict if d > last_date]
+        return min(newer) if newer else None
+
+    def _build_watermark(self, data_dict, checksum):
+        return {
+            "version": WATERMARK_VERSION,
+            "last_date": max(data_dict) if data_dict else "",
+            "prices": self._prices.to_list(),
+            "months": {m: format(h, "x") for m, h in compute_month_hashes(data_dict).items()},
+            # Impronta dello storico inviato: se all'avvio coincide con quella del riepilogo non c'è nulla da fare.
+            "checksum": format(checksum, "x"),
+        }
+
+    def _state_before(self, from_date):
+        """
+        Energia e costo cumulativi (non arrotondati) dell'ultima lettura precedente a 'from_date', dalle somme prefisse
+        dell'indice (vedi PriceHistory.cost_through): nessun ordinamento né somma dei costi dal primo giorno.
+        Richiede l'indice completo se 'from_date' precede gli ultimi giorni del riepilogo.
+        """
+        if not from_date:
+            return 0.0, 0.0
+        ordinal = date.fromisoformat(from_date).toordinal() - 1
+        index = self._history.index
+        return index.value_at(ordinal), self._prices.cost_through(index, ordinal)
+
+    def _saved_state(self, date_str):
+        """
+        Stato (energia, costo) dell'ultima lettura precedente a 'date_str' preso dal watermark, in O(log n):
+        quello dell'ultimo giorno inviato per un giorno successivo, quello del giorno prima per lo stesso giorno.
+        None se il watermark non ha lo stato o se il cumulativo dell'indice prima di 'date_str' non coincide
+        (letture nel mezzo o correzioni non ancora inviate).
+        """
+        state = self._watermark.get("state") if self._watermark is not None else None
+        if not state:
+            return None
+        if date_str > state["date"]:
+            candidate = (state["energy"], state["cost"])
+        elif date_str == state["date"]:
+            candidate = tuple(state["previous"])
+        else:
+            return None
+        opening = self._history.index.value_at(date.fromisoformat(date_str).toordinal() - 1)
+        if abs(opening - candidate[0]) > STATE_TOLERANCE:
+            return None
+        return candidate
+
+    def _set_state(self, cost=None, previous=None):
+        """
+        Salva nel watermark lo stato dell'ultima lettura (cumulativo dell'indice e costo cumulativo 'cost', calcolato
+        dalle somme prefisse se non indicato) e quello della lettura precedente ('previous' se noto, altrimenti
+        ricavato togliendo l'ultimo giorno). È il punto da cui prosegue l'invio del giorno successivo.
+        """
+        last = self._history.index.last()
+        if last is None:
+            self._watermark.pop("state", None)
+            return
+        ordinal = date.fromisoformat(last[0]).toordinal()
+        energy = last[1]
+        if cost is None:
+            cost = self._prices.cost_through(self._history.index, ordinal)
+        if previous is None:
+            opening = self._history.index.value_at(ordinal - 1)
+            previous = (opening, cost - (energy - opening) * self._prices.price_on(ordinal))
+        self._watermark["state"] = {"date": last[0], "energy": energy, "cost": cost, "previous": list(previous)}
+
+    async def _async_push(self, from_date=None, energy=True, cost=True, prev_state=None):
+        """
+        Invia i giorni da 'from_date' in avanti, a blocchi mensili se sono molti.
+        I giorni coperti dalle letture a intervalli vengono inviati come righe orarie.
+        I giorni da inviare vengono letti dall'indice con due ricerche binarie; lo stato del giorno precedente
+        è 'prev_state' se già noto (es. dal watermark), altrimenti viene ricavato dalle somme prefisse.
+        Restituisce lo stato (energia, costo) dell'ultimo giorno inviato.
+        """
+        with self.metrics.timer("statistics_push_ms"):
+            first_interval = self._intervals.first_date() if self._intervals is not None else None
+            until_date = first_interval.isoformat() if first_interval else None
+            if prev_state is None:
+                prev_state = self._state_before(from_date)
+            end_state = prev_state
+
+            if until_date is None or not from_date or from_date < until_date:
+                first = date.fromisoformat(from_date).toordinal() if from_date else 1
+                last = first_interval.toordinal() - 1 if first_interval else date.max.toordinal()
+                days = {ordinal_to_date(o): v for o, v in self._history.index.records_between(first, last)}
+                if len(days) > STATISTICS_CHUNK_THRESHOLD:
+                    self._set_progress(0, len(days))
+                    end_state = await push_bulk_statistics_chunked(
+                        self.hass, days, self._prices, from_date, energy, cost, self._set_progress,
+                        until_date=until_date, entry_id=self._statistics_key, metrics=self.metrics, prev_state=prev_state,
+                    )
+                elif days:
+                    end_state = await push_bulk_statistics(
+                        self.hass, days, self._prices, from_date, energy, cost, until_date,
+                        entry_id=self._statistics_key, metrics=self.metrics, prev_state=prev_state,
+                    )
+
+            if until_date is not None:
+                # Le righe orarie proseguono dall'ultimo giorno inviato (o dallo stato iniziale, se non ce n'erano).
+                state = await push_interval_statistics_chunked(
+                    self.hass, {}, self._intervals, self._prices,
+                    max(from_date or until_date, until_date), energy, cost, self._set_progress,
+                    entry_id=self._statistics_key, metrics=self.metrics, prev_state=end_state,
+                )
+                if state is not None:
+                    end_state = state
+        return end_state
+
+    async def async_sync(self, history):
+        """
+        Sincronizzazione all'avvio: invia solo la parte di storico non ancora coperta dal watermark.
+        Se lo storico prezzi è cambiato rispetto al watermark, il costo viene reinviato dalla data del cambio.
+        Se il watermark manca o non è valido, esegue una sincronizzazione completa.
+        Se storico e prezzi sono identici a quelli dell'ultimo invio, lo storico completo non viene nemmeno caricato.
+        """
+        watermark = history.extras.get(WATERMARK_STATE_KEY)
+        if watermark is None:
+            # Versioni precedenti: il watermark era in un file dedicato.
+            watermark = await async_run_io(self.hass, self._io, load_watermark_sync, self.hass, self.entry_id)
+
+        if (
+            self._is_valid(watermark)
+            and watermark.get("checksum") == format(history.checksum, "x")
+            and self._prices.first_difference(watermark["prices"]) is None
+        ):
+            _LOGGER.debug("Statistiche già allineate allo storico: nessuna sincronizzazione necessaria")
+            self._watermark = watermark
+            return
+
+        await history.async_ensure_loaded()
+        data_dict = history.data
+
+        if self._is_valid(watermark):
+            energy_from = self._energy_start(data_dict, watermark)
+            price_from = self._prices.first_difference(watermark["prices"])
+            # "" (prezzi diversi fin dall'inizio) precede qualsiasi data e produce un reinvio completo del costo.
+            candidates = [d for d in (energy_from, price_from) if d is not None]
+            cost_from = min(candidates) if candidates else None
+            _LOGGER.debug(f"Sincronizzazione incrementale statistiche: energia dal {energy_from}, costo dal {cost_from}")
+
+            if energy_from is not None and energy_from == cost_from:
+                await self._async_push(energy_from)
+            else:
+                if cost_from is not None:
+                    await self._async_push(cost_from, energy=False)
+                if energy_from is not None:
+                    await self._async_push(energy_from, cost=False)
+        else:
+            _LOGGER.info("Watermark statistiche assente o non valido: sincronizzazione completa")
+            await self._async_push()
+
+        self._watermark = self._build_watermark(data_dict, history.checksum)
+        self._set_state()
+        self._async_save_watermark()
+
+    async def async_push_day(self, date_str, cumulative_value, previous_value=None, checksum=None):
+        """
+        Invia un nuovo giorno (l'ultimo dello storico) e aggiorna il watermark in O(1) (impronta del mese e ultima data).
+        Il costo prosegue dallo stato salvato nel watermark (vedi _saved_state): nessun ordinamento dello storico
+        né ricalcolo dei costi dal primo giorno.
+        Con 'previous_value' il giorno esisteva già (letture a intervalli): la sua vecchia impronta viene tolta.
+        'checksum' è l'impronta dello storico dopo la modifica (vedi OctopusHistory.checksum).
+        """
+        prev_state = self._saved_state(date_str)
+        if prev_state is None:
+            # Watermark senza stato (versioni precedenti) o non allineato: una volta sola dalle somme prefisse,
+            # che richiedono lo storico completo (il giorno può essere stato accodato al solo riepilogo).
+            await self._history.async_ensure_loaded()
+            prev_state = self._state_before(date_str)
+        end_state = await self._async_push(date_str, prev_state=prev_state)
+
+        if self._watermark is None:
+            # Sincronizzazione iniziale non ancora eseguita: sarà lei a scrivere il watermark completo.
+            return
+
+        month = date_str[:7]
+        months = self._watermark["months"]
+        month_hash = int(months.get(month, "0"), 16) + _entry_hash(date_str, cumulative_value)
+        if previous_value is not None:
+            month_hash -= _entry_hash(date_str, previous_value)
+        months[month] = format(month_hash & 0xFFFFFFFFFFFFFFFF, "x")
+        self._watermark["last_date"] = max(self._watermark["last_date"], date_str)
+        if checksum is not None:
+            self._watermark["checksum"] = format(checksum, "x")
+        self._set_state(end_state[1], prev_state if date_str == self._history.last_date else None)
+        self._async_save_watermark()
+
+    async def async_push_from(self, date_str, checksum=None):
+        """
+        Correzione retroattiva o inserimento di un giorno passato: i cumulativi cambiano dal giorno 'date_str'
+        in avanti, quindi vengono reinviati solo quel giorno e i successivi (energia e costo).
+        Le impronte dei mesi interessati vengono ricalcolate nel watermark dalle letture dell'indice.
+        """
+        end_state = await self._async_push(date_str)
+
+        if self._watermark is None:
+            return
+
+        month = date_str[:7]
+        months = self._watermark["months"]
+        for m in [m for m in months if m >= month]:
+            del months[m]
+        first = date.fromisoformat(f"{month}-01").toordinal()
+        changed = {ordinal_to_date(o): v for o, v in self._history.index.records_between(first, date.max.toordinal())}
+        months.update({m: format(h, "x") for m, h in compute_month_hashes(changed).items()})
+        self._watermark["last_date"] = max(self._watermark["last_date"], max(changed))
+        if checksum is not None:
+            self._watermark["checksum"] = format(checksum, "x")
+        self._set_state(end_state[1])
+        self._async_save_watermark()
+
+    async def async_push_cost_from(self, date_str):
+        """
+        Cambio di prezzo dal giorno 'date_str': ricalcola e reinvia solo la serie del costo da quel giorno in avanti,
+        proseguendo dallo stato salvato nel watermark (vedi _saved_state). La serie dell'energia non cambia.
+        Un cambio successivo all'ultima lettura (il caso tipico: il prezzo di oggi, con le letture in ritardo di qualche
+        giorno) non cambia alcun costo già inviato: viene aggiornato solo il watermark, senza leggere lo storico.
+        """
+        last_date = self._history.last_date
+        if last_date is not None and date_str <= last_date:
+            prev_state = self._saved_state(date_str)
+            end_state = await self._async_push(date_str, energy=False, prev_state=prev_state)
+            if self._watermark is not None:
+                self._set_state(end_state[1], prev_state if date_str == last_date else None)
+
+        if self._watermark is not None:
+            self._watermark["prices"] = self._prices.to_list()
+            self._async_save_watermark()
+
+    async def async_rebase(self, data_dict, checksum):
+        """
+        Lo storico è stato compattato (vedi retention.py): i cumulativi conservati, e quindi le statistiche
+        già inviate, non cambiano, ma le impronte dei mesi compattati sì. Il watermark viene ricalcolato
+        senza reinviare nulla, così la prossima sincronizzazione non scambia la compattazione per una correzione.
+        """
+        if self._watermark is None:
+            return
+        self._watermark["months"] = {m: format(h, "x") for m, h in compute_month_hashes(data_dict).items()}
+        self._watermark["checksum"] = format(checksum, "x")
+        self._async_save_watermark()
+
+    @callback
+    def _async_save_watermark(self):
+        """
+        Salva il watermark nel riepilogo dello storico (scrittura differita, insieme alle letture).
+        Il riepilogo ne serializza una copia: il thread di I/O non vede le modifiche fatte nel frattempo dal loop.
+        """
+        self._history.async_set_extra(WATERMARK_STATE_KEY, self._watermark)
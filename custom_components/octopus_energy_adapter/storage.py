@@ -1,24 +1,148 @@
 """
 Questo modulo gestisce la lettura e la scrittura dei dati su file locale (JSON).
-I dati vengono salvati nella cartella /config/octopus_data/ per evitare di perdere lo storico.
+I dati vengono salvati nella cartella /config/octopus_data/<entry_id>/ per evitare di perdere lo storico:
+ogni contatore configurato ha i propri file.
+In alternativa al salvataggio completo del JSON è disponibile un formato 'journal':
+ogni nuova lettura viene accodata come singola riga e il file JSON diventa uno snapshot
+che viene ricompattato periodicamente in background.
+In alternativa è disponibile un formato binario compatto (ordinale del giorno + cumulativo a dimensione fissa)
+che all'avvio viene mappato in memoria e interrogato con ricerche binarie, senza interpretare l'intero file.
+Le letture a intervalli (30/60 minuti) sono salvate in un file binario compatto a parte.
+Accanto allo storico viene mantenuto un piccolo riepilogo (ultima lettura, totali di apertura di ogni mese,
+ultimi giorni e impronta del contenuto): all'avvio basta leggere quello, lo storico completo viene caricato
+solo quando serve davvero.
 """
 
+import copy
+import asyncio
+import hashlib
 import json
 import os
 import logging
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from homeassistant.const import EVENT_HOMEASSISTANT_FINAL_WRITE
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN, STORAGE_FORMAT_JSON, STORAGE_FORMAT_JOURNAL, STORAGE_FORMAT_BINARY
+from .index import HistoryIndex, date_to_ordinal, ordinal_to_date
+from .metrics import BYTES_BUCKETS, NULL_METRICS, bytes_written, file_stamps_sync
 
 _LOGGER = logging.getLogger(__name__)
 
-# Nome del file e della cartella relativa alla cartella /config di Home Assistant
+# Nome del file e della cartella relativa alla cartella /config di Home Assistant.
+# Ogni entry (contatore) usa una propria sottocartella: vedi entry_path().
 STORAGE_FILE = "octopus_data/octopus_energy.json"
 
-def load_data_sync(hass):
+# Journal delle letture accodate dopo l'ultimo snapshot (una riga JSON per lettura)
+JOURNAL_FILE = "octopus_data/octopus_energy.journal"
+
+# File binario dello storico giornaliero: header fisso seguito da record (int32 ordinale del giorno, float64 cumulativo)
+# ordinati per giorno. Tutti i valori sono little-endian.
+BINARY_FILE = "octopus_data/octopus_energy.bin"
+BINARY_MAGIC = b"OCTD"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sHH")  # magic, versione, dimensione del record
+BINARY_RECORD = struct.Struct("<id")
+
+# Riepilogo dello storico letto all'avvio al posto dell'intero storico
+SUMMARY_FILE = "octopus_data/octopus_summary.json"
+SUMMARY_VERSION = 1
+
+# Giorni più recenti copiati nel riepilogo: bastano per settimana, mese corrente e costo del mese.
+SUMMARY_TAIL_DAYS = 62
+
+# Inizio (giorni prima dell'ultima lettura) della finestra dell'anno precedente copiata nel riepilogo:
+# copre lo stesso giorno dell'anno prima anche negli anni bisestili (vedi build_summary).
+SUMMARY_LAST_YEAR_DAYS = 367
+
+# File binario delle letture a intervalli (header fisso + coppie float64 slot/kWh)
+INTERVALS_FILE = "octopus_data/octopus_intervals.bin"
+INTERVALS_MAGIC = b"OCTI"
+INTERVALS_VERSION = 1
+INTERVALS_HEADER = struct.Struct("<4sHH")
+
+# Watermark dell'ultima sincronizzazione delle statistiche a lungo termine delle versioni precedenti
+# (ora è salvato nel riepilogo dello storico): viene solo letto, una volta, per la migrazione.
+WATERMARK_FILE = "octopus_data/octopus_statistics.json"
+
+# Secondi di attesa prima di scrivere su disco: gli aggiornamenti ravvicinati vengono accorpati in un'unica scrittura.
+SAVE_DELAY = 10
+
+# Numero minimo di righe del journal prima di una compattazione. La soglia effettiva cresce con
+# la dimensione dello storico, così il costo della riscrittura dello snapshot resta costante per lettura.
+JOURNAL_COMPACT_LINES = 100
+
+class StorageExecutor:
+    """
+    Esecutore a thread singolo dedicato all'I/O su disco di una entry.
+    Le operazioni sui file della entry vengono eseguite una alla volta e nell'ordine di invio,
+    senza occupare (né attendere) il pool di thread condiviso di Home Assistant.
+    """
+
+    def __init__(self, hass, entry_id):
+        self.hass = hass
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{DOMAIN}_io_{entry_id}")
+
+    async def async_run(self, func, *args):
+        """Esegue func(*args) sul thread di I/O della entry e ne restituisce il risultato."""
+        return await self.hass.loop.run_in_executor(self._executor, func, *args)
+
+    def shutdown(self):
+        """Chiude il thread di I/O; le operazioni già inviate vengono comunque completate."""
+        self._executor.shutdown(wait=False)
+
+async def async_run_io(hass, io, func, *args):
+    """Esegue un'operazione di I/O sull'esecutore dedicato, oppure sul pool di HA se non è stato fornito."""
+    if io is None:
+        return await hass.async_add_executor_job(func, *args)
+    return await io.async_run(func, *args)
+
+def entry_path(hass, filename, entry_id=None):
+    """
+    Percorso assoluto di un file dati per una specifica entry: octopus_data/<entry_id>/<file>.
+    Senza entry_id restituisce il percorso condiviso delle versioni precedenti (usato solo dalla migrazione).
+    """
+    if entry_id is None:
+        return hass.config.path(filename)
+    folder, name = os.path.split(filename)
+    return hass.config.path(folder, entry_id, name)
+
+def migrate_legacy_files_sync(hass, entry_id, filenames):
+    """
+    Sposta i file condivisi delle versioni precedenti nella cartella della entry.
+    Un file già presente nella cartella della entry non viene mai sovrascritto.
+    Restituisce l'elenco dei file spostati.
+    """
+    moved = []
+    for filename in filenames:
+        src = entry_path(hass, filename)
+        dst = entry_path(hass, filename, entry_id)
+        if not os.path.exists(src) or os.path.exists(dst):
+            continue
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(src, dst)
+            moved.append(filename)
+        except Exception as e:
+            _LOGGER.error(f"Errore durante la migrazione di {filename}: {e}")
+    return moved
+
+def load_data_sync(hass, entry_id=None):
     """
     Legge i dati dal file JSON in modo sincrono.
     Restituisce un dizionario vuoto se il file non esiste o è corrotto.
     """
     # Converte il percorso relativo in un percorso assoluto del sistema (es: /config/...)
-    path = hass.config.path(STORAGE_FILE)
+    path = entry_path(hass, STORAGE_FILE, entry_id)
     
     # Se il file non esiste ancora (es: prima installazione), restituiamo un dizionario vuoto
     if not os.path.exists(path):
@@ -34,13 +158,15 @@ def load_data_sync(hass):
         _LOGGER.error(f"Errore durante la lettura del file JSON: {e}")
         return {}
 
-def save_data_sync(hass, data):
+def save_data_sync(hass, data, entry_id=None):
     """
     Salva i dati nel file JSON in modo sincrono.
     Se la cartella non esiste, viene creata automaticamente.
+    Restituisce True se il salvataggio è andato a buon fine.
     """
-    # Definisce il percorso assoluto: /config/octopus_data/octopus_energy.json
-    path = hass.config.path(STORAGE_FILE)
+    # Definisce il percorso assoluto: /config/octopus_data/<entry_id>/octopus_energy.json
+    path = entry_path(hass, STORAGE_FILE, entry_id)
+    tmp_path = f"{path}.tmp"
     
     try:
         # Crea la cartella 'octopus_data' se non esiste (exist_ok=True evita errori se esiste già)
@@ -48,12 +174,34 @@ def save_data_sync(hass, data):
         
         # Scrive effettivamente il dizionario 'data' nel file JSON.
         # indent=4 rende il file leggibile anche da un essere umano se aperto con un editor.
-        with open(path, 'w', encoding='utf-8') as f:
+        # Si scrive prima su un file temporaneo e poi lo si rinomina: un'interruzione di corrente
+        # a metà scrittura non può più lasciare un JSON troncato.
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return True
             
     except Exception as e:
         # Usiamo il logger ufficiale di Home Assistant per tracciare i problemi di scrittura
         _LOGGER.error(f"Errore critico durante il salvataggio dei dati Octopus: {e}")
+        return False
+
+def load_watermark_sync(hass, entry_id=None):
+    """
+    Legge il watermark delle statistiche già inviate al Recorder dal file delle versioni precedenti.
+    Restituisce None se il file non esiste o non è leggibile: in quel caso serve una sincronizzazione completa.
+    """
+    path = entry_path(hass, WATERMARK_FILE, entry_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        _LOGGER.warning(f"Watermark delle statistiche non leggibile, verrà eseguita una sincronizzazione completa: {e}")
+        return None
 
 def has_date(data, date_str):
     """
@@ -67,4 +215,1358 @@ def add_day(data, date_str, cumulative_value):
     Aggiunge o aggiorna una lettura nel dizionario in memoria.
     La chiave è la data (YYYY-MM-DD), il valore è il totale kWh cumulativo.
     """
-    data[date_str] = cumulative_value
\ No newline at end of file
+    data[date_str] = cumulative_value
+
+def load_journal_sync(hass, entry_id=None):
+    """
+    Ricostruisce lo storico leggendo lo snapshot JSON e riapplicando le righe del journal.
+    Restituisce la coppia (dati, numero di righe del journal riapplicate).
+    Una riga illeggibile (tipicamente l'ultima, troncata da un crash) viene ignorata.
+    """
+    data = load_data_sync(hass, entry_id)
+    path = entry_path(hass, JOURNAL_FILE, entry_id)
+
+    if not os.path.exists(path):
+        return data, 0
+
+    lines = 0
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    date_str, cumulative_value = json.loads(line)
+                except (ValueError, TypeError):
+                    _LOGGER.warning(f"Riga del journal non valida ignorata: {line.strip()!r}")
+                    continue
+                add_day(data, date_str, cumulative_value)
+                lines += 1
+    except Exception as e:
+        _LOGGER.error(f"Errore durante la lettura del journal: {e}")
+
+    return data, lines
+
+def append_journal_sync(hass, entries, entry_id=None, check_tail=True):
+    """
+    Accoda una riga al journal per ogni coppia (data, cumulativo) di 'entries'.
+    Il costo su disco dipende solo dal numero di letture nuove, non dalla dimensione dello storico.
+    Con check_tail=False (il file è stato scritto per intero da questo processo) non viene letto nulla.
+    Restituisce True se la scrittura è andata a buon fine.
+    """
+    path = entry_path(hass, JOURNAL_FILE, entry_id)
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a+b') as f:
+            # Se un crash ha lasciato l'ultima riga a metà la chiudiamo, così la riga nuova resta leggibile.
+            if check_tail and f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            for date_str, cumulative_value in entries:
+                f.write((json.dumps([date_str, cumulative_value]) + "\n").encode('utf-8'))
+            # fsync: dopo il ritorno la riga è sul disco, un crash può perdere al massimo quella in corso.
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+    except Exception as e:
+        _LOGGER.error(f"Errore critico durante la scrittura del journal Octopus: {e}")
+        return False
+
+def compact_journal_sync(hass, data, entry_id=None):
+    """
+    Compatta il journal: salva lo storico completo come nuovo snapshot e solo dopo elimina il journal.
+    Se il salvataggio dello snapshot fallisce il journal viene conservato, quindi nessun dato va perso.
+    """
+    if not save_data_sync(hass, data, entry_id):
+        return False
+
+    path = entry_path(hass, JOURNAL_FILE, entry_id)
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+        return True
+    except Exception as e:
+        _LOGGER.error(f"Errore durante la compattazione del journal: {e}")
+        return False
+
+class _MappedColumn:
+    """
+    Colonna (ordinali o cumulativi) del file binario letta direttamente dalla memoria mappata.
+    Supporta len() e l'accesso per indice/slice: è sufficiente per bisect e per HistoryIndex.
+    """
+
+    def __init__(self, mapped, field):
+        self._mapped = mapped
+        self._field = field
+
+    def __len__(self):
+        return self._mapped.count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._mapped.record(i)[self._field] for i in range(*key.indices(self._mapped.count))]
+        if key < 0:
+            key += self._mapped.count
+        if not 0 <= key < self._mapped.count:
+            raise IndexError(key)
+        return self._mapped.record(key)[self._field]
+
+    def __iter__(self):
+        for i in range(self._mapped.count):
+            yield self._mapped.record(i)[self._field]
+
+class MappedHistoryFile:
+    """
+    Vista in sola lettura del file binario dello storico, mappato in memoria.
+    Il sistema operativo carica solo le pagine effettivamente lette: ultima lettura e base del mese
+    si trovano con poche ricerche binarie, senza interpretare l'intero file.
+    Un record finale troncato (crash durante un'accodatura) viene ignorato.
+    """
+
+    def __init__(self, path):
+        self.count = 0
+        self._mm = None
+        with open(path, 'rb') as f:
+            header = f.read(BINARY_HEADER.size)
+            magic, version, record_size = BINARY_HEADER.unpack(header)
+            if magic != BINARY_MAGIC or version != BINARY_VERSION or record_size != BINARY_RECORD.size:
+                raise ValueError("header non valido")
+            size = os.fstat(f.fileno()).st_size
+            self.count = (size - BINARY_HEADER.size) // BINARY_RECORD.size
+            if self.count:
+                # La mappatura resta valida anche dopo la chiusura del file (e dopo un os.replace del file).
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.ordinals = _MappedColumn(self, 0)
+        self.values = _MappedColumn(self, 1)
+
+    def record(self, i):
+        """Coppia (ordinale, cumulativo) del record i-esimo."""
+        return BINARY_RECORD.unpack_from(self._mm, BINARY_HEADER.size + i * BINARY_RECORD.size)
+
+    def iter_records(self):
+        """Tutti i record in ordine, decodificati in un solo passaggio."""
+        if not self.count:
+            return iter(())
+        end = BINARY_HEADER.size + self.count * BINARY_RECORD.size
+        return BINARY_RECORD.iter_unpack(self._mm[BINARY_HEADER.size:end])
+
+    def items(self):
+        """Coppie (data, cumulativo) di tutti i record, prodotte una alla volta (stessa forma di dict.items())."""
+        return ((ordinal_to_date(ordinal), value) for ordinal, value in self.iter_records())
+
+    def to_dict(self):
+        """Storico completo nel formato del JSON ({'YYYY-MM-DD': cumulativo})."""
+        return dict(self.items())
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+def _binary_records(data):
+    """Record (ordinale, cumulativo) ordinati di un dizionario {data: cumulativo}; le voci non valide vengono scartate."""
+    records = []
+    for date_str, value in data.items():
+        try:
+            records.append((date_to_ordinal(date_str), float(value)))
+        except (ValueError, TypeError) as e:
+            _LOGGER.warning(f"Lettura ignorata dal file binario per data {date_str}: {e}")
+    records.sort()
+    return records
+
+def write_binary_file_sync(path, data):
+    """Scrive l'intero storico nel formato binario (file temporaneo + rinomina atomica)."""
+    records = _binary_records(data)
+    buf = bytearray(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, BINARY_RECORD.size))
+    for record in records:
+        buf += BINARY_RECORD.pack(*record)
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(tmp_path, 'wb') as f:
+        f.write(buf)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_binary_file_sync(path):
+    """Legge l'intero file binario in un dizionario {data: cumulativo}."""
+    mapped = MappedHistoryFile(path)
+    try:
+        return mapped.to_dict()
+    finally:
+        mapped.close()
+
+def save_binary_sync(hass, data, entry_id=None):
+    """Riscrive lo storico completo nel file binario della entry. Restituisce True se è andata a buon fine."""
+    try:
+        write_binary_file_sync(entry_path(hass, BINARY_FILE, entry_id), data)
+        return True
+    except Exception as e:
+        _LOGGER.error(f"Errore critico durante il salvataggio del file binario Octopus: {e}")
+        return False
+
+def _find_binary_record(f, count, ordinal):
+    """Posizione del record con l'ordinale indicato nel file binario aperto (ricerca binaria), None se assente."""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(BINARY_HEADER.size + mid * BINARY_RECORD.size)
+        mid_ordinal = BINARY_RECORD.unpack(f.read(BINARY_RECORD.size))[0]
+        if mid_ordinal < ordinal:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo < count:
+        f.seek(BINARY_HEADER.size + lo * BINARY_RECORD.size)
+        if BINARY_RECORD.unpack(f.read(BINARY_RECORD.size))[0] == ordinal:
+            return lo
+    return None
+
+def append_binary_sync(hass, entries, entry_id=None):
+    """
+    Scrive le coppie (data, cumulativo) ordinate di 'entries' nel file binario.
+    I giorni già presenti (es. i cumulativi ricalcolati dopo una correzione) vengono aggiornati sul posto,
+    essendo i record a dimensione fissa; quelli successivi all'ultimo giorno vengono accodati.
+    Restituisce False se il file manca o se un giorno andrebbe inserito in mezzo: serve una riscrittura completa.
+    """
+    path = entry_path(hass, BINARY_FILE, entry_id)
+    try:
+        with open(path, 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            count = (size - BINARY_HEADER.size) // BINARY_RECORD.size
+            end = BINARY_HEADER.size + count * BINARY_RECORD.size
+            if size != end:
+                # Record troncato da un crash: viene eliminato prima di accodare.
+                f.truncate(end)
+            last_ordinal = None
+            if count:
+                f.seek(end - BINARY_RECORD.size)
+                last_ordinal = BINARY_RECORD.unpack(f.read(BINARY_RECORD.size))[0]
+
+            # Prima si individuano le posizioni di tutti i record: se ne manca anche uno non si scrive nulla.
+            writes = []
+            for date_str, value in entries:
+                ordinal = date_to_ordinal(date_str)
+                if last_ordinal is None or ordinal > last_ordinal:
+                    pos = count
+                    count += 1
+                    last_ordinal = ordinal
+                else:
+                    pos = _find_binary_record(f, count, ordinal)
+                    if pos is None:
+                        return False
+                writes.append((pos, BINARY_RECORD.pack(ordinal, float(value))))
+
+            for pos, record in writes:
+                f.seek(BINARY_HEADER.size + pos * BINARY_RECORD.size)
+                f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        _LOGGER.error(f"Errore critico durante la scrittura del file binario Octopus: {e}")
+        return False
+
+def json_to_binary_sync(json_path, bin_path):
+    """
+    Converte uno storico JSON ({data: cumulativo}) nel formato binario.
+    La conversione è senza perdita: i cumulativi sono float64 e le date ordinali intere.
+    Restituisce il numero di letture convertite.
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    write_binary_file_sync(bin_path, data)
+    return len(_binary_records(data))
+
+def binary_to_json_sync(bin_path, json_path):
+    """Converte il file binario in uno storico JSON leggibile (stesso formato di octopus_energy.json)."""
+    data = read_binary_file_sync(bin_path)
+    tmp_path = f"{json_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, json_path)
+    return len(data)
+
+def load_history_sync(hass, storage_format, entry_id=None):
+    """
+    Carica lo storico della entry e restituisce (dati, indice, righe del journal, file mappato o None, da_riscrivere).
+    Se esistono file di entrambi i formati (l'utente ha cambiato formato dalle opzioni) viene usato il più recente;
+    'da_riscrivere' indica che i dati vanno salvati per intero nel formato configurato.
+    Dal file binario i dati sono None: lo storico resta nelle colonne mappate, senza decodificare tutti i record.
+    """
+    bin_path = entry_path(hass, BINARY_FILE, entry_id)
+    json_mtime = max(
+        (os.path.getmtime(p) for p in (entry_path(hass, STORAGE_FILE, entry_id), entry_path(hass, JOURNAL_FILE, entry_id)) if os.path.exists(p)),
+        default=None,
+    )
+    bin_mtime = os.path.getmtime(bin_path) if os.path.exists(bin_path) else None
+
+    if bin_mtime is not None and (json_mtime is None or bin_mtime >= json_mtime):
+        try:
+            mapped = MappedHistoryFile(bin_path)
+        except Exception as e:
+            _LOGGER.error(f"Errore durante la lettura del file binario, verrà usato lo storico JSON: {e}")
+        else:
+            # L'indice legge direttamente la memoria mappata: nessun ordinamento né conversione delle date.
+            index = HistoryIndex.from_columns(mapped.ordinals, mapped.values)
+            return None, index, 0, mapped, storage_format != STORAGE_FORMAT_BINARY
+
+    data, lines = load_journal_sync(hass, entry_id)
+    # Storico JSON con formato binario configurato: il primo salvataggio crea il file binario completo.
+    return data, HistoryIndex.from_data(data), lines, None, storage_format == STORAGE_FORMAT_BINARY and bool(data)
+
+def record_hash(date_str, cumulative_value):
+    """Impronta a 64 bit di una lettura, esatta sul valore salvato."""
+    payload = f"{date_str}={float(cumulative_value)!r}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), "big")
+
+def history_checksum(data):
+    """
+    Impronta dell'intero storico: somma modulo 2^64 delle impronte delle letture.
+    Non dipende dall'ordine e si aggiorna in O(1) ad ogni lettura aggiunta o corretta.
+    'data' può essere un dizionario {data: cumulativo} o un MappedHistoryFile (stesso metodo items()).
+    """
+    checksum = 0
+    for date_str, value in data.items():
+        try:
+            checksum += record_hash(date_str, value)
+        except (ValueError, TypeError):
+            continue
+    return checksum & 0xFFFFFFFFFFFFFFFF
+
+def _file_stamps(hass, entry_id):
+    """Dimensione e data di modifica dei file dello storico: identificano il contenuto descritto dal riepilogo."""
+    stamps = {}
+    for filename in (STORAGE_FILE, JOURNAL_FILE, BINARY_FILE):
+        path = entry_path(hass, filename, entry_id)
+        if os.path.exists(path):
+            st = os.stat(path)
+            stamps[os.path.basename(path)] = [st.st_size, st.st_mtime_ns]
+    return stamps
+
+def build_summary(index, checksum, storage_format, tail_days=SUMMARY_TAIL_DAYS, extras=None, base=None):
+    """
+    Riepilogo dello storico calcolato dall'indice: prima e ultima lettura, totale di apertura (cumulativo
+    prima del giorno 1) di ogni mese, letture degli ultimi 'tail_days' giorni, letture attorno allo stesso
+    periodo dell'anno precedente e impronta del contenuto.
+    'extras' è lo stato aggiuntivo della entry salvato insieme al riepilogo (es. il filtro anomalie).
+    'base' ({"count", "last_year"}) serve quando 'index' è l'indice parziale di un riepilogo (vedi summary_index)
+    con letture accodate: numero di letture e finestra dell'anno precedente non si ricavano dall'indice.
+    """
+    summary = {
+        "version": SUMMARY_VERSION,
+        "format": storage_format,
+        "count": len(index) if base is None else base["count"],
+        "first": None,
+        "last_date": "",
+        "last_total": 0.0,
+        "months": {},
+        "tail_days": tail_days,
+        "tail": [],
+        "last_year": None,
+        "checksum": format(checksum, "x"),
+        "extras": extras or {},
+    }
+    last = index.last()
+    if last is None:
+        return summary
+
+    summary["last_date"], summary["last_total"] = last
+    summary["first"] = list(index.first())
+    first_day = date.fromisoformat(summary["first"][0]).replace(day=1)
+    last_day = date.fromisoformat(last[0])
+    month = first_day
+    while month <= last_day:
+        summary["months"][month.strftime("%Y-%m")] = index.value_at(month - timedelta(days=1))
+        month = (month + timedelta(days=32)).replace(day=1)
+    summary["tail"] = index.records_since(last_day - timedelta(days=tail_days))
+    if base is not None:
+        summary["last_year"] = base["last_year"]
+    else:
+        # Cumulativo del giorno prima della finestra più le letture fino a 'until': bastano per il consumo
+        # dell'anno precedente (vedi RollingAggregates.add) delle letture accodate dal solo riepilogo,
+        # finché il loro corrispondente dell'anno prima non supera 'until'.
+        start = last_day.toordinal() - SUMMARY_LAST_YEAR_DAYS
+        until = last_day.toordinal() - 365 + tail_days
+        summary["last_year"] = {
+            "until": until,
+            "points": [(start, index.value_at(start))] + index.records_between(start + 1, until),
+        }
+    return summary
+
+def summary_index(summary):
+    """
+    Indice parziale ricostruito dal riepilogo: prima lettura, letture degli ultimi giorni e dello stesso periodo
+    dell'anno precedente più i totali di apertura dei mesi precedenti.
+    È esatto per tutte le interrogazioni dei sensori (mese, settimana, anno, finestra mobile, costo del mese)
+    e per gli accumulatori delle letture accodate senza caricare lo storico completo.
+    """
+    points = {}
+    tail_start = summary["tail"][0][0] if summary["tail"] else None
+    # Riepiloghi scritti da versioni precedenti: senza prima lettura né finestra dell'anno precedente.
+    first = summary.get("first")
+    first_ordinal = date.fromisoformat(first[0]).toordinal() if first else None
+    for month, opening in summary["months"].items():
+        ordinal = date.fromisoformat(f"{month}-01").toordinal() - 1
+        if (tail_start is None or ordinal < tail_start) and (first_ordinal is None or ordinal > first_ordinal):
+            points[ordinal] = float(opening)
+    if first:
+        points[first_ordinal] = float(first[1])
+    for ordinal, value in (summary.get("last_year") or {}).get("points", []):
+        # Prima della prima lettura il cumulativo è comunque 0: nessun punto da aggiungere.
+        if first_ordinal is None or ordinal >= first_ordinal:
+            points[int(ordinal)] = float(value)
+    for ordinal, value in summary["tail"]:
+        points[int(ordinal)] = float(value)
+    ordinals = sorted(points)
+    return HistoryIndex.from_columns(ordinals, [points[o] for o in ordinals])
+
+def load_summary_sync(hass, entry_id=None, allow_stale=False):
+    """
+    Legge il riepilogo dello storico. Restituisce None se manca, non è leggibile oppure
+    non corrisponde più ai file dello storico (es. scritti da una versione precedente o modificati a mano).
+    Con 'allow_stale' un riepilogo leggibile ma non più corrispondente ai file viene restituito comunque,
+    con la chiave "stale": è l'ultimo stato noto, utilizzabile finché lo storico completo non viene caricato.
+    """
+    path = entry_path(hass, SUMMARY_FILE, entry_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            summary = json.load(f)
+    except Exception as e:
+        _LOGGER.warning(f"Riepilogo dello storico non leggibile, verrà caricato lo storico completo: {e}")
+        return None
+    if not isinstance(summary, dict) or summary.get("version") != SUMMARY_VERSION:
+        return None
+    if summary.get("files") != _file_stamps(hass, entry_id):
+        _LOGGER.debug("Riepilogo dello storico non aggiornato rispetto ai file: verrà caricato lo storico completo")
+        if not allow_stale:
+            return None
+        summary["stale"] = True
+    return summary
+
+def save_summary_sync(hass, summary, entry_id=None):
+    """
+    Salva il riepilogo (scrittura atomica) con l'impronta dei file dello storico appena scritti.
+    Va eseguito sullo stesso thread di I/O subito dopo la scrittura dello storico.
+    """
+    path = entry_path(hass, SUMMARY_FILE, entry_id)
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(summary, files=_file_stamps(hass, entry_id)), f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        _LOGGER.error(f"Errore durante il salvataggio del riepilogo dello storico: {e}")
+
+class DelayedSaveStore:
+    """
+    Base comune per gli archivi residenti in memoria con salvataggio differito (write-behind).
+    Più modifiche ravvicinate producono una sola scrittura; lo scarico su disco è garantito
+    alla rimozione della entry e allo spegnimento di Home Assistant.
+    Le sottoclassi implementano _async_write() (True se la scrittura è riuscita) e _metric_paths()
+    (file dell'archivio, per i byte letti e scritti della strumentazione).
+    """
+
+    # Prefisso delle misure di questo archivio nella strumentazione (vedi metrics.py)
+    METRICS_NAME = "store"
+
+    def __init__(self, hass, save_delay=SAVE_DELAY, io=None, metrics=None):
+        self.hass = hass
+        # Esecutore dedicato all'I/O della entry (StorageExecutor); None = pool condiviso di HA
+        self._io = io
+        self.metrics = metrics or NULL_METRICS
+        self._save_delay = save_delay
+        self._dirty = False
+        self._save_lock = asyncio.Lock()
+        self._unsub_save = None
+        self._unsub_final_write = None
+
+    @callback
+    def _async_listen_final_write(self):
+        """FINAL_WRITE è l'ultimo evento utile per scrivere su disco prima della chiusura di HA."""
+        self._unsub_final_write = self.hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_FINAL_WRITE, self._async_on_final_write
+        )
+
+    @callback
+    def async_delay_save(self):
+        """
+        Segna l'archivio come modificato e avvia il timer di salvataggio.
+        Se un timer è già in corso non ne viene creato un altro: la raffica di modifiche
+        confluisce nella scrittura già pianificata.
+        """
+        self._dirty = True
+        if self._unsub_save is None:
+            self._unsub_save = async_call_later(self.hass, self._save_delay, self._async_on_save_timer)
+
+    async def _async_on_save_timer(self, _now):
+        """Scadenza del timer di salvataggio differito."""
+        self._unsub_save = None
+        await self.async_flush()
+
+    async def _async_on_final_write(self, _event):
+        """Spegnimento di Home Assistant: scrive immediatamente le modifiche pendenti."""
+        self._unsub_final_write = None
+        await self.async_flush()
+
+    async def async_flush(self):
+        """Scrive subito su disco le modifiche pendenti (se presenti)."""
+        if self._unsub_save is not None:
+            self._unsub_save()
+            self._unsub_save = None
+
+        # Il lock evita che due scritture concorrenti arrivino sul file in ordine invertito.
+        async with self._save_lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            before = await self._async_file_stamps()
+            with self.metrics.timer(f"{self.METRICS_NAME}_write_ms"):
+                ok = await self._async_write()
+            if not ok:
+                # Scrittura fallita: le modifiche restano pendenti per il prossimo tentativo.
+                self._dirty = True
+            if before is not None:
+                written = bytes_written(before, await self._async_file_stamps())
+                self.metrics.observe(f"{self.METRICS_NAME}_bytes_written", written, BYTES_BUCKETS)
+
+        await self._async_after_flush()
+
+    async def _async_write(self):
+        raise NotImplementedError
+
+    def _metric_paths(self):
+        return []
+
+    async def _async_file_stamps(self, paths=None):
+        """Dimensione e inode dei file dell'archivio, solo con la strumentazione attiva (altrimenti None)."""
+        if not self.metrics.enabled:
+            return None
+        return await async_run_io(self.hass, self._io, file_stamps_sync, paths or self._metric_paths())
+
+    async def _async_observe_bytes_read(self, name, paths=None):
+        """Registra nell'istogramma 'name' la dimensione dei file appena letti."""
+        stamps = await self._async_file_stamps(paths)
+        if stamps is not None:
+            self.metrics.observe(name, sum(size for size, _inode in stamps.values()), BYTES_BUCKETS)
+
+    async def _async_after_flush(self):
+        """Punto di estensione eseguito fuori dal lock dopo ogni scarico su disco."""
+
+    async def async_close(self):
+        """Chiamato allo scaricamento della entry: rimuove i listener e forza lo scarico su disco."""
+        if self._unsub_final_write is not None:
+            self._unsub_final_write()
+            self._unsub_final_write = None
+        await self.async_flush()
+
+class OctopusHistory(DelayedSaveStore):
+    """
+    Storico residente in memoria di una singola entry.
+    Il file JSON viene letto una sola volta all'avvio e i sensori lavorano sul dizionario in RAM,
+    con salvataggio differito tramite DelayedSaveStore.
+    Con il formato 'journal' ogni scrittura accoda solo le letture nuove e lo snapshot JSON
+    viene riscritto in background quando il journal supera la soglia di compattazione.
+    Accanto al dizionario è mantenuto un HistoryIndex ordinato per le interrogazioni per periodo.
+    Se il riepilogo su disco è aggiornato, all'avvio viene letto solo quello: l'indice è parziale
+    (sufficiente per i sensori) e il dizionario completo viene caricato da async_ensure_loaded()
+    alla prima operazione che lo richiede (correzioni, sincronizzazione completa, interrogazioni storiche).
+    Con i formati journal e binario anche un giorno nuovo viene accodato dal solo riepilogo (vedi async_ensure_writable).
+    """
+
+    METRICS_NAME = "history"
+
+    def __init__(self, hass, entry_id, storage_format=STORAGE_FORMAT_JSON, save_delay=SAVE_DELAY, io=None, tail_days=SUMMARY_TAIL_DAYS, metrics=None):
+        super().__init__(hass, save_delay, io, metrics)
+        self.entry_id = entry_id
+        self._data = {}
+        self.index = HistoryIndex()
+        # False finché data/index provengono solo dal riepilogo
+        self.loaded = False
+        # True se il riepilogo letto all'avvio manca o non è aggiornato: i valori sono solo l'ultimo stato noto
+        self.stale = False
+        # Impronta del contenuto (vedi history_checksum), aggiornata ad ogni lettura
+        self._checksum = 0
+        self._tail_days = tail_days
+        self._tail_dates = set()
+        self._load_lock = asyncio.Lock()
+        self._storage_format = storage_format
+        self._pending = {}  # Letture modificate dall'ultima scrittura (solo formato journal)
+        self._journal_lines = 0
+        # True quando l'ultima riga del journal è stata scritta (completa) da questo processo
+        self._journal_tail_ok = False
+        # File binario mappato in memoria su cui poggia l'indice finché non viene modificato
+        self._mapped = None
+        # True se il prossimo salvataggio deve riscrivere l'intero storico (cambio di formato, correzioni retroattive)
+        self._full_write = False
+        # Stato aggiuntivo salvato nel riepilogo (vedi async_set_extra) e flag di riepilogo da riscrivere
+        self.extras = {}
+        self._summary_dirty = False
+        # Finché l'indice viene dal solo riepilogo: numero di letture e finestra dell'anno precedente (vedi build_summary)
+        self._base = None
+        # Letture accodate dal solo riepilogo, riapplicate allo storico completo quando viene caricato
+        self._appended = {}
+
+    @property
+    def _journal_mode(self):
+        return self._storage_format == STORAGE_FORMAT_JOURNAL
+
+    @property
+    def _binary_mode(self):
+        return self._storage_format == STORAGE_FORMAT_BINARY
+
+    @property
+    def data(self):
+        """
+        Storico {data: cumulativo}, con i cumulativi spostati dalle correzioni già riportati (vedi _async_settle).
+        Con il file binario il dizionario viene costruito dall'indice solo al primo accesso (esportazione,
+        sincronizzazione completa delle statistiche, riscrittura completa) e da lì in avanti mantenuto aggiornato.
+        """
+        self._async_settle()
+        if self._data is None:
+            self._data = {ordinal_to_date(ordinal): value for ordinal, value in self.index.records_since(date.min)}
+        return self._data
+
+    @property
+    def checksum(self):
+        """Impronta dello storico, comprese le letture spostate dalle correzioni (vedi _async_settle)."""
+        self._async_settle()
+        return self._checksum
+
+    @property
+    def count(self):
+        """Numero di letture dello storico; disponibile anche dal solo riepilogo."""
+        return len(self.index) if self._base is None else self._base["count"]
+
+    async def async_load(self):
+        """
+        Legge il riepilogo dello storico (tempo costante) e si registra per lo scarico finale allo spegnimento.
+        Il tempo di avvio non dipende mai dalla dimensione dello storico: un riepilogo non più allineato ai file
+        (o scritto con un altro formato o con meno giorni recenti) viene usato comunque come ultimo stato noto
+        e segnato come 'stale'; senza alcun riepilogo l'indice resta vuoto. In entrambi i casi lo storico completo
+        va caricato in background con async_ensure_loaded(), che ricrea anche il riepilogo.
+        """
+        with self.metrics.timer("history_load_summary_ms"):
+            summary = await async_run_io(self.hass, self._io, load_summary_sync, self.hass, self.entry_id, True)
+        await self._async_observe_bytes_read("history_summary_bytes_read", [entry_path(self.hass, SUMMARY_FILE, self.entry_id)])
+        if summary is not None:
+            self.index = summary_index(summary)
+            self._checksum = int(summary["checksum"], 16)
+            self._tail_dates = {ordinal_to_date(ordinal) for ordinal, _ in summary["tail"]}
+            self.extras = summary.get("extras") or {}
+            self.stale = (
+                summary.get("stale", False)
+                or summary.get("format") != self._storage_format
+                or summary.get("tail_days", 0) < self._tail_days
+            )
+            # Storico vuoto: non c'è nulla da caricare.
+            self.loaded = not summary["count"] and not self.stale
+            if not self.loaded:
+                self._base = {"count": summary["count"], "last_year": summary.get("last_year")}
+            if self._journal_mode and not self.stale:
+                self._journal_lines = summary.get("journal_lines", 0)
+        else:
+            self.stale = True
+
+        self._async_listen_final_write()
+
+    async def async_ensure_loaded(self):
+        """Carica lo storico completo se finora è stato usato solo il riepilogo (una volta sola)."""
+        if self.loaded:
+            return
+        async with self._load_lock:
+            if self.loaded:
+                return
+            expected = self.checksum
+            await self._async_load_full()
+            _LOGGER.debug(f"Storico completo caricato su richiesta per la entry {self.entry_id} ({len(self.index)} letture)")
+            if self.stale:
+                # Riepilogo assente o non aggiornato: viene ricreato dallo storico appena letto.
+                self.stale = False
+                self._summary_dirty = False
+                await async_run_io(
+                    self.hass, self._io, save_summary_sync, self.hass, self._build_summary(), self.entry_id
+                )
+            elif self.checksum != expected:
+                _LOGGER.warning(f"Il riepilogo dello storico della entry {self.entry_id} non corrisponde ai dati: verrà ricreato")
+                await async_run_io(
+                    self.hass, self._io, save_summary_sync, self.hass, self._build_summary(), self.entry_id
+                )
+
+    async def async_ensure_writable(self, date_str):
+        """
+        Prepara lo storico alla lettura del giorno date_str, caricando lo storico completo solo se serve.
+        Con i formati journal e binario un giorno nuovo (o l'aggiornamento dell'ultimo) viene accodato anche dal solo
+        riepilogo: righe, impronta e riepilogo si aggiornano senza leggere gli anni di storico.
+        Correzioni retroattive, formato JSON (che riscrive l'intero file) e riepiloghi non aggiornati
+        richiedono il caricamento completo.
+        """
+        if not self.loaded and not self._can_append(date_str):
+            await self.async_ensure_loaded()
+
+    def _can_append(self, date_str):
+        """True se la lettura del giorno date_str si può accodare all'indice parziale del riepilogo."""
+        last_date = self.last_date
+        last_year = self._base["last_year"] if self._base is not None else None
+        return (
+            not self.stale
+            and (self._journal_mode or self._binary_mode)
+            and last_year is not None
+            and last_date is not None
+            and date_str >= last_date
+            # Il consumo dello stesso giorno dell'anno precedente deve cadere nella finestra del riepilogo.
+            and date.fromisoformat(date_str).toordinal() - 365 <= last_year["until"]
+        )
+
+    async def _async_load_full(self):
+        """Carica in memoria lo storico completo e ne calcola l'impronta."""
+        # Lo snapshot viene sempre integrato con l'eventuale journal (o letto dal file binario, se più recente),
+        # così si può passare da un formato all'altro senza perdere le letture non ancora compattate.
+        # L'unico ordinamento dell'intero storico avviene qui, fuori dal loop di eventi.
+        with self.metrics.timer("history_load_full_ms"):
+            self._data, self.index, self._journal_lines, self._mapped, self._full_write = await async_run_io(
+                self.hass, self._io, load_history_sync, self.hass, self._storage_format, self.entry_id
+            )
+        recomputed = self._data is not None or self.stale
+        if recomputed:
+            with self.metrics.timer("history_checksum_ms"):
+                self._checksum = await async_run_io(
+                    self.hass, self._io, history_checksum, self._data if self._data is not None else self._mapped
+                )
+        # File binario con riepilogo aggiornato: i file corrispondono al riepilogo, quindi anche l'impronta
+        # è quella già letta. Nessun record viene decodificato finché non serve.
+        await self._async_observe_bytes_read("history_bytes_read")
+
+        # Letture accodate dal solo riepilogo: quelle non ancora su disco (salvataggio in corso o fallito)
+        # mancano dai file appena letti. Restano comunque tra le letture da scrivere.
+        for date_str, value in self._appended.items():
+            previous = self.index.set(date_str, value)
+            if previous == value:
+                continue
+            if self._mapped is not None:
+                self._mapped.close()
+                self._mapped = None
+            if self._data is not None:
+                add_day(self._data, date_str, value)
+            if recomputed:
+                if previous is not None:
+                    self._checksum -= record_hash(date_str, previous)
+                self._checksum = (self._checksum + record_hash(date_str, value)) & 0xFFFFFFFFFFFFFFFF
+        self._appended = {}
+        self._base = None
+        self.loaded = True
+        if self._full_write or (self._journal_lines and not self._journal_mode):
+            # Formato cambiato o journal residuo: il prossimo salvataggio riscrive lo storico nel formato configurato.
+            self.async_delay_save()
+
+    @property
+    def last_date(self):
+        """Data dell'ultima lettura (None se lo storico è vuoto); disponibile anche dal solo riepilogo."""
+        last = self.index.last()
+        return last[0] if last else None
+
+    def has_date(self, date_str):
+        """Equivalente di has_date() applicato all'indice in memoria (richiede lo storico completo)."""
+        return self.value_of(date_str) is not None
+
+    async def async_has_date(self, date_str):
+        """
+        Come has_date(), ma risponde dal riepilogo quando possibile (data successiva all'ultima
+        o compresa negli ultimi giorni) e carica lo storico completo solo per le date più vecchie.
+        """
+        if not self.loaded and not self.stale:
+            last_date = self.last_date
+            if last_date is None or date_str > last_date:
+                return False
+            if date_str in self._tail_dates:
+                return True
+        await self.async_ensure_loaded()
+        return self.has_date(date_str)
+
+    def _metric_paths(self):
+        return [
+            entry_path(self.hass, filename, self.entry_id)
+            for filename in (STORAGE_FILE, JOURNAL_FILE, BINARY_FILE, SUMMARY_FILE)
+        ]
+
+    def _build_summary(self):
+        # Copia dello stato aggiuntivo: il thread di I/O lo serializza mentre il loop può modificarlo.
+        summary = build_summary(
+            self.index, self.checksum, self._storage_format, self._tail_days, copy.deepcopy(self.extras),
+            None if self._base is None else dict(self._base),
+        )
+        # Righe del journal non ancora compattate: servono alla soglia di compattazione dopo un riavvio.
+        summary["journal_lines"] = self._journal_lines
+        return summary
+
+    @callback
+    def async_set_extra(self, key, value):
+        """
+        Aggiorna lo stato aggiuntivo 'key' salvato nel riepilogo e pianifica il salvataggio differito.
+        Se non ci sono letture da scrivere viene riscritto solo il riepilogo.
+        """
+        self.extras[key] = value
+        self._summary_dirty = True
+        self.async_delay_save()
+
+    def day_kwh(self, date_str):
+        """
+        kWh registrati nel giorno indicato (None se il giorno non è presente).
+        Per i giorni recenti la risposta arriva anche dal solo riepilogo.
+        """
+        return self.index.day_value(date.fromisoformat(date_str))
+
+    @callback
+    def async_set_daily(self, date_str, kwh):
+        """
+        Registra il consumo 'kwh' del giorno date_str, che può essere un giorno nuovo, un giorno
+        precedente all'ultimo (inserimento retroattivo) oppure la correzione di un giorno già presente.
+        Il cumulativo del giorno diventa 'cumulativo del giorno precedente + kwh' e tutti i cumulativi
+        successivi vengono spostati della differenza in O(log n): solo nell'indice, mentre dizionario, impronta
+        e letture da scrivere dei giorni successivi vengono aggiornati una volta sola (vedi _async_settle),
+        anche dopo molte correzioni ravvicinate (es. un recupero di più giorni).
+        Restituisce False se il valore registrato era già identico.
+        """
+        day = date.fromisoformat(date_str)
+        new_cum = round(self.index.value_at(day - timedelta(days=1)) + kwh, 3)
+        current = self.value_of(date_str)
+        # Gli spostamenti non ancora consolidati lasciano residui in virgola mobile: il confronto è sul valore
+        # arrotondato, lo stesso che _async_settle scriverebbe.
+        if current is not None and round(current, 3) == new_cum:
+            return False
+
+        # Per un giorno nuovo value_at(day) è il cumulativo del giorno precedente: la differenza è proprio kwh.
+        delta = new_cum - self.index.value_at(day)
+        self.async_add_day(date_str, new_cum)
+        if delta:
+            self.index.shift_after(day, delta)
+        return True
+
+    def value_of(self, date_str):
+        """
+        Cumulativo registrato nel giorno indicato (None se il giorno non è presente), letto dall'indice
+        comprese le correzioni non ancora consolidate. Per i giorni recenti risponde anche dal solo riepilogo.
+        """
+        day = date.fromisoformat(date_str)
+        if self.index.day_value(day) is None:
+            return None
+        return self.index.value_at(day)
+
+    @callback
+    def _async_settle(self):
+        """
+        Riporta nel dizionario, nell'impronta e nelle letture da scrivere i cumulativi spostati dalle correzioni
+        (vedi HistoryIndex.apply_offsets): O(k) per le k letture successive alla correzione più vecchia,
+        eseguito al salvataggio o alla prima lettura di 'data' o 'checksum', non ad ogni correzione.
+        """
+        for ordinal, previous, value in self.index.apply_offsets(3):
+            self._async_store(ordinal_to_date(ordinal), value, previous)
+
+    @callback
+    def async_merge_daily(self, readings, overwrite=False):
+        """
+        Unisce allo storico i consumi giornalieri {data ISO: kWh} importati da file, in un solo passaggio.
+        Senza 'overwrite' i giorni già presenti restano invariati. I cumulativi vengono ricalcolati
+        una volta sola dal primo giorno modificato (invece di uno spostamento per ogni giorno importato)
+        e il prossimo salvataggio riscrive l'intero storico.
+        Restituisce la prima data modificata (None se non è cambiato nulla).
+        """
+        if not self.loaded:
+            raise RuntimeError("Storico non ancora caricato: chiamare async_ensure_loaded() prima di modificarlo")
+
+        changes = {}
+        for date_str, kwh in readings.items():
+            day = date.fromisoformat(date_str)
+            current = self.index.day_value(day)
+            if current is not None and (not overwrite or abs(current - kwh) < 0.0005):
+                continue
+            changes[day.toordinal()] = kwh
+        if not changes:
+            return None
+
+        # replace_from consolida gli spostamenti: prima vanno riportati nel dizionario e nell'impronta.
+        self._async_settle()
+        first_day = date.fromordinal(min(changes))
+        # Consumi giornalieri dal primo giorno modificato: quelli già presenti aggiornati con quelli importati.
+        daily = dict(self.index.daily_since(first_day))
+        daily.update(changes)
+        cumulative = self.index.value_at(first_day - timedelta(days=1))
+        records = []
+        for ordinal in sorted(daily):
+            cumulative = round(cumulative + daily[ordinal], 3)
+            records.append((ordinal, cumulative))
+
+        stored = dict(self.index.records_after(first_day - timedelta(days=1)))
+        self.index.replace_from(first_day, records)
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+        for ordinal, cumulative in records:
+            previous = stored.get(ordinal)
+            if previous != cumulative:
+                self._async_store(ordinal_to_date(ordinal), cumulative, previous)
+        # Molti giorni in mezzo allo storico: una riscrittura completa costa meno di altrettante righe accodate.
+        self._full_write = True
+        self.async_delay_save()
+        return first_day.isoformat()
+
+    @callback
+    def async_drop_before(self, day, keep=()):
+        """
+        Elimina dallo storico le letture precedenti al giorno 'day', tranne quelle con ordinale in 'keep'
+        (vedi retention.py). I cumulativi conservati non cambiano; il prossimo salvataggio riscrive l'intero storico.
+        Restituisce il numero di letture eliminate.
+        """
+        if not self.loaded:
+            raise RuntimeError("Storico non ancora caricato: chiamare async_ensure_loaded() prima di modificarlo")
+        # drop_before consolida gli spostamenti: prima vanno riportati nel dizionario e nell'impronta.
+        self._async_settle()
+        stored = dict(self.index.records_between(1, day.toordinal() - 1))
+        removed = self.index.drop_before(day, keep)
+        if not removed:
+            return 0
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+        for ordinal in removed:
+            date_str = ordinal_to_date(ordinal)
+            self._checksum = (self._checksum - record_hash(date_str, stored[ordinal])) & 0xFFFFFFFFFFFFFFFF
+            if self._data is not None:
+                self._data.pop(date_str, None)
+            self._pending.pop(date_str, None)
+        self._full_write = True
+        self.async_delay_save()
+        return len(removed)
+
+    @callback
+    def _async_store(self, date_str, cumulative_value, previous=None):
+        """
+        Aggiorna dizionario, impronta e letture da scrivere per un cumulativo già presente nell'indice.
+        'previous' è il valore salvato in precedenza per quel giorno (None per un giorno nuovo).
+        """
+        if previous is not None:
+            self._checksum -= record_hash(date_str, previous)
+        self._checksum = (self._checksum + record_hash(date_str, cumulative_value)) & 0xFFFFFFFFFFFFFFFF
+        if self._data is not None:
+            add_day(self._data, date_str, cumulative_value)
+        self._pending[date_str] = cumulative_value
+
+    @callback
+    def async_add_day(self, date_str, cumulative_value):
+        """
+        Aggiunge una lettura in memoria e pianifica il salvataggio differito.
+        Lo storico completo deve essere già caricato (vedi async_ensure_loaded), tranne che per un giorno
+        che si può accodare al solo riepilogo (vedi async_ensure_writable).
+        """
+        if not self.loaded and not self._can_append(date_str):
+            raise RuntimeError("Storico non ancora caricato: chiamare async_ensure_loaded() prima di modificarlo")
+        last_date = self.last_date
+        if last_date is not None and date_str < last_date and self.value_of(date_str) is None:
+            # Inserimento in mezzo all'indice: consolida gli spostamenti, che vanno prima riportati nel dizionario.
+            self._async_settle()
+        previous = self.index.set(date_str, cumulative_value)
+        if self._mapped is not None:
+            # L'indice è ora in liste proprie: la mappatura del file non serve più.
+            self._mapped.close()
+            self._mapped = None
+        if not self.loaded:
+            self._appended[date_str] = cumulative_value
+            self._tail_dates.add(date_str)
+            if previous is None:
+                self._base["count"] += 1
+        self._async_store(date_str, cumulative_value, previous)
+        self.async_delay_save()
+
+    async def _async_write(self):
+        # I cumulativi spostati dalle correzioni entrano qui, una volta sola, tra le letture da scrivere.
+        self._async_settle()
+        pending, self._pending = self._pending, {}
+        full_write, self._full_write = self._full_write, False
+        # Il riepilogo descrive esattamente il contenuto che sta per essere scritto.
+        summary = self._build_summary()
+        summary_dirty, self._summary_dirty = self._summary_dirty, False
+
+        if not pending and not full_write and not (self._journal_lines and not self._journal_mode):
+            # Nessuna lettura da scrivere: al più il riepilogo con lo stato aggiuntivo aggiornato.
+            # Un indice provvisorio (riepilogo non aggiornato) non va salvato: lo stato aggiuntivo
+            # verrà scritto con il riepilogo ricreato dal caricamento completo.
+            if self.stale:
+                self._summary_dirty = self._summary_dirty or summary_dirty
+            elif summary_dirty:
+                await async_run_io(self.hass, self._io, save_summary_sync, self.hass, summary, self.entry_id)
+            return True
+
+        if self._binary_mode:
+            ok = True
+            if pending and not full_write:
+                # Solo i record nuovi (o l'ultimo giorno aggiornato sul posto): pochi byte per salvataggio.
+                ok = await async_run_io(
+                    self.hass, self._io, append_binary_sync, self.hass, sorted(pending.items()), self.entry_id
+                )
+                # Un giorno da inserire in mezzo al file richiede la riscrittura completa,
+                # che dal solo riepilogo non è possibile: le letture restano da scrivere.
+                full_write = not ok and self.loaded
+            if full_write:
+                ok = await async_run_io(self.hass, self._io, save_binary_sync, self.hass, dict(self.data), self.entry_id)
+        elif self._journal_mode and not full_write:
+            if not pending:
+                return True
+            # Solo le righe nuove: O(letture modificate) byte scritti, indipendentemente dagli anni di storico.
+            entries = sorted(pending.items())
+            ok = await async_run_io(
+                self.hass, self._io, append_journal_sync, self.hass, entries, self.entry_id, not self._journal_tail_ok
+            )
+            if ok:
+                self._journal_lines += len(entries)
+                self._journal_tail_ok = True
+        else:
+            # Copia superficiale: il thread di I/O serializza uno snapshot stabile
+            # mentre il loop può continuare a modificare il dizionario originale.
+            snapshot = dict(self.data)
+            ok = await async_run_io(self.hass, self._io, compact_journal_sync, self.hass, snapshot, self.entry_id)
+            if ok:
+                self._journal_lines = 0
+
+        if ok:
+            summary["journal_lines"] = self._journal_lines
+            await async_run_io(self.hass, self._io, save_summary_sync, self.hass, summary, self.entry_id)
+        else:
+            self._pending = {**pending, **self._pending}
+            self._full_write = self._full_write or full_write
+            self._summary_dirty = self._summary_dirty or summary_dirty
+        return ok
+
+    async def _async_after_flush(self):
+        if self._journal_mode and self._journal_lines >= max(JOURNAL_COMPACT_LINES, self.count):
+            self.hass.async_create_background_task(
+                self.async_compact(), f"{DOMAIN} journal compaction"
+            )
+
+    async def async_close(self):
+        await super().async_close()
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+
+    async def async_compact(self):
+        """
+        Riscrive lo snapshot JSON e svuota il journal.
+        Gira sotto lo stesso lock delle scritture: nessuna riga può essere accodata
+        tra la copia dello snapshot e la rimozione del journal.
+        """
+        # Lo snapshot contiene l'intero storico: con le sole letture accodate al riepilogo va prima caricato.
+        await self.async_ensure_loaded()
+        async with self._save_lock:
+            if not self._journal_lines:
+                return
+            snapshot = dict(self.data)
+            summary = self._build_summary()
+            # Le letture ancora pendenti sono già nello snapshot: non serve più accodarle.
+            pending, self._pending = self._pending, {}
+            if await async_run_io(self.hass, self._io, compact_journal_sync, self.hass, snapshot, self.entry_id):
+                _LOGGER.debug(f"Journal compattato ({self._journal_lines} righe) per la entry {self.entry_id}")
+                self._journal_lines = summary["journal_lines"] = 0
+                await async_run_io(self.hass, self._io, save_summary_sync, self.hass, summary, self.entry_id)
+            else:
+                self._pending = {**pending, **self._pending}
+
+def load_intervals_sync(hass, slot_minutes, entry_id=None):
+    """
+    Legge il file binario degli intervalli e restituisce due array (slot, kWh) ordinati per slot.
+    Il file è un header fisso seguito da coppie di float64 (indice dello slot, kWh): viene caricato
+    con una sola frombytes(), senza interpretare riga per riga.
+    Record duplicati (correzioni accodate) vengono risolti tenendo l'ultimo.
+    """
+    path = entry_path(hass, INTERVALS_FILE, entry_id)
+    if not os.path.exists(path):
+        return array('d'), array('d')
+
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(INTERVALS_HEADER.size)
+            magic, version, file_slot_minutes = INTERVALS_HEADER.unpack(header)
+            if magic != INTERVALS_MAGIC or version != INTERVALS_VERSION:
+                raise ValueError("header non valido")
+            payload = f.read()
+    except Exception as e:
+        _LOGGER.error(f"Errore durante la lettura del file degli intervalli: {e}")
+        return array('d'), array('d')
+
+    if file_slot_minutes != slot_minutes:
+        # Durata dello slot cambiata dalle opzioni: il vecchio file viene conservato a parte.
+        _LOGGER.warning(f"Il file degli intervalli usa slot da {file_slot_minutes} minuti: verrà archiviato e ricreato")
+        os.replace(path, f"{path}.{file_slot_minutes}min.bak")
+        return array('d'), array('d')
+
+    records = array('d')
+    # Un eventuale record troncato da un crash viene ignorato.
+    records.frombytes(payload[: len(payload) - len(payload) % 16])
+    if sys.byteorder == "big":
+        records.byteswap()
+
+    slots = records[0::2]
+    values = records[1::2]
+    if all(a < b for a, b in zip(slots, slots[1:])):
+        return slots, values
+
+    # Percorso lento, solo se sono state accodate correzioni fuori ordine.
+    merged = dict(zip(slots, values))
+    ordered = sorted(merged)
+    return array('d', ordered), array('d', (merged[s] for s in ordered))
+
+def append_intervals_sync(hass, slot_minutes, records, entry_id=None):
+    """
+    Accoda i record (slot, kWh) al file binario, creando l'header se il file non esiste ancora.
+    Restituisce True se la scrittura è andata a buon fine.
+    """
+    path = entry_path(hass, INTERVALS_FILE, entry_id)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        new_file = not os.path.exists(path)
+        buf = array('d', (x for record in records for x in record))
+        if sys.byteorder == "big":
+            buf.byteswap()
+        with open(path, 'ab') as f:
+            if new_file:
+                f.write(INTERVALS_HEADER.pack(INTERVALS_MAGIC, INTERVALS_VERSION, slot_minutes))
+            f.write(buf.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+    except Exception as e:
+        _LOGGER.error(f"Errore critico durante il salvataggio degli intervalli Octopus: {e}")
+        return False
+
+def save_intervals_sync(hass, slot_minutes, slots, values, entry_id=None):
+    """
+    Riscrive l'intero file degli intervalli (file temporaneo + rinomina atomica).
+    Usato dopo le importazioni massive, che toccherebbero troppi slot per essere accodate.
+    """
+    path = entry_path(hass, INTERVALS_FILE, entry_id)
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        buf = array('d', bytes(16 * len(slots)))
+        buf[0::2] = slots
+        buf[1::2] = values
+        if sys.byteorder == "big":
+            buf.byteswap()
+        with open(tmp_path, 'wb') as f:
+            f.write(INTERVALS_HEADER.pack(INTERVALS_MAGIC, INTERVALS_VERSION, slot_minutes))
+            f.write(buf.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        _LOGGER.error(f"Errore critico durante la riscrittura degli intervalli Octopus: {e}")
+        return False
+
+def merge_interval_arrays(slots, values, new_slots, new_values, slot_seconds, overwrite=False):
+    """
+    Fonde in un'unica passata lineare due coppie di array ordinati (slot, kWh).
+    Senza 'overwrite' gli slot già presenti mantengono il valore esistente.
+    Restituisce (slot, kWh, giorni locali modificati ordinati). Pensata per il thread di I/O.
+    """
+    merged_slots = array('d')
+    merged_values = array('d')
+    changed = set()
+    i = j = 0
+    while i < len(slots) or j < len(new_slots):
+        if j >= len(new_slots) or (i < len(slots) and slots[i] < new_slots[j]):
+            merged_slots.append(slots[i])
+            merged_values.append(values[i])
+            i += 1
+            continue
+        slot = new_slots[j]
+        if i < len(slots) and slots[i] == slot:
+            value = new_values[j] if overwrite else values[i]
+            if value != values[i]:
+                changed.add(slot)
+            i += 1
+        else:
+            value = new_values[j]
+            changed.add(slot)
+        merged_slots.append(slot)
+        merged_values.append(value)
+        j += 1
+
+    days = sorted({
+        dt_util.as_local(datetime.fromtimestamp(int(slot) * slot_seconds, tz=dt_util.UTC)).date()
+        for slot in changed
+    })
+    return merged_slots, merged_values, days
+
+class IntervalHistory(DelayedSaveStore):
+    """
+    Letture a intervalli (30 o 60 minuti) in rappresentazione compatta: due array tipizzati paralleli
+    (indice dello slot dall'epoca Unix, kWh dello slot) ordinati per slot.
+    Una decina d'anni di dati semiorari (~175k punti) occupa circa 2.8 MB in RAM e si carica in un'unica lettura.
+    Le nuove letture vengono accodate al file binario con salvataggio differito.
+    """
+
+    METRICS_NAME = "intervals"
+
+    def __init__(self, hass, entry_id, slot_minutes, save_delay=SAVE_DELAY, io=None, metrics=None):
+        super().__init__(hass, save_delay, io, metrics)
+        self.entry_id = entry_id
+        self.slot_minutes = slot_minutes
+        self.slot_seconds = slot_minutes * 60
+        self.slots = array('d')
+        self.values = array('d')
+        self._pending = []
+        # True se il prossimo salvataggio deve riscrivere l'intero file (dopo un'importazione)
+        self._full_write = False
+
+    async def async_load(self):
+        """Carica gli intervalli in memoria e si registra per lo scarico finale allo spegnimento."""
+        with self.metrics.timer("intervals_load_ms"):
+            self.slots, self.values = await async_run_io(
+                self.hass, self._io, load_intervals_sync, self.hass, self.slot_minutes, self.entry_id
+            )
+        await self._async_observe_bytes_read("intervals_bytes_read")
+        self._async_listen_final_write()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _metric_paths(self):
+        return [entry_path(self.hass, INTERVALS_FILE, self.entry_id)]
+
+    def slot_for(self, start):
+        """Indice dello slot che inizia al datetime (aware) 'start'."""
+        return float(int(start.timestamp()) // self.slot_seconds)
+
+    def slot_start(self, slot):
+        """Datetime UTC di inizio dello slot."""
+        return datetime.fromtimestamp(int(slot) * self.slot_seconds, tz=dt_util.UTC)
+
+    def first_date(self):
+        """Data locale del primo intervallo memorizzato (None se vuoto)."""
+        if not self.slots:
+            return None
+        return dt_util.as_local(self.slot_start(self.slots[0])).date()
+
+    def bounds(self, start, end):
+        """Posizioni [i, j) degli slot compresi tra i datetime aware start (incluso) ed end (escluso)."""
+        i = bisect_left(self.slots, self.slot_for(start))
+        j = bisect_left(self.slots, self.slot_for(end))
+        return i, j
+
+    def has_slot(self, slot):
+        """True se lo slot indicato è già stato ricevuto."""
+        pos = bisect_left(self.slots, float(slot))
+        return pos < len(self.slots) and self.slots[pos] == float(slot)
+
+    def slot_value(self, slot):
+        """kWh registrati nello slot indicato (None se non è ancora stato ricevuto)."""
+        pos = bisect_left(self.slots, float(slot))
+        if pos < len(self.slots) and self.slots[pos] == float(slot):
+            return self.values[pos]
+        return None
+
+    def has_day(self, day):
+        """True se il giorno locale 'day' ha almeno un intervallo."""
+        i, j = self.bounds(dt_util.start_of_local_day(day), dt_util.start_of_local_day(day + timedelta(days=1)))
+        return j > i
+
+    def incomplete_days(self, start, end):
+        """Giorni locali tra start ed end (inclusi) con meno intervalli di quelli attesi (giorni con buchi)."""
+        expected = 24 * 60 // self.slot_minutes
+        days = []
+        day = start
+        while day <= end:
+            i, j = self.bounds(dt_util.start_of_local_day(day), dt_util.start_of_local_day(day + timedelta(days=1)))
+            if j - i < expected:
+                days.append(day)
+            day += timedelta(days=1)
+        return days
+
+    def day_total(self, day):
+        """kWh totali degli intervalli del giorno locale 'day' (ricerca binaria + somma di al più 48 slot)."""
+        start = dt_util.start_of_local_day(day)
+        end = dt_util.start_of_local_day(day + timedelta(days=1))
+        i, j = self.bounds(start, end)
+        return sum(self.values[i:j])
+
+    @callback
+    def async_set(self, slot, kwh):
+        """
+        Inserisce o aggiorna il valore di uno slot. Restituisce False se il valore era già identico
+        (gli eventi doppi del sensore data e del sensore valore non producono scritture).
+        """
+        slot = float(slot)
+        kwh = float(kwh)
+        if not self.slots or slot > self.slots[-1]:
+            self.slots.append(slot)
+            self.values.append(kwh)
+        else:
+            pos = bisect_left(self.slots, slot)
+            if pos < len(self.slots) and self.slots[pos] == slot:
+                if self.values[pos] == kwh:
+                    return False
+                self.values[pos] = kwh
+            else:
+                self.slots.insert(pos, slot)
+                self.values.insert(pos, kwh)
+        self._pending.append((slot, kwh))
+        self.async_delay_save()
+        return True
+
+    @callback
+    def async_drop_before(self, day):
+        """
+        Elimina gli intervalli precedenti al giorno locale 'day' (i totali giornalieri restano nello storico).
+        Restituisce il numero di intervalli eliminati.
+        """
+        i = bisect_left(self.slots, self.slot_for(dt_util.start_of_local_day(day)))
+        if not i:
+            return 0
+        del self.slots[:i]
+        del self.values[:i]
+        self._pending = []
+        self._full_write = True
+        self.async_delay_save()
+        return i
+
+    async def async_merge(self, new_slots, new_values, overwrite=False):
+        """
+        Unisce agli intervalli in memoria gli array ordinati (slot, kWh) di un'importazione.
+        La fusione avviene sul thread di I/O su una copia degli array; il risultato sostituisce quelli
+        in memoria e il prossimo salvataggio riscrive l'intero file.
+        Il chiamante deve impedire modifiche concorrenti (lock degli aggiornamenti del coordinatore).
+        Restituisce i giorni locali modificati, in ordine.
+        """
+        slots, values, days = await async_run_io(
+            self.hass, self._io, merge_interval_arrays,
+            array('d', self.slots), array('d', self.values), new_slots, new_values, self.slot_seconds, overwrite,
+        )
+        if days:
+            self.slots, self.values = slots, values
+            self._pending = []
+            self._full_write = True
+            self.async_delay_save()
+        return days
+
+    async def _async_write(self):
+        if self._full_write:
+            self._full_write = False
+            self._pending = []
+            ok = await async_run_io(
+                self.hass, self._io, save_intervals_sync, self.hass, self.slot_minutes,
+                array('d', self.slots), array('d', self.values), self.entry_id,
+            )
+            self._full_write = not ok
+            return ok
+        pending, self._pending = self._pending, []
+        if not pending:
+            return True
+        ok = await async_run_io(self.hass, self._io, append_intervals_sync, self.hass, self.slot_minutes, pending, self.entry_id)
+        if not ok:
+            self._pending = pending + self._pending
+        return ok
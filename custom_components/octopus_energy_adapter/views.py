@@ -0,0 +1,71 @@
+"""
+Questo modulo registra la vista HTTP per l'esportazione dello storico:
+GET /api/octopus_energy_adapter/export/<entry_id>?format=csv|ndjson&level=daily|interval&start=AAAA-MM-GG&end=AAAA-MM-GG
+La risposta viene trasmessa a blocchi man mano che le righe sono prodotte (vedi export.py).
+Richiede l'autenticazione di Home Assistant (token o sessione) con un utente amministratore.
+"""
+
+from http import HTTPStatus
+
+from aiohttp import web
+
+from homeassistant.components.http import HomeAssistantView
+from homeassistant.exceptions import Unauthorized
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN
+from .export import (
+    CONTENT_TYPES,
+    EXPORT_FORMAT_CSV,
+    EXPORT_FORMATS,
+    EXPORT_LEVEL_DAILY,
+    EXPORT_LEVEL_INTERVAL,
+    EXPORT_LEVELS,
+    async_iter_export,
+    export_filename,
+)
+
+class OctopusExportView(HomeAssistantView):
+    """Esportazione in streaming dello storico di una entry."""
+
+    url = f"/api/{DOMAIN}/export/{{entry_id}}"
+    name = f"api:{DOMAIN}:export"
+    requires_auth = True
+
+    async def get(self, request, entry_id):
+        hass = request.app["hass"]
+        if not request["hass_user"].is_admin:
+            raise Unauthorized()
+
+        coordinator = hass.data.get(DOMAIN, {}).get(entry_id)
+        if coordinator is None:
+            return self.json_message(f"Entry {entry_id} non trovata", HTTPStatus.NOT_FOUND)
+
+        query = request.query
+        export_format = query.get("format", EXPORT_FORMAT_CSV)
+        level = query.get("level", EXPORT_LEVEL_DAILY)
+        if export_format not in EXPORT_FORMATS:
+            return self.json_message(f"Formato non valido: {export_format}", HTTPStatus.BAD_REQUEST)
+        if level not in EXPORT_LEVELS:
+            return self.json_message(f"Livello non valido: {level}", HTTPStatus.BAD_REQUEST)
+        if level == EXPORT_LEVEL_INTERVAL and coordinator.intervals is None:
+            return self.json_message("La entry non registra letture a intervalli", HTTPStatus.BAD_REQUEST)
+
+        dates = {}
+        for key in ("start", "end"):
+            value = query.get(key)
+            dates[key] = dt_util.parse_date(value) if value else None
+            if value and dates[key] is None:
+                return self.json_message(f"Data non valida per '{key}': {value}", HTTPStatus.BAD_REQUEST)
+
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": f"{CONTENT_TYPES[export_format]}; charset=utf-8",
+                "Content-Disposition": f'attachment; filename="{export_filename(export_format, level, dates["start"], dates["end"])}"',
+            }
+        )
+        await response.prepare(request)
+        async for text in async_iter_export(coordinator, export_format, level, dates["start"], dates["end"]):
+            await response.write(text.encode("utf-8"))
+        await response.write_eof()
+        return response
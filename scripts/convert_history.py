@@ -0,0 +1,32 @@
+"""
+Conversione manuale dello storico Octopus tra il formato JSON e il formato binario,
+per ispezionare o migrare uno storico. Usa le stesse funzioni dell'integrazione (storage.py),
+quindi richiede un ambiente con Home Assistant installato (es. il container di HA).
+
+Esempi (da una copia del repository):
+    python scripts/convert_history.py to-json /config/octopus_data/<entry_id>/octopus_energy.bin storico.json
+    python scripts/convert_history.py to-binary storico.json /config/octopus_data/<entry_id>/octopus_energy.bin
+"""
+
+import argparse
+import os
+import sys
+
+# Lo script importa l'integrazione direttamente dal repository (custom_components/...).
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from custom_components.octopus_energy_adapter.storage import binary_to_json_sync, json_to_binary_sync
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Conversione dello storico Octopus tra JSON e formato binario")
+    parser.add_argument("direction", choices=["to-json", "to-binary"])
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    args = parser.parse_args(argv)
+    convert = binary_to_json_sync if args.direction == "to-json" else json_to_binary_sync
+    print(f"{convert(args.source, args.destination)} letture convertite in {args.destination}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Configurazione comune dei test: l'integrazione e i sostituti dei benchmark (benchmarks/fakes.py)
+vengono importati direttamente dal repository, senza installazione.
+Le dimensioni del test di carico si possono cambiare da riga di comando, es.:
+    python -m pytest --harness-entries 10 --harness-rounds 3
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.join(REPO_ROOT, "benchmarks")
+for path in (REPO_ROOT, BENCHMARKS_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+def pytest_addoption(parser):
+    group = parser.getgroup("octopus", "Test di carico Octopus Energy Adapter")
+    group.addoption("--harness-entries", type=int, default=3, help="Entry (contatori) del test di carico")
+    group.addoption("--harness-rounds", type=int, default=1, help="Giri di pubblicazione del test di carico")
+    group.addoption(
+        "--harness-budget-ms", type=float, default=None,
+        help="Budget del 95° percentile della latenza (default: quello dell'harness)",
+    )
+
+@pytest.fixture
+def harness_entries(request):
+    return request.config.getoption("--harness-entries")
+
+@pytest.fixture
+def harness_rounds(request):
+    return request.config.getoption("--harness-rounds")
+
+@pytest.fixture
+def harness_budget_ms(request):
+    return request.config.getoption("--harness-budget-ms")
+
+@pytest.fixture
+def hass(tmp_path):
+    """Sostituto di 'hass' con la cartella di configurazione nella cartella temporanea del test."""
+    from fakes import FakeHass
+
+    return FakeHass(str(tmp_path))
+
+@pytest.fixture
+def run_hass(tmp_path):
+    """
+    Esegue la coroutine 'test(hass)' in un'istanza reale di Home Assistant (nessuna integrazione caricata,
+    cartella di configurazione temporanea) e la arresta alla fine. Restituisce il risultato della coroutine.
+    """
+    from homeassistant.core import HomeAssistant
+
+    def run(test):
+        async def main():
+            hass = HomeAssistant(str(tmp_path))
+            try:
+                return await test(hass)
+            finally:
+                await hass.async_stop(force=True)
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,109 @@
+"""
+Test degli accumulatori dei sensori di media e previsione: aggiornamento giorno per giorno (anche dello stesso giorno
+e dal solo indice parziale del riepilogo) confrontato con la ricostruzione esatta dallo storico completo.
+"""
+
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from custom_components.octopus_energy_adapter.aggregates import AVERAGE_WINDOWS, RollingAggregates
+from custom_components.octopus_energy_adapter.const import STORAGE_FORMAT_JOURNAL
+from custom_components.octopus_energy_adapter.index import HistoryIndex
+from custom_components.octopus_energy_adapter.prices import PriceHistory
+from custom_components.octopus_energy_adapter.storage import build_summary, history_checksum, summary_index
+
+START = date(2022, 11, 20)
+
+def _readings(days, seed=25):
+    """Consumi giornalieri con giorni mancanti, come (data, kWh), attraverso il febbraio bisestile del 2024."""
+    rng = random.Random(seed)
+    return [
+        (START + timedelta(days=i), round(rng.uniform(0, 14), 3))
+        for i in range(days)
+        if rng.random() > 0.12
+    ]
+
+def _prices(hass):
+    prices = PriceHistory(hass)
+    prices._set_points([["2022-12-01", 0.3], ["2023-04-01", 0.21], ["2024-02-15", 0.24], ["2024-03-01", 0.19]])
+    return prices
+
+def _rebuilt(index, prices):
+    aggregates = RollingAggregates()
+    aggregates.rebuild(index, prices)
+    return aggregates
+
+def _assert_same(aggregates, expected):
+    assert aggregates.last == expected.last
+    assert aggregates.month == expected.month
+    for window in AVERAGE_WINDOWS:
+        # Le somme mobili differiscono solo per l'errore di arrotondamento accumulato.
+        assert [o for o, _ in aggregates._days[window]] == [o for o, _ in expected._days[window]]
+        assert aggregates._sums[window] == pytest.approx(expected._sums[window])
+    assert aggregates.month_kwh == pytest.approx(expected.month_kwh)
+    assert aggregates.month_cost == pytest.approx(expected.month_cost)
+    assert aggregates.last_year_known == expected.last_year_known
+    assert aggregates.last_year_kwh == pytest.approx(expected.last_year_kwh)
+
+def _record(index, day, kwh):
+    """Registra il consumo di 'day' come nuovo cumulativo (o correzione dell'ultimo giorno)."""
+    previous = index.value_at(day - timedelta(days=1))
+    index.set(day.isoformat(), round(previous + kwh, 3))
+
+def test_add_matches_rebuild(hass):
+    prices = _prices(hass)
+    index = HistoryIndex.from_data({})
+    aggregates = RollingAggregates()
+    rng = random.Random(1)
+    for day, kwh in _readings(520):
+        _record(index, day, kwh)
+        assert aggregates.add(day, index.day_value(day), index, prices)
+        if rng.random() < 0.2:
+            # Aggiornamento dell'ultimo giorno (es. letture a intervalli): solo la differenza.
+            _record(index, day, kwh + rng.uniform(0, 3))
+            assert aggregates.add(day, index.day_value(day), index, prices)
+        _assert_same(aggregates, _rebuilt(index, prices))
+    assert aggregates.last_year_known
+
+    # Un giorno precedente all'ultimo non può essere accumulato: va ricostruito.
+    assert not aggregates.add(date.fromordinal(aggregates.last - 1), 1.0, index, prices)
+
+def test_state_round_trip(hass):
+    prices = _prices(hass)
+    index = HistoryIndex.from_data({})
+    for day, kwh in _readings(400):
+        _record(index, day, kwh)
+    aggregates = _rebuilt(index, prices)
+    restored = RollingAggregates()
+    restored.load(aggregates.to_dict())
+    _assert_same(restored, aggregates)
+
+    empty = RollingAggregates()
+    empty.load(RollingAggregates().to_dict())
+    assert empty.last is None and empty.average(7) is None
+    assert empty.forecast(date(2024, 1, 10), 0.2) == (None, None)
+
+def test_add_from_summary_index(hass):
+    prices = _prices(hass)
+    readings = _readings(900)
+    history, new_days = readings[:-40], readings[-40:]
+    full = HistoryIndex.from_data({})
+    for day, kwh in history:
+        _record(full, day, kwh)
+    aggregates = _rebuilt(full, prices)
+    data = {date.fromordinal(o).isoformat(): v for o, v in full.records_since(date.min)}
+    summary = build_summary(full, history_checksum(data), STORAGE_FORMAT_JOURNAL)
+
+    # Dopo un riavvio: stato salvato e indice parziale del riepilogo, senza caricare lo storico.
+    partial = summary_index(summary)
+    assert len(partial) < len(full)
+    restored = RollingAggregates()
+    restored.load(aggregates.to_dict())
+    for day, kwh in new_days:
+        _record(full, day, kwh)
+        _record(partial, day, kwh)
+        assert partial.day_value(day) == full.day_value(day)
+        assert restored.add(day, partial.day_value(day), partial, prices)
+        _assert_same(restored, _rebuilt(full, prices))
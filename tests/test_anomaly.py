@@ -0,0 +1,76 @@
+"""Test del filtro delle letture anomale: lista a salti indicizzabile, mediana e MAD contro il calcolo diretto."""
+
+import random
+from statistics import median
+
+import pytest
+
+from custom_components.octopus_energy_adapter.anomaly import IndexableSkipList, OutlierFilter
+from custom_components.octopus_energy_adapter.const import MAX_READING_KWH
+
+def test_skip_list_matches_sorted_list():
+    rng = random.Random(4)
+    skip, expected = IndexableSkipList(50), []
+    for _ in range(2000):
+        if expected and rng.random() < 0.45:
+            value = rng.choice(expected)
+            skip.remove(value)
+            expected.remove(value)
+        else:
+            # Valori ripetuti di proposito: la lista deve gestire i duplicati.
+            value = float(rng.randint(0, 40))
+            skip.insert(value)
+            expected.append(value)
+            expected.sort()
+        assert len(skip) == len(expected)
+    assert list(skip) == expected
+    for i in range(len(expected)):
+        assert skip[i] == expected[i]
+    for value in (-1.0, 0.0, 12.0, 12.5, 41.0):
+        assert skip.bisect_left(value) == sum(1 for x in expected if x < value)
+
+def test_skip_list_errors():
+    skip = IndexableSkipList()
+    skip.insert(1.0)
+    with pytest.raises(KeyError):
+        skip.remove(2.0)
+    with pytest.raises(IndexError):
+        skip[1]
+
+def test_median_and_mad_match_brute_force():
+    rng = random.Random(5)
+    window = 31
+    outliers = OutlierFilter(window, sensitivity=3)
+    values = []
+    for _ in range(300):
+        value = round(rng.lognormvariate(2, 0.6), 3)
+        outliers.add(value)
+        values = (values + [value])[-window:]
+        m = median(values)
+        assert outliers.median() == pytest.approx(m)
+        assert outliers.mad() == pytest.approx(median(abs(x - m) for x in values))
+        assert len(outliers) == len(values)
+
+def test_threshold_needs_min_samples():
+    outliers = OutlierFilter(30, sensitivity=3, min_samples=5)
+    outliers.seed([10.0] * 4)
+    assert outliers.threshold() == MAX_READING_KWH
+    outliers.add(10.0)
+    assert outliers.threshold() < MAX_READING_KWH
+    assert OutlierFilter(30, sensitivity=0).threshold() == MAX_READING_KWH
+
+def test_state_round_trip():
+    outliers = OutlierFilter(10, sensitivity=3)
+    outliers.seed(float(i) for i in range(25))
+    assert outliers.quarantine_add("2024-05-01", 300.0, 42.0)
+    assert not outliers.quarantine_add("2024-05-01", 300.0, 42.0)
+    assert outliers.quarantine_add("2024-05-02", 250.0, 42.0)
+    assert outliers.quarantine_pop("2024-05-02", reject=True)["kwh"] == 250.0
+    assert outliers.is_rejected("2024-05-02", 250.0)
+
+    restored = OutlierFilter(10, sensitivity=3)
+    restored.load(outliers.to_dict())
+    assert restored.to_dict() == outliers.to_dict()
+    assert list(restored._sorted) == [float(i) for i in range(15, 25)]
+    assert restored.median() == outliers.median()
+    assert restored.mad() == outliers.mad()
@@ -0,0 +1,108 @@
+"""
+Test delle correzioni dello storico (OctopusHistory.async_set_daily) nei tre formati: giorni nuovi,
+inserimenti retroattivi e correzioni confrontati con la riscrittura diretta dei cumulativi,
+spostamenti riportati una volta sola al salvataggio e riepilogo coerente dopo il riavvio.
+"""
+
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from custom_components.octopus_energy_adapter.const import (
+    STORAGE_FORMAT_BINARY,
+    STORAGE_FORMAT_JOURNAL,
+    STORAGE_FORMAT_JSON,
+)
+from custom_components.octopus_energy_adapter.storage import (
+    OctopusHistory,
+    history_checksum,
+    load_history_sync,
+    save_binary_sync,
+    save_data_sync,
+)
+
+ENTRY_ID = "test_entry"
+START = date(2023, 1, 1)
+
+def _history(rng):
+    data, total = {}, 0.0
+    for i in range(400):
+        total = round(total + rng.uniform(1, 9), 3)
+        if i % 17 != 5:
+            data[(START + timedelta(days=i)).isoformat()] = total
+    return data
+
+def _set_daily(data, date_str, kwh):
+    """Riscrittura diretta: cumulativo del giorno dal giorno precedente e tutti i successivi spostati."""
+    before = [d for d in data if d < date_str]
+    opening = data[max(before)] if before else 0.0
+    new_value = round(opening + kwh, 3)
+    delta = new_value - data.get(date_str, opening)
+    data[date_str] = new_value
+    for d in data:
+        if d > date_str:
+            data[d] = round(data[d] + delta, 3)
+
+def _disk(hass, storage_format):
+    data, index, _, mapped, _ = load_history_sync(hass, storage_format, ENTRY_ID)
+    if mapped is not None:
+        data = dict(mapped.items())
+        mapped.close()
+    return data
+
+@pytest.mark.parametrize("storage_format", [STORAGE_FORMAT_JSON, STORAGE_FORMAT_JOURNAL, STORAGE_FORMAT_BINARY])
+def test_set_daily_matches_rewritten_history(run_hass, storage_format):
+    rng = random.Random(15)
+    data = _history(rng)
+    expected = dict(data)
+
+    async def test(hass):
+        if storage_format == STORAGE_FORMAT_BINARY:
+            save_binary_sync(hass, data, ENTRY_ID)
+        else:
+            save_data_sync(hass, data, ENTRY_ID)
+        history = OctopusHistory(hass, ENTRY_ID, storage_format, save_delay=1000)
+        await history.async_load()
+        await history.async_ensure_loaded()
+
+        # Correzioni di giorni presenti e giorni nuovi: le letture successive non vengono riscritte subito,
+        # solo quelle toccate sono da scrivere.
+        last = START + timedelta(days=399)
+        days = list(expected) + [(last + timedelta(days=i)).isoformat() for i in (1, 2, 3, 4, 6, 9)]
+        for _ in range(30):
+            date_str = rng.choice(days)
+            kwh = round(rng.uniform(0, 12), 3)
+            history.async_set_daily(date_str, kwh)
+            _set_daily(expected, date_str, kwh)
+        assert len(history._pending) <= 30
+
+        # Inserimenti retroattivi nei giorni mancanti.
+        missing = [d.isoformat() for d in (START + timedelta(days=i) for i in range(400))]
+        for date_str in rng.sample([d for d in missing if d not in expected], 5):
+            kwh = round(rng.uniform(0, 12), 3)
+            assert history.async_set_daily(date_str, kwh)
+            _set_daily(expected, date_str, kwh)
+
+        for date_str, value in expected.items():
+            assert history.value_of(date_str) == pytest.approx(value, abs=1e-6)
+        # Stesso consumo di un giorno già spostato più volte: nessuna modifica da registrare.
+        for date_str in sorted(expected)[-20:]:
+            previous = (date.fromisoformat(date_str) - timedelta(days=1)).isoformat()
+            if previous in expected:
+                assert not history.async_set_daily(date_str, round(expected[date_str] - expected[previous], 3))
+
+        await history.async_flush()
+        assert history.data == expected
+        assert history.checksum == history_checksum(expected)
+        assert _disk(hass, storage_format) == expected
+        await history.async_close()
+
+        reloaded = OctopusHistory(hass, ENTRY_ID, storage_format)
+        await reloaded.async_load()
+        assert not reloaded.stale
+        assert reloaded.checksum == history_checksum(expected)
+        assert reloaded.last_date == max(expected)
+        await reloaded.async_close()
+
+    run_hass(test)
@@ -0,0 +1,82 @@
+"""Test della lettura dei file di importazione (CSV e JSON-lines), giornalieri e a intervalli."""
+
+import json
+from datetime import datetime, timezone
+
+from custom_components.octopus_energy_adapter.importer import read_import_file_sync
+
+def _slot(moment, slot_minutes):
+    return float(int(moment.timestamp()) // (slot_minutes * 60))
+
+def test_daily_csv_with_italian_format(tmp_path):
+    path = tmp_path / "consumi.csv"
+    path.write_text(
+        "Data;Consumo\n"
+        "01/03/2024;12,5\n"
+        "2024-03-02;8\n"
+        "03/03/2024;-1\n"
+        "04/03/2024;abc\n",
+        encoding="utf-8",
+    )
+    result = read_import_file_sync(str(path))
+    assert result["daily"] == {"2024-03-01": 12.5, "2024-03-02": 8.0}
+    assert (result["rows"], result["rejected"]) == (4, 2)
+    assert not result["slots"]
+
+def test_intervals_summed_per_day_in_daily_mode(tmp_path):
+    path = tmp_path / "consumi.jsonl"
+    lines = [
+        {"start": "2024-03-01T00:00:00+00:00", "kwh": 0.5},
+        {"start": "2024-03-01T12:00:00+00:00", "kwh": 0.25},
+        {"start": "2024-03-02T00:00:00+00:00", "kwh": 1},
+    ]
+    path.write_text("\n".join(json.dumps(line) for line in lines) + "\nnon json\n", encoding="utf-8")
+    result = read_import_file_sync(str(path))
+    assert sum(result["daily"].values()) == 1.75
+    assert result["rejected"] == 1
+
+def test_finer_intervals_merged_into_slot(tmp_path):
+    path = tmp_path / "semiorario.csv"
+    path.write_text(
+        "start,kwh\n"
+        "2024-03-01T00:30:00+00:00,0.2\n"
+        "2024-03-01T00:00:00+00:00,0.1\n"
+        "2024-03-01T01:00:00+00:00,0.3\n"
+        "2024-03-01T01:30:00+00:00,0.4\n"
+        # Riga ripetuta: vale l'ultima, non viene sommata.
+        "2024-03-01T01:30:00+00:00,0.5\n",
+        encoding="utf-8",
+    )
+    result = read_import_file_sync(str(path), slot_minutes=60)
+    first = datetime(2024, 3, 1, 0, tzinfo=timezone.utc)
+    second = datetime(2024, 3, 1, 1, tzinfo=timezone.utc)
+    assert list(result["slots"]) == [_slot(first, 60), _slot(second, 60)]
+    assert list(result["values"]) == [0.3, 0.8]
+    assert result["merged"] == 2
+    assert result["rejected"] == 0
+
+def test_end_only_intervals(tmp_path):
+    path = tmp_path / "fine.csv"
+    path.write_text(
+        "end,kwh\n"
+        "2024-03-01T00:15:00+00:00,0.1\n"
+        "2024-03-01T00:30:00+00:00,0.2\n"
+        "2024-03-01T00:45:00+00:00,0.3\n",
+        encoding="utf-8",
+    )
+    result = read_import_file_sync(str(path), slot_minutes=15)
+    start = datetime(2024, 3, 1, 0, tzinfo=timezone.utc)
+    assert list(result["slots"]) == [_slot(start, 15) + i for i in range(3)]
+    assert list(result["values"]) == [0.1, 0.2, 0.3]
+
+def test_coarser_intervals_rejected(tmp_path):
+    path = tmp_path / "orario.csv"
+    path.write_text(
+        "start,kwh\n"
+        "2024-03-01T00:00:00+00:00,1.0\n"
+        "2024-03-01T01:00:00+00:00,1.0\n",
+        encoding="utf-8",
+    )
+    result = read_import_file_sync(str(path), slot_minutes=30)
+    assert not result["slots"]
+    assert result["rejected"] == 2
@@ -0,0 +1,117 @@
+"""Test dell'indice dello storico (HistoryIndex) e dell'albero di Fenwick, confrontati con un calcolo diretto."""
+
+import random
+from datetime import date, timedelta
+
+from custom_components.octopus_energy_adapter.index import FenwickTree, HistoryIndex
+
+START = date(2024, 1, 1)
+
+def _history(days, seed=1):
+    """Storico {data: cumulativo} di 'days' giorni consecutivi, con qualche giorno mancante."""
+    rng = random.Random(seed)
+    data, total = {}, 0.0
+    for i in range(days):
+        total += round(rng.uniform(0, 20), 3)
+        if rng.random() > 0.1:
+            data[(START + timedelta(days=i)).isoformat()] = round(total, 3)
+    return data
+
+def _value_at(data, day):
+    """Cumulativo dell'ultima lettura con data <= day, calcolato scorrendo tutto il dizionario."""
+    dates = [d for d in data if d <= day.isoformat()]
+    return data[max(dates)] if dates else 0.0
+
+def test_fenwick_matches_brute_force():
+    rng = random.Random(2)
+    tree, expected = FenwickTree(5), [0.0] * 5
+    for _ in range(300):
+        if rng.random() < 0.2:
+            tree.append()
+            expected.append(expected[-1] if expected else 0.0)
+        pos, delta = rng.randrange(len(expected)), rng.uniform(-5, 5)
+        tree.add_from(pos, delta)
+        for i in range(pos, len(expected)):
+            expected[i] += delta
+        assert len(tree) == len(expected)
+        for i in range(len(expected)):
+            assert abs(tree.point(i) - expected[i]) < 1e-9
+
+def test_value_at_and_totals():
+    data = _history(120)
+    index = HistoryIndex.from_data(data)
+    assert len(index) == len(data)
+    for i in range(-2, 125):
+        day = START + timedelta(days=i)
+        assert index.value_at(day) == _value_at(data, day)
+        assert index.value_at(day.toordinal()) == _value_at(data, day)
+    start, end = START + timedelta(days=10), START + timedelta(days=40)
+    expected = _value_at(data, end) - _value_at(data, start - timedelta(days=1))
+    assert index.total_between(start, end) == round(expected, 3)
+    assert index.total_between(end, start) == 0.0
+
+def test_shift_after_matches_rewritten_history():
+    rng = random.Random(3)
+    data = _history(90)
+    index = HistoryIndex.from_data(data)
+    dates = sorted(data)
+    for _ in range(40):
+        # Correzione retroattiva: il consumo di un giorno cambia e tutti i cumulativi successivi si spostano.
+        day, delta = rng.choice(dates), round(rng.uniform(-3, 3), 3)
+        data[day] += delta
+        for later in dates:
+            if later > day:
+                data[later] += delta
+        index.set(day, data[day])
+        index.shift_after(date.fromisoformat(day), delta)
+        # Una lettura nuova in coda eredita gli spostamenti già registrati.
+        if rng.random() < 0.3:
+            new_day = (date.fromisoformat(dates[-1]) + timedelta(days=1)).isoformat()
+            data[new_day] = data[dates[-1]] + 5
+            dates.append(new_day)
+            index.set(new_day, data[new_day])
+        for d in dates:
+            assert abs(index.value_at(date.fromisoformat(d)) - data[d]) < 1e-6
+    assert index.last()[0] == dates[-1]
+    assert abs(index.last_value() - data[dates[-1]]) < 1e-6
+
+def test_insert_in_the_middle_folds_offsets():
+    data = {"2024-01-01": 10.0, "2024-01-03": 30.0, "2024-01-04": 40.0}
+    index = HistoryIndex.from_data(data)
+    index.shift_after(date(2024, 1, 1), 1.0)
+    index.set("2024-01-02", 21.0)
+    assert index.records_after(date(2024, 1, 1)) == [
+        (date(2024, 1, 2).toordinal(), 21.0),
+        (date(2024, 1, 3).toordinal(), 31.0),
+        (date(2024, 1, 4).toordinal(), 41.0),
+    ]
+    assert index.day_value(date(2024, 1, 3)) == 10.0
+    assert index.day_value(date(2024, 1, 5)) is None
+
+def test_replace_from_and_drop_before():
+    data = _history(30)
+    index = HistoryIndex.from_data(data)
+    cut = START + timedelta(days=20)
+    records = [((cut + timedelta(days=i)).toordinal(), 1000.0 + i) for i in range(5)]
+    index.replace_from(cut, records)
+    assert index.records_after(cut - timedelta(days=1)) == records
+    assert index.value_at(cut - timedelta(days=1)) == _value_at(data, cut - timedelta(days=1))
+
+    keep = {START.toordinal()} if START.isoformat() in data else set()
+    before = index.records_between(START.toordinal(), (START + timedelta(days=9)).toordinal())
+    removed = index.drop_before(START + timedelta(days=10), keep=keep)
+    assert sorted(removed) == sorted(o for o, _ in before if o not in keep)
+    # I cumulativi delle letture conservate non cambiano.
+    assert index.value_at(cut) == 1000.0
+    remaining = index.records_between(START.toordinal(), (START + timedelta(days=9)).toordinal())
+    assert [o for o, _ in remaining] == sorted(keep)
+
+def test_from_columns_is_read_only_until_modified():
+    ordinals = (START.toordinal(), START.toordinal() + 1)
+    index = HistoryIndex.from_columns(ordinals, (1.0, 3.0))
+    assert index.value_at(START + timedelta(days=5)) == 3.0
+    index.set((START + timedelta(days=2)).isoformat(), 4.0)
+    assert ordinals == (START.toordinal(), START.toordinal() + 1)
+    assert list(index.daily_since(START)) == [
+        (START.toordinal(), 1.0), (START.toordinal() + 1, 2.0), (START.toordinal() + 2, 1.0),
+    ]
@@ -0,0 +1,37 @@
+"""
+Test di carico: esegue benchmarks/load_harness.py con poche entry e verifica il budget di latenza,
+l'assenza di timeout e il numero di file scritti per evento sorgente.
+"""
+
+import json
+import subprocess
+import sys
+
+from conftest import BENCHMARKS_DIR, REPO_ROOT
+
+# Salvataggi differiti per entry e per giro: riepilogo dello storico, journal e prezzi.
+STORES_PER_ENTRY = 3
+
+def test_load_harness_within_budget(tmp_path, harness_entries, harness_rounds, harness_budget_ms):
+    output = tmp_path / "report.json"
+    command = [
+        sys.executable, f"{BENCHMARKS_DIR}/load_harness.py",
+        "--entries", str(harness_entries),
+        "--rounds", str(harness_rounds),
+        "--history-days", "60",
+        "--output", str(output),
+    ]
+    if harness_budget_ms is not None:
+        command += ["--budget-ms", str(harness_budget_ms)]
+
+    result = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, timeout=300)
+    assert output.exists(), result.stderr
+    report = json.loads(output.read_text(encoding="utf-8"))
+
+    assert report["entries"] == harness_entries
+    assert report["timeouts"] == 0
+    assert report["reading_latency"]["p95_ms"] <= report["budget_ms"]
+    assert report["passed"]
+    assert result.returncode == 0, result.stderr
+    # Al più uno scarico per store, per entry e per giro: nessuna scrittura per singolo evento.
+    assert report["file_writes"] <= STORES_PER_ENTRY * harness_entries * harness_rounds
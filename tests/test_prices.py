@@ -0,0 +1,77 @@
+"""Test dello storico prezzi: costo cumulativo dalle somme prefisse, confronto con un elenco salvato e cambi nello stesso giorno."""
+
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from custom_components.octopus_energy_adapter.index import HistoryIndex
+from custom_components.octopus_energy_adapter.prices import PriceHistory
+
+START = date(2024, 1, 1)
+
+def _history(days, seed=7):
+    rng = random.Random(seed)
+    data, total = {}, 0.0
+    for i in range(days):
+        total = round(total + rng.uniform(0, 12), 3)
+        if rng.random() > 0.15:
+            data[(START + timedelta(days=i)).isoformat()] = total
+    return data
+
+def _prices(hass, points, overrides=None):
+    prices = PriceHistory(hass)
+    prices._set_points(points)
+    prices.set_overrides(overrides or {})
+    return prices
+
+def _cost_brute_force(data, prices, ordinal):
+    """Somma giorno per giorno di kWh × prezzo in vigore, fino al giorno 'ordinal' incluso."""
+    cost, previous = 0.0, 0.0
+    for date_str in sorted(data):
+        day = date.fromisoformat(date_str).toordinal()
+        if day > ordinal:
+            break
+        cost += (data[date_str] - previous) * prices.price_on(day)
+        previous = data[date_str]
+    return cost
+
+def test_cost_through_matches_brute_force(hass):
+    data = _history(200)
+    index = HistoryIndex.from_data(data)
+    # Il primo cambio è successivo alla prima lettura: i giorni precedenti usano il primo prezzo noto.
+    points = [["2024-01-20", 0.22], ["2024-03-01", 0.18], ["2024-03-02", 0.3], ["2024-06-10", 0.25]]
+    overrides = {
+        (START + timedelta(days=40)).toordinal(): 0.4,
+        (START + timedelta(days=41)).toordinal(): 0.1,
+    }
+    for prices in (_prices(hass, points), _prices(hass, points, overrides), _prices(hass, [])):
+        for offset in range(-3, 205, 3):
+            ordinal = (START + timedelta(days=offset)).toordinal()
+            assert prices.cost_through(index, ordinal) == pytest.approx(_cost_brute_force(data, prices, ordinal))
+
+def test_first_difference(hass):
+    prices = _prices(hass, [["2024-01-01", 0.2], ["2024-03-01", 0.25]])
+    assert prices.first_difference([["2024-01-01", 0.2], ["2024-03-01", 0.25]]) is None
+    # Stessa funzione a gradini con un punto ridondante: nessuna differenza.
+    assert prices.first_difference([["2024-01-01", 0.2], ["2024-02-01", 0.2], ["2024-03-01", 0.25]]) is None
+    assert prices.first_difference([["2024-01-01", 0.2], ["2024-04-01", 0.25]]) == "2024-03-01"
+    assert prices.first_difference([["2024-01-01", 0.2]]) == "2024-03-01"
+    assert prices.first_difference([["2024-01-01", 0.21], ["2024-03-01", 0.25]]) == ""
+    assert prices.first_difference([]) == ""
+    assert _prices(hass, []).first_difference([]) is None
+    assert _prices(hass, []).first_difference(None) is None
+
+def test_same_day_changes_keep_one_point(run_hass):
+    async def test(hass):
+        prices = PriceHistory(hass)
+        day = date(2024, 5, 10)
+        assert prices.async_record(0.2, date(2024, 5, 1)) == "2024-05-01"
+        assert prices.async_record(0.3, day) == "2024-05-10"
+        assert prices.async_record(0.3, day) is None
+        # Correzione in giornata: l'ultimo prezzo registrato vale per l'intero giorno.
+        assert prices.async_record(0.28, day) == "2024-05-10"
+        await prices.async_close()
+        return prices.to_list()
+
+    assert run_hass(test) == [["2024-05-01", 0.2], ["2024-05-10", 0.28]]
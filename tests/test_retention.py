@@ -0,0 +1,87 @@
+"""
+Test della conservazione: un checkpoint per mese (l'ultima lettura del mese), costo invariato grazie ai prezzi
+effettivi anche dopo più compattazioni successive, e limite di conservazione mai più recente della finestra richiesta.
+"""
+
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from custom_components.octopus_energy_adapter.index import HistoryIndex
+from custom_components.octopus_energy_adapter.prices import PriceHistory
+from custom_components.octopus_energy_adapter.retention import monthly_checkpoints, retention_cutoff
+
+START = date(2023, 1, 10)
+
+def _history(days, seed=19):
+    rng = random.Random(seed)
+    data, total = {}, 0.0
+    for i in range(days):
+        day = START + timedelta(days=i)
+        # Marzo 2023 senza letture e una sola lettura a maggio 2023.
+        if day.month == 3 and day.year == 2023 or (day.year, day.month) == (2023, 5) and day.day != 20:
+            continue
+        total = round(total + rng.uniform(0, 12), 3)
+        if rng.random() > 0.1:
+            data[day.isoformat()] = total
+    return data
+
+def _prices(hass):
+    prices = PriceHistory(hass)
+    prices._set_points([["2023-01-01", 0.22], ["2023-02-14", 0.31], ["2023-07-01", 0.18], ["2024-01-15", 0.25]])
+    return prices
+
+def _compact(index, prices, cutoff):
+    keep, overrides = monthly_checkpoints(index, prices, cutoff)
+    index.drop_before(cutoff, keep)
+    # Come il coordinatore: i prezzi dei checkpoint già compattati restano validi.
+    prices.set_overrides({**prices._overrides, **overrides})
+    return keep, overrides
+
+def test_checkpoints_are_last_reading_of_each_month(hass):
+    data = _history(500)
+    index = HistoryIndex.from_data(data)
+    cutoff = date(2023, 9, 1)
+    keep, overrides = monthly_checkpoints(index, _prices(hass), cutoff)
+
+    months = {}
+    for date_str in sorted(data):
+        if date_str < cutoff.isoformat():
+            months[date_str[:7]] = date_str
+    assert sorted(keep) == sorted(date.fromisoformat(d).toordinal() for d in months.values())
+    assert "2023-03" not in months
+    # Il mese con una sola lettura non ha bisogno di un prezzo effettivo.
+    assert set(overrides) == keep - {date(2023, 5, 20).toordinal()}
+    assert monthly_checkpoints(index, _prices(hass), START) == (set(), {})
+
+def test_compaction_keeps_cost_and_cumulatives(hass):
+    data = _history(500)
+    index = HistoryIndex.from_data(data)
+    prices = _prices(hass)
+    last = date.fromisoformat(max(data)).toordinal()
+    cutoffs = (date(2023, 6, 1), date(2023, 11, 1), date(2024, 2, 1))
+    # Costo originale alla fine di ogni mese e all'ultimo giorno.
+    ends = [date(y, m, 1).toordinal() - 1 for y in (2023, 2024) for m in range(1, 13)] + [last]
+    expected = {ordinal: prices.cost_through(index, ordinal) for ordinal in ends}
+
+    for cutoff in cutoffs:
+        _compact(index, prices, cutoff)
+        assert index.last() == (max(data), data[max(data)])
+        # Anche la fine dei mesi compattati resta esatta: il checkpoint porta il costo dell'intero mese.
+        for ordinal, cost in expected.items():
+            assert prices.cost_through(index, ordinal) == pytest.approx(cost), date.fromordinal(ordinal)
+        # Checkpoint con il cumulativo originale, giorni recenti intatti.
+        for date_str, value in data.items():
+            if date_str >= cutoff.isoformat():
+                assert index.value_at(date.fromisoformat(date_str)) == value
+        for ordinal, value in index.records_between(1, cutoff.toordinal() - 1):
+            assert data[date.fromordinal(ordinal).isoformat()] == value
+
+def test_retention_cutoff():
+    assert retention_cutoff(date(2024, 3, 15), 12) == date(2023, 3, 1)
+    assert retention_cutoff(date(2024, 1, 31), 1) == date(2023, 12, 1)
+    assert retention_cutoff(date(2024, 12, 1), 0) == date(2024, 12, 1)
+    # La finestra minima sposta il limite indietro al mese che la contiene.
+    assert retention_cutoff(date(2024, 3, 15), 1, 400) == date(2023, 2, 1)
+    assert retention_cutoff(date(2024, 3, 15), 24, 400) == date(2022, 3, 1)
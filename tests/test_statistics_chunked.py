@@ -0,0 +1,109 @@
+"""
+Test dell'invio a blocchi mensili delle statistiche: suddivisione per mese, righe identiche all'invio in un'unica
+chiamata, avanzamento e contropressione sulla coda del Recorder (attesa dello svuotamento e limite di attesa).
+"""
+
+import asyncio
+from datetime import date, timedelta
+
+from custom_components.octopus_energy_adapter import statistics
+from custom_components.octopus_energy_adapter.statistics import (
+    RECORDER_BACKLOG_LIMIT,
+    iter_monthly_chunks,
+    push_bulk_statistics,
+    push_bulk_statistics_chunked,
+)
+
+START = date(2023, 11, 20)
+
+def _history(days):
+    return {(START + timedelta(days=i)).isoformat(): round(1.5 * (i + 1), 3) for i in range(days)}
+
+class Recorder:
+    """
+    Recorder fittizio: la coda scende di 'drain' elementi ad ogni controllo e ogni blocco inviato la riporta a 'burst'.
+    Registra la coda vista da ogni invio.
+    """
+
+    def __init__(self, burst, drain):
+        self.burst = burst
+        self.drain = drain
+        self._backlog = 0
+        self.polls = 0
+        self.sent = []
+
+    @property
+    def backlog(self):
+        self.polls += 1
+        value = self._backlog
+        self._backlog = max(0, self._backlog - self.drain)
+        return value
+
+    def add(self, hass, metadata, rows):
+        self.sent.append((metadata["statistic_id"], self._backlog, rows))
+        self._backlog = self.burst
+
+def _install(monkeypatch, recorder, poll=0.0, timeout=statistics.RECORDER_DRAIN_TIMEOUT):
+    monkeypatch.setattr(statistics, "async_add_external_statistics", recorder.add)
+    monkeypatch.setattr(statistics, "get_instance", lambda hass: recorder)
+    monkeypatch.setattr(statistics, "RECORDER_DRAIN_POLL", poll)
+    monkeypatch.setattr(statistics, "RECORDER_DRAIN_TIMEOUT", timeout)
+
+def test_monthly_chunks():
+    dates = sorted(_history(75))
+    chunks = list(iter_monthly_chunks(dates))
+    assert [chunk[0][:7] for chunk in chunks] == ["2023-11", "2023-12", "2024-01", "2024-02"]
+    assert all(len({d[:7] for d in chunk}) == 1 for chunk in chunks)
+    assert [d for chunk in chunks for d in chunk] == dates
+    assert list(iter_monthly_chunks([])) == []
+
+def test_chunked_rows_match_single_push(hass, monkeypatch):
+    data = _history(75)
+    recorder = Recorder(burst=0, drain=0)
+    _install(monkeypatch, recorder)
+    progress = []
+
+    end_chunked = asyncio.run(push_bulk_statistics_chunked(
+        hass, data, 0.25, progress_callback=lambda done, total: progress.append((done, total)), log_interval=0,
+    ))
+    chunked = [row for _, _, rows in recorder.sent for row in rows]
+    # Un invio per serie (energia e costo) per ogni mese.
+    assert len(recorder.sent) == 2 * 4
+    recorder.sent.clear()
+    end_single = asyncio.run(push_bulk_statistics(hass, data, 0.25))
+    single = [row for _, _, rows in recorder.sent for row in rows]
+
+    assert sorted(chunked, key=lambda r: (r["start"], r["sum"])) == sorted(single, key=lambda r: (r["start"], r["sum"]))
+    assert end_chunked == end_single
+    assert progress[-1] == (75, 75)
+    assert [done for done, _ in progress] == sorted(done for done, _ in progress)
+
+def test_chunked_from_date_continues_cost(hass, monkeypatch):
+    data = _history(75)
+    recorder = Recorder(burst=0, drain=0)
+    _install(monkeypatch, recorder)
+    asyncio.run(push_bulk_statistics_chunked(hass, data, 0.25, from_date="2024-01-10"))
+    energy_id, cost_id = statistics.statistic_ids()
+    days = sorted(d for d in data if d >= "2024-01-10")
+    energy = [row["sum"] for sid, _, rows in recorder.sent if sid == energy_id for row in rows]
+    cost = [row["sum"] for sid, _, rows in recorder.sent if sid == cost_id for row in rows]
+    assert energy == [data[d] for d in days]
+    assert cost == [round(data[d] * 0.25, 2) for d in days]
+
+def test_waits_for_recorder_backlog(hass, monkeypatch):
+    recorder = Recorder(burst=RECORDER_BACKLOG_LIMIT * 3, drain=4)
+    _install(monkeypatch, recorder)
+    asyncio.run(push_bulk_statistics_chunked(hass, _history(75), 0.25))
+    # Il primo blocco parte subito; i successivi solo con la coda sotto la soglia.
+    assert len(recorder.sent) == 8
+    backlog_at_chunk = [backlog for i, (_, backlog, _) in enumerate(recorder.sent) if i % 2 == 0]
+    assert all(backlog <= RECORDER_BACKLOG_LIMIT for backlog in backlog_at_chunk)
+    assert recorder.polls > len(backlog_at_chunk)
+
+def test_stuck_recorder_does_not_block_forever(hass, monkeypatch):
+    recorder = Recorder(burst=RECORDER_BACKLOG_LIMIT * 100, drain=0)
+    _install(monkeypatch, recorder, poll=0.001, timeout=0.005)
+    asyncio.run(push_bulk_statistics_chunked(hass, _history(75), 0.25))
+    # Attesa limitata per blocco: l'invio prosegue comunque fino alla fine.
+    assert len(recorder.sent) == 8
+    assert recorder.polls <= 4 * 7
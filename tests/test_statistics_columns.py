@@ -0,0 +1,68 @@
+"""
+Test della costruzione in blocco delle colonne statistiche: stesso risultato con NumPy e senza,
+e inizio delle righe (mezzanotte locale in UTC) corretto nei giorni di cambio dell'ora legale.
+"""
+
+import random
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from homeassistant.util import dt as dt_util
+
+from custom_components.octopus_energy_adapter import statistics
+from custom_components.octopus_energy_adapter.prices import PriceHistory
+from custom_components.octopus_energy_adapter.statistics import _build_statistics_columns
+
+def _history(start, days, seed=6):
+    rng = random.Random(seed)
+    data, total = {}, 0.0
+    for i in range(days):
+        total += rng.uniform(0, 15)
+        data[(start + timedelta(days=i)).isoformat()] = total
+    return data
+
+@pytest.fixture
+def rome(monkeypatch):
+    monkeypatch.setattr(dt_util, "DEFAULT_TIME_ZONE", dt_util.get_time_zone("Europe/Rome"))
+
+def test_numpy_and_pure_python_match(hass, monkeypatch):
+    pytest.importorskip("numpy")
+    data = _history(date(2024, 1, 1), 400)
+    # Righe non interpretabili e un valore negativo: scartate o segnalate allo stesso modo.
+    data["2024-02-30"] = 1.0
+    data["2024-03-05"] = "n/d"
+    data["2024-03-06"] = -2.0
+    prices = PriceHistory(hass)
+    prices._set_points([["2024-01-01", 0.21], ["2024-06-15", 0.18], ["2024-11-01", 0.25]])
+    dates = sorted(data)
+
+    for price in (prices, 0.3):
+        with_numpy = _build_statistics_columns(data, dates, price, 10.0, 2.5)
+        with monkeypatch.context() as patch:
+            patch.setattr(statistics, "np", None)
+            pure = _build_statistics_columns(data, dates, price, 10.0, 2.5)
+
+        assert with_numpy[0] == pure[0]
+        assert with_numpy[1] == pure[1]
+        assert with_numpy[2] == pure[2]
+        assert with_numpy[3] == pytest.approx(pure[3], abs=0.011)
+        assert with_numpy[4] == pure[4]
+        assert with_numpy[5] == pytest.approx(pure[5])
+        assert "2024-02-30" not in pure[0] and "2024-03-05" not in pure[0]
+        assert pure[4][pure[0].index("2024-03-06")]
+
+def test_dst_days_start_at_local_midnight(rome):
+    data = _history(date(2024, 3, 29), 5) | _history(date(2024, 10, 25), 5)
+    dates, starts, *_ = _build_statistics_columns(data, sorted(data), 0.2)
+    utc = {d: s for d, s in zip(dates, starts)}
+
+    # Ora legale dal 31 marzo: la mezzanotte del 31 è ancora +01:00, quella del 1° aprile +02:00.
+    assert utc["2024-03-31"] == datetime(2024, 3, 30, 23, tzinfo=timezone.utc)
+    assert utc["2024-04-01"] == datetime(2024, 3, 31, 22, tzinfo=timezone.utc)
+    assert utc["2024-04-01"] - utc["2024-03-31"] == timedelta(hours=23)
+    # Ritorno all'ora solare il 27 ottobre: giorno di 25 ore.
+    assert utc["2024-10-27"] == datetime(2024, 10, 26, 22, tzinfo=timezone.utc)
+    assert utc["2024-10-28"] - utc["2024-10-27"] == timedelta(hours=25)
+    for date_str, start in utc.items():
+        local = start.astimezone(dt_util.DEFAULT_TIME_ZONE)
+        assert (local.date().isoformat(), local.hour, local.minute) == (date_str, 0, 0)
@@ -0,0 +1,177 @@
+"""
+Test della sincronizzazione incrementale delle statistiche (StatisticsSync): sincronizzazione completa,
+riavvio senza modifiche, correzione di un mese passato, cambio di prezzo e nuovo giorno dal watermark.
+Le righe vengono raccolte al posto del Recorder e confrontate con energia e costo calcolati direttamente.
+"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from fakes import FakeRecorder
+
+from custom_components.octopus_energy_adapter import statistics
+from custom_components.octopus_energy_adapter.const import STORAGE_FORMAT_JOURNAL
+from custom_components.octopus_energy_adapter.prices import PriceHistory, save_prices_sync
+from custom_components.octopus_energy_adapter.statistics import StatisticsSync, statistic_ids
+from custom_components.octopus_energy_adapter.storage import OctopusHistory, save_data_sync
+
+ENTRY_ID = "test_entry"
+ENERGY_ID, COST_ID = statistic_ids(ENTRY_ID)
+START = date(2024, 1, 1)
+DAYS = 90
+PRICE = 0.2
+
+def _history():
+    data, total = {}, 0.0
+    for i in range(DAYS):
+        total = round(total + 1 + (i % 7) * 0.5, 3)
+        data[(START + timedelta(days=i)).isoformat()] = total
+    return data
+
+def _expected(data, price_on, since):
+    """Righe attese {giorno: (energia, costo)} dal giorno 'since', con il costo sommato giorno per giorno."""
+    rows, cost, previous = {}, 0.0, 0.0
+    for date_str in sorted(data):
+        cost += (data[date_str] - previous) * price_on(date_str)
+        previous = data[date_str]
+        if date_str >= since:
+            rows[date_str] = (round(data[date_str], 3), round(cost, 2))
+    return rows
+
+class Recorded:
+    """Sostituto di async_add_external_statistics: conserva le righe ricevute per statistic_id."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def __call__(self, hass, metadata, rows):
+        self.rows.setdefault(metadata["statistic_id"], []).extend(rows)
+
+    def sums(self, statistic_id):
+        # Fuso orario predefinito UTC: l'inizio della riga è la mezzanotte del giorno.
+        return {row["start"].date().isoformat(): row["sum"] for row in self.rows.get(statistic_id, [])}
+
+@pytest.fixture
+def recorded(monkeypatch):
+    recorded = Recorded()
+    monkeypatch.setattr(statistics, "async_add_external_statistics", recorded)
+    monkeypatch.setattr(statistics, "get_instance", lambda hass: FakeRecorder())
+    return recorded
+
+async def _open(hass):
+    """Storico e prezzi della entry come dopo un riavvio (solo il riepilogo) e sincronizzazione collegata."""
+    history = OctopusHistory(hass, ENTRY_ID, STORAGE_FORMAT_JOURNAL)
+    await history.async_load()
+    prices = PriceHistory(hass, ENTRY_ID)
+    await prices.async_load()
+    return history, prices, StatisticsSync(hass, ENTRY_ID, history, prices)
+
+async def _close(*stores):
+    for store in stores:
+        await store.async_close()
+
+async def _first_sync(hass, data):
+    save_data_sync(hass, data, ENTRY_ID)
+    save_prices_sync(hass, [[START.isoformat(), PRICE]], ENTRY_ID)
+    history, prices, sync = await _open(hass)
+    await sync.async_sync(history)
+    await _close(history, prices)
+
+def _assert_rows(recorded, expected):
+    energy, cost = recorded.sums(ENERGY_ID), recorded.sums(COST_ID)
+    assert sorted(energy) == sorted(cost) == sorted(expected)
+    for date_str, (kwh, eur) in expected.items():
+        assert energy[date_str] == kwh
+        assert cost[date_str] == pytest.approx(eur, abs=0.011)
+
+def test_full_sync_then_nothing_to_do_after_restart(run_hass, recorded):
+    data = _history()
+
+    async def test(hass):
+        await _first_sync(hass, data)
+        _assert_rows(recorded, _expected(data, lambda d: PRICE, ""))
+        recorded.rows.clear()
+
+        history, prices, sync = await _open(hass)
+        await sync.async_sync(history)
+        # Watermark allineato: nessun invio e nessun caricamento dello storico completo.
+        assert not recorded.rows
+        assert not history.loaded
+        await _close(history, prices)
+
+    run_hass(test)
+
+def test_correction_resends_from_start_of_month(run_hass, recorded):
+    data = _history()
+
+    async def test(hass):
+        await _first_sync(hass, data)
+        history, prices, sync = await _open(hass)
+        await history.async_ensure_loaded()
+        # Correzione non inviata (es. Home Assistant spento prima dell'invio): la trova la sincronizzazione successiva.
+        history.async_set_daily("2024-02-10", 50.0)
+        await _close(history, prices)
+        recorded.rows.clear()
+
+        history, prices, sync = await _open(hass)
+        await sync.async_sync(history)
+        await _close(history, prices)
+        return history.data
+
+    corrected = run_hass(test)
+    assert corrected["2024-02-10"] == round(data["2024-02-09"] + 50.0, 3)
+    _assert_rows(recorded, _expected(corrected, lambda d: PRICE, "2024-02-01"))
+
+def test_price_change_resends_only_cost(run_hass, recorded):
+    data = _history()
+    change = "2024-03-01"
+
+    async def test(hass):
+        await _first_sync(hass, data)
+        history, prices, sync = await _open(hass)
+        prices.async_record(0.3, date.fromisoformat(change))
+        await _close(history, prices)
+        recorded.rows.clear()
+
+        history, prices, sync = await _open(hass)
+        await sync.async_sync(history)
+        await _close(history, prices)
+
+    run_hass(test)
+    assert ENERGY_ID not in recorded.rows
+    expected = _expected(data, lambda d: 0.3 if d >= change else PRICE, change)
+    cost = recorded.sums(COST_ID)
+    assert sorted(cost) == sorted(expected)
+    for date_str, (_, eur) in expected.items():
+        assert cost[date_str] == pytest.approx(eur, abs=0.011)
+
+def test_new_day_continues_from_watermark_state(run_hass, recorded):
+    data = _history()
+    new_day = (START + timedelta(days=DAYS)).isoformat()
+
+    async def test(hass):
+        await _first_sync(hass, data)
+        recorded.rows.clear()
+
+        history, prices, sync = await _open(hass)
+        await sync.async_sync(history)
+        await history.async_ensure_writable(new_day)
+        history.async_set_daily(new_day, 4.0)
+        await sync.async_push_day(new_day, history.value_of(new_day), checksum=history.checksum)
+        # Costo proseguito dallo stato del watermark: nessuna somma dal primo giorno, nessun caricamento completo.
+        assert not history.loaded
+        await _close(history, prices)
+        pushed = Recorded()
+        pushed.rows, recorded.rows = recorded.rows, {}
+
+        # Il watermark aggiornato dal nuovo giorno copre tutto: il riavvio successivo non invia nulla.
+        history, prices, sync = await _open(hass)
+        await sync.async_sync(history)
+        await _close(history, prices)
+        assert not recorded.rows
+        return pushed
+
+    pushed = run_hass(test)
+    data[new_day] = round(data[max(data)] + 4.0, 3)
+    _assert_rows(pushed, _expected(data, lambda d: PRICE, new_day))
@@ -0,0 +1,105 @@
+"""
+Test del formato binario: aggiornamento sul posto e accodatura, rifiuto degli inserimenti in mezzo al file,
+record troncato da un crash, conversione JSON ↔ binario e caricamento dalle colonne mappate.
+"""
+
+import json
+import os
+
+from custom_components.octopus_energy_adapter.const import STORAGE_FORMAT_BINARY, STORAGE_FORMAT_JOURNAL
+from custom_components.octopus_energy_adapter.storage import (
+    BINARY_FILE,
+    BINARY_HEADER,
+    BINARY_RECORD,
+    OctopusHistory,
+    append_binary_sync,
+    binary_to_json_sync,
+    entry_path,
+    history_checksum,
+    json_to_binary_sync,
+    load_history_sync,
+    read_binary_file_sync,
+    save_binary_sync,
+)
+
+ENTRY_ID = "test_entry"
+DATA = {"2024-01-01": 1.5, "2024-01-02": 3.25, "2024-01-04": 7.0, "2024-01-05": 9.125}
+
+def _path(hass):
+    return entry_path(hass, BINARY_FILE, ENTRY_ID)
+
+def _records(hass):
+    return (os.path.getsize(_path(hass)) - BINARY_HEADER.size) // BINARY_RECORD.size
+
+def test_update_in_place_and_append(hass):
+    assert save_binary_sync(hass, DATA, ENTRY_ID)
+    # Cumulativi ricalcolati dopo una correzione (giorni già presenti) più un giorno nuovo.
+    entries = [("2024-01-02", 3.5), ("2024-01-05", 9.375), ("2024-01-06", 11.0)]
+    assert append_binary_sync(hass, entries, ENTRY_ID)
+    assert read_binary_file_sync(_path(hass)) == {**DATA, **dict(entries)}
+    assert _records(hass) == len(DATA) + 1
+
+def test_insert_in_the_middle_needs_full_rewrite(hass):
+    assert save_binary_sync(hass, DATA, ENTRY_ID)
+    with open(_path(hass), "rb") as f:
+        before = f.read()
+    # Il 3 gennaio non è nel file: nessun record viene scritto, nemmeno quelli che si potrebbero aggiornare.
+    assert not append_binary_sync(hass, [("2024-01-02", 4.0), ("2024-01-03", 5.0), ("2024-01-07", 12.0)], ENTRY_ID)
+    with open(_path(hass), "rb") as f:
+        assert f.read() == before
+    assert not append_binary_sync(hass, [("2024-01-07", 12.0)], "missing_entry")
+
+def test_truncated_record_is_dropped_before_append(hass):
+    assert save_binary_sync(hass, DATA, ENTRY_ID)
+    with open(_path(hass), "ab") as f:
+        f.write(BINARY_RECORD.pack(739000, 1.0)[:5])
+    assert read_binary_file_sync(_path(hass)) == DATA
+    assert append_binary_sync(hass, [("2024-01-06", 10.0)], ENTRY_ID)
+    assert read_binary_file_sync(_path(hass)) == {**DATA, "2024-01-06": 10.0}
+    assert os.path.getsize(_path(hass)) == BINARY_HEADER.size + 5 * BINARY_RECORD.size
+
+def test_json_binary_round_trip(tmp_path):
+    data = {f"2024-{m:02d}-{d:02d}": round(m * 100 + d / 3, 6) for m in range(1, 13) for d in range(1, 29)}
+    json_path, bin_path, back_path = tmp_path / "in.json", tmp_path / "storico.bin", tmp_path / "out.json"
+    json_path.write_text(json.dumps(data), encoding="utf-8")
+
+    assert json_to_binary_sync(str(json_path), str(bin_path)) == len(data)
+    assert binary_to_json_sync(str(bin_path), str(back_path)) == len(data)
+    # Senza perdita: float64 e date ordinali intere.
+    assert json.loads(back_path.read_text(encoding="utf-8")) == data
+
+def test_load_history_keeps_binary_columns(hass):
+    assert save_binary_sync(hass, DATA, ENTRY_ID)
+    data, index, lines, mapped, rewrite = load_history_sync(hass, STORAGE_FORMAT_BINARY, ENTRY_ID)
+    try:
+        # Nessun dizionario: indice e impronta leggono direttamente i record mappati.
+        assert data is None
+        assert (lines, rewrite) == (0, False)
+        assert index.last() == ("2024-01-05", 9.125)
+        assert history_checksum(mapped) == history_checksum(DATA)
+    finally:
+        mapped.close()
+
+    # Formato journal configurato su un file binario: va riscritto per intero.
+    loaded = load_history_sync(hass, STORAGE_FORMAT_JOURNAL, ENTRY_ID)
+    loaded[3].close()
+    assert loaded[4]
+
+def test_history_builds_dict_only_on_demand(run_hass):
+    async def test(hass):
+        assert save_binary_sync(hass, DATA, ENTRY_ID)
+        # Nessun riepilogo: l'impronta viene calcolata dai record mappati.
+        history = OctopusHistory(hass, ENTRY_ID, STORAGE_FORMAT_BINARY)
+        await history.async_load()
+        await history.async_ensure_loaded()
+        assert history._data is None
+        assert history.checksum == history_checksum(DATA)
+        assert history.has_date("2024-01-04") and not history.has_date("2024-01-03")
+
+        history.async_add_day("2024-01-06", 10.0)
+        assert history._data is None
+        assert history.data == {**DATA, "2024-01-06": 10.0}
+        await history.async_close()
+        return read_binary_file_sync(_path(hass))
+
+    assert run_hass(test) == {**DATA, "2024-01-06": 10.0}
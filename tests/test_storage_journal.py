@@ -0,0 +1,70 @@
+"""Test del formato Journal: righe accodate, riga troncata da un crash e compattazione nello snapshot."""
+
+import json
+import os
+
+from custom_components.octopus_energy_adapter.const import STORAGE_FORMAT_BINARY, STORAGE_FORMAT_JOURNAL
+from custom_components.octopus_energy_adapter.storage import (
+    JOURNAL_FILE,
+    STORAGE_FILE,
+    append_journal_sync,
+    compact_journal_sync,
+    entry_path,
+    load_history_sync,
+    load_journal_sync,
+    save_data_sync,
+)
+
+ENTRY_ID = "test_entry"
+
+def test_journal_replays_on_top_of_snapshot(hass):
+    assert save_data_sync(hass, {"2024-01-01": 1.0, "2024-01-02": 2.0}, ENTRY_ID)
+    assert append_journal_sync(hass, [("2024-01-03", 3.0), ("2024-01-02", 2.5)], ENTRY_ID)
+    assert append_journal_sync(hass, [("2024-01-04", 4.0)], ENTRY_ID, check_tail=False)
+
+    data, lines = load_journal_sync(hass, ENTRY_ID)
+    assert lines == 3
+    # L'ultima riga del journal vince sullo snapshot.
+    assert data == {"2024-01-01": 1.0, "2024-01-02": 2.5, "2024-01-03": 3.0, "2024-01-04": 4.0}
+
+def test_truncated_line_is_skipped_and_closed(hass):
+    assert append_journal_sync(hass, [("2024-01-01", 1.0)], ENTRY_ID)
+    # Crash durante la scrittura: l'ultima riga resta a metà, senza a capo.
+    with open(entry_path(hass, JOURNAL_FILE, ENTRY_ID), "a", encoding="utf-8") as f:
+        f.write('["2024-01-02", 2.')
+    assert load_journal_sync(hass, ENTRY_ID) == ({"2024-01-01": 1.0}, 1)
+
+    # La riga successiva non si incolla a quella troncata.
+    assert append_journal_sync(hass, [("2024-01-03", 3.0)], ENTRY_ID)
+    assert load_journal_sync(hass, ENTRY_ID) == ({"2024-01-01": 1.0, "2024-01-03": 3.0}, 2)
+
+def test_compaction_writes_snapshot_then_removes_journal(hass):
+    assert save_data_sync(hass, {"2024-01-01": 1.0}, ENTRY_ID)
+    assert append_journal_sync(hass, [("2024-01-02", 2.0), ("2024-01-03", 3.0)], ENTRY_ID)
+    data, _ = load_journal_sync(hass, ENTRY_ID)
+
+    assert compact_journal_sync(hass, data, ENTRY_ID)
+    assert not os.path.exists(entry_path(hass, JOURNAL_FILE, ENTRY_ID))
+    with open(entry_path(hass, STORAGE_FILE, ENTRY_ID), encoding="utf-8") as f:
+        assert json.load(f) == data
+    assert load_journal_sync(hass, ENTRY_ID) == (data, 0)
+
+def test_failed_compaction_keeps_journal(hass, monkeypatch):
+    from custom_components.octopus_energy_adapter import storage
+
+    assert append_journal_sync(hass, [("2024-01-01", 1.0)], ENTRY_ID)
+    monkeypatch.setattr(storage, "save_data_sync", lambda *args: False)
+    assert not compact_journal_sync(hass, {"2024-01-01": 1.0}, ENTRY_ID)
+    assert os.path.exists(entry_path(hass, JOURNAL_FILE, ENTRY_ID))
+
+def test_load_history_from_journal(hass):
+    assert save_data_sync(hass, {"2024-01-01": 1.0}, ENTRY_ID)
+    assert append_journal_sync(hass, [("2024-01-02", 2.0)], ENTRY_ID)
+
+    data, index, lines, mapped, rewrite = load_history_sync(hass, STORAGE_FORMAT_JOURNAL, ENTRY_ID)
+    assert data == {"2024-01-01": 1.0, "2024-01-02": 2.0}
+    assert (lines, mapped, rewrite) == (1, None, False)
+    assert index.last() == ("2024-01-02", 2.0)
+
+    # Formato binario configurato su uno storico JSON: va riscritto per intero.
+    assert load_history_sync(hass, STORAGE_FORMAT_BINARY, ENTRY_ID)[4]
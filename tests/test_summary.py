@@ -0,0 +1,117 @@
+"""
+Test del riepilogo dello storico: riconoscimento dei file modificati dopo il salvataggio, indice parziale esatto
+per le interrogazioni dei sensori, impronta incrementale e riepilogo ricreato quando non corrisponde ai dati.
+"""
+
+import json
+import random
+from datetime import date, timedelta
+
+from custom_components.octopus_energy_adapter.const import STORAGE_FORMAT_JOURNAL
+from custom_components.octopus_energy_adapter.index import HistoryIndex
+from custom_components.octopus_energy_adapter.storage import (
+    SUMMARY_FILE,
+    SUMMARY_TAIL_DAYS,
+    OctopusHistory,
+    append_journal_sync,
+    build_summary,
+    entry_path,
+    history_checksum,
+    load_summary_sync,
+    record_hash,
+    save_data_sync,
+    save_summary_sync,
+    summary_index,
+)
+
+ENTRY_ID = "test_entry"
+START = date(2022, 5, 17)
+LAST = START + timedelta(days=799)
+
+def _history(seed=8):
+    rng = random.Random(seed)
+    data, total = {}, 0.0
+    for i in range(800):
+        total = round(total + rng.uniform(0, 12), 3)
+        if rng.random() > 0.1 or i in (0, 799):
+            data[(START + timedelta(days=i)).isoformat()] = total
+    return data
+
+def _saved_summary(hass, data):
+    save_data_sync(hass, data, ENTRY_ID)
+    index = HistoryIndex.from_data(data)
+    save_summary_sync(hass, build_summary(index, history_checksum(data), STORAGE_FORMAT_JOURNAL), ENTRY_ID)
+    return load_summary_sync(hass, ENTRY_ID)
+
+def test_summary_is_stale_after_files_change(hass):
+    data = _history()
+    summary = _saved_summary(hass, data)
+    assert summary is not None and "stale" not in summary
+    assert summary["count"] == len(data)
+    assert int(summary["checksum"], 16) == history_checksum(data)
+
+    # Una lettura scritta senza aggiornare il riepilogo (es. crash tra le due scritture).
+    append_journal_sync(hass, [((LAST + timedelta(days=1)).isoformat(), 1e6)], ENTRY_ID)
+    assert load_summary_sync(hass, ENTRY_ID) is None
+    assert load_summary_sync(hass, ENTRY_ID, allow_stale=True)["stale"]
+
+def test_unreadable_or_old_summary_is_ignored(hass):
+    _saved_summary(hass, _history())
+    path = entry_path(hass, SUMMARY_FILE, ENTRY_ID)
+    with open(path, encoding="utf-8") as f:
+        summary = json.load(f)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(dict(summary, version=0), f)
+    assert load_summary_sync(hass, ENTRY_ID, allow_stale=True) is None
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{")
+    assert load_summary_sync(hass, ENTRY_ID, allow_stale=True) is None
+
+def test_summary_index_answers_sensor_queries(hass):
+    data = _history()
+    full = HistoryIndex.from_data(data)
+    partial = summary_index(_saved_summary(hass, data))
+    assert len(partial) < len(full)
+    assert partial.first() == full.first()
+    assert partial.last() == full.last()
+
+    # Ultimi giorni, aperture dei mesi e stesso periodo dell'anno precedente: cumulativi esatti.
+    days = [LAST - timedelta(days=i) for i in range(SUMMARY_TAIL_DAYS)]
+    days += [LAST - timedelta(days=365 + i) for i in range(-SUMMARY_TAIL_DAYS + 1, 3)]
+    month = START.replace(day=1)
+    while month <= LAST:
+        days.append(month - timedelta(days=1))
+        month = (month + timedelta(days=32)).replace(day=1)
+    for day in days + [START - timedelta(days=1)]:
+        assert partial.value_at(day) == full.value_at(day), day
+    for i in range(1, SUMMARY_TAIL_DAYS):
+        day = LAST - timedelta(days=i)
+        assert partial.day_value(day) == full.day_value(day)
+
+def test_checksum_is_order_independent_and_incremental():
+    data = _history()
+    checksum = history_checksum(data)
+    assert history_checksum(dict(reversed(list(data.items())))) == checksum
+
+    day, new_value = min(data), 0.5
+    updated = (checksum - record_hash(day, data[day]) + record_hash(day, new_value)) & 0xFFFFFFFFFFFFFFFF
+    assert history_checksum({**data, day: new_value}) == updated
+    # Anche una differenza oltre la terza cifra decimale cambia l'impronta.
+    assert history_checksum({**data, day: data[day] + 1e-9}) != checksum
+
+def test_wrong_checksum_rebuilds_summary(run_hass):
+    data = _history()
+
+    async def test(hass):
+        save_data_sync(hass, data, ENTRY_ID)
+        # Riepilogo allineato ai file ma con un'impronta sbagliata (es. scritto da una versione con un errore).
+        save_summary_sync(hass, build_summary(HistoryIndex.from_data(data), 12345, STORAGE_FORMAT_JOURNAL), ENTRY_ID)
+        history = OctopusHistory(hass, ENTRY_ID, STORAGE_FORMAT_JOURNAL)
+        await history.async_load()
+        assert not history.stale and history.checksum == 12345
+        await history.async_ensure_loaded()
+        assert history.checksum == history_checksum(data)
+        await history.async_close()
+        return load_summary_sync(hass, ENTRY_ID)
+
+    assert int(run_hass(test)["checksum"], 16) == history_checksum(data)